@@ -0,0 +1,67 @@
+"""测量首页的单次请求耗时和内存分配
+
+在临时目录中生成指定数量的PDF文件作为上传目录，通过Flask测试客户端
+反复请求首页，输出耗时分位数和每次请求的内存分配峰值。
+
+    python benchmarks/index_page.py --files 20000 --requests 200
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=20000, help='上传目录中的PDF文件数')
+    parser.add_argument('--requests', type=int, default=200, help='计时的请求次数')
+    args = parser.parse_args()
+
+    import server
+
+    with tempfile.TemporaryDirectory(prefix='index-bench-') as folder:
+        for i in range(args.files):
+            with open(os.path.join(folder, f"{i:08d}_scan.pdf"), 'wb') as f:
+                f.write(b'%PDF-1.4\n')
+        server.app.config['UPLOAD_FOLDER'] = folder
+        client = server.app.test_client()
+
+        # 预热：建立索引、编译模板
+        client.get('/')
+
+        latencies = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            response = client.get('/')
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200
+
+        tracemalloc.start()
+        peaks = []
+        for _ in range(min(args.requests, 20)):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            client.get('/')
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+
+    latencies.sort()
+    result = {
+        'files': args.files,
+        'requests': args.requests,
+        'response_bytes': len(response.data),
+        'p50_ms': round(statistics.median(latencies) * 1000, 3),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+        'peak_alloc_kb': round(statistics.median(peaks) / 1024, 1),
+    }
+    print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
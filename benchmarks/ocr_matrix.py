@@ -0,0 +1,360 @@
+"""在OCR选项矩阵上端到端测量处理性能
+
+用Pillow在本地生成固定的合成语料（英文和简体中文文本页，不同DPI，
+可选倾斜和噪点），通过Flask测试客户端上传、等待任务完成并下载结果，
+对每组选项输出处理速度（页/秒）、延迟中位数和99分位、服务进程及其子进程的
+内存峰值和输出文件大小，结果写入JSON文件便于比较两次运行。
+
+    python benchmarks/ocr_matrix.py --output before.json
+    python benchmarks/ocr_matrix.py --output after.json --baseline before.json
+
+默认每次只改变一个选项（以 optimize_level=1、其余选项关闭为基准），
+--full 测量全部组合。语料由 --seed 决定，相同参数生成的文件逐字节相同。
+"""
+import argparse
+import hashlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image, ImageDraw, ImageFont
+
+ENGLISH_WORDS = (
+    "the quick brown fox jumps over lazy dog invoice total amount due payment account "
+    "report quarterly revenue increased compared with previous year customer service "
+    "shipping address order number date signature page section summary analysis result"
+).split()
+CHINESE_PHRASES = (
+    "发票 合计 金额 付款 账户 季度 报告 收入 同比 增长 客户 服务 地址 订单 编号 日期 签名 "
+    "页面 章节 摘要 分析 结果 合同 甲方 乙方 条款 说明 数量 单价 备注 审核 批准 部门 项目"
+).split()
+
+# 常见的中文字体位置，找不到时需要通过 --cjk-font 指定
+CJK_FONT_CANDIDATES = (
+    '/usr/share/fonts/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/wenquanyi/wqy-zenhei/wqy-zenhei.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',
+    '/System/Library/Fonts/PingFang.ttc',
+)
+LATIN_FONT_CANDIDATES = (
+    '/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSerif.ttf',
+    '/usr/share/fonts/ttf-dejavu/DejaVuSerif.ttf',
+)
+
+# 单独改变的选项，基准为 optimize_level=1、其余关闭
+MATRIX_FLAGS = ('deskew', 'rotate_pages', 'remove_background', 'force_ocr')
+OPTIMIZE_LEVELS = (0, 1, 2, 3)
+
+
+def find_font(path, candidates):
+    if path:
+        return path
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def render_page(rng, language, dpi, font_path, skew, noise, lines=None):
+    """渲染一页A4文本图像，lines 不为None时追加每行的文本"""
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    image = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.truetype(font_path, size=max(8, dpi // 6))
+    margin = dpi
+    line_height = int(font.size * 1.6)
+    y = margin
+    while y < height - margin - line_height:
+        if language == 'chi_sim':
+            text = ''.join(rng.choice(CHINESE_PHRASES) for _ in range(12))
+        else:
+            text = ' '.join(rng.choice(ENGLISH_WORDS) for _ in range(10))
+        draw.text((margin, y), text, fill=0, font=font)
+        if lines is not None:
+            lines.append(text)
+        y += line_height
+    if noise:
+        # 固定种子的随机噪点，模拟扫描件上的污点
+        for _ in range(width * height // 2000):
+            x, y = rng.randrange(width), rng.randrange(height)
+            radius = rng.choice((0, 0, 1, 2))
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=rng.randrange(0, 160))
+    if skew:
+        image = image.rotate(skew, resample=Image.BICUBIC, fillcolor=255)
+    return image
+
+
+def build_corpus(folder, seed, pages, dpis, latin_font, cjk_font):
+    """生成合成语料，返回文档描述列表"""
+    documents = []
+    languages = [('eng', latin_font), ('chi_sim', cjk_font)]
+    for language, font_path in languages:
+        if font_path is None:
+            print(f"未找到 {language} 字体，跳过该语言（可用 --cjk-font 指定）", file=sys.stderr)
+            continue
+        for dpi in dpis:
+            for variant, skew, noise in (('clean', 0, False), ('scanned', 2.5, True)):
+                name = f"{language}_{dpi}dpi_{variant}.pdf"
+                rng = random.Random(f"{seed}:{name}")
+                images = [render_page(rng, language, dpi, font_path, skew, noise) for _ in range(pages)]
+                buffer = io.BytesIO()
+                images[0].save(buffer, 'PDF', resolution=dpi, save_all=True, append_images=images[1:])
+                data = buffer.getvalue()
+                with open(os.path.join(folder, name), 'wb') as f:
+                    f.write(data)
+                documents.append({
+                    'name': name, 'language': language, 'dpi': dpi, 'variant': variant,
+                    'pages': pages, 'bytes': len(data), 'sha256': hashlib.sha256(data).hexdigest(),
+                })
+    return documents
+
+
+def option_matrix(full):
+    """返回 (名称, 选项) 列表"""
+    if full:
+        combos = []
+        for level in OPTIMIZE_LEVELS:
+            for values in itertools.product((False, True), repeat=len(MATRIX_FLAGS)):
+                flags = dict(zip(MATRIX_FLAGS, values))
+                label = '+'.join([f"O{level}"] + [flag for flag, on in flags.items() if on])
+                combos.append((label, dict(flags, optimize_level=level)))
+        return combos
+    combos = [(f"O{level}", {'optimize_level': level}) for level in OPTIMIZE_LEVELS]
+    combos += [(f"O1+{flag}", {'optimize_level': 1, flag: True}) for flag in MATRIX_FLAGS]
+    return combos
+
+
+class TreeRssSampler:
+    """定期汇总本进程及全部子孙进程的常驻内存，记录峰值"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _tree_rss():
+        root = os.getpid()
+        parents, rss = {}, {}
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                parents[int(entry)] = int(fields[1])
+                rss[int(entry)] = int(fields[21]) * page_size
+            except (OSError, IndexError, ValueError):
+                continue
+        total = 0
+        for pid in rss:
+            current = pid
+            while current and current != root:
+                current = parents.get(current)
+            if current == root:
+                total += rss[pid]
+        return total
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._tree_rss())
+
+    def __enter__(self):
+        self.peak = self._tree_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_document(client, server, path, options, timeout):
+    """上传一个文档并等待完成，返回 (耗时秒数, 输出字节数, 内存峰值)，失败时输出字节数为None"""
+    form = {'language': options['language'], 'optimize_level': str(options['optimize_level']),
+            'ocr_enabled': 'true'}
+    form.update({flag: 'true' for flag in MATRIX_FLAGS if options.get(flag)})
+    with open(path, 'rb') as f:
+        data = f.read()
+    # 每次都重新处理，不使用上一轮的结果缓存（任务库中的结果也以输出文件存在为准）
+    with server.jobs_lock:
+        server.result_cache.clear()
+    upload_dir = server.app.config['UPLOAD_FOLDER']
+    for name in os.listdir(upload_dir):
+        if name.endswith('_ocr.pdf'):
+            os.remove(os.path.join(upload_dir, name))
+    with TreeRssSampler() as sampler:
+        start = time.perf_counter()
+        response = client.post('/upload', data=dict(form, pdf_file=(io.BytesIO(data), os.path.basename(path))))
+        if response.status_code != 303:
+            raise RuntimeError(f"上传失败: {response.status_code} {response.get_data(as_text=True)}")
+        job_url = response.headers['Location']
+        deadline = time.monotonic() + timeout
+        while True:
+            status = client.get(job_url, query_string={'format': 'json'}).get_json()
+            if status['state'] in ('done', 'failed') or time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+    if status['state'] != 'done':
+        return elapsed, None, sampler.peak
+    result = client.get(status['result_url'])
+    return elapsed, len(result.data), sampler.peak
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def tool_version(command):
+    try:
+        output = subprocess.run(command, capture_output=True, text=True, timeout=30)
+        return (output.stdout or output.stderr).strip().splitlines()[0]
+    except (OSError, IndexError, subprocess.SubprocessError):
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path):
+    """与上一次结果比较处理速度"""
+    with open(baseline_path) as f:
+        baseline = {(r['label'], r['language']): r for r in json.load(f)['results']}
+    for result in results:
+        old = baseline.get((result['label'], result['language']))
+        if not old or not old['pages_per_second'] or not result['pages_per_second']:
+            continue
+        change = result['pages_per_second'] / old['pages_per_second'] - 1
+        print(f"{result['language']:8} {result['label']:40} {old['pages_per_second']:8.3f} -> "
+              f"{result['pages_per_second']:8.3f} 页/秒 ({change:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default='ocr_matrix.json', help='结果JSON文件')
+    parser.add_argument('--baseline', help='与之比较的上一次结果JSON文件')
+    parser.add_argument('--seed', default='ocr-matrix-v1', help='语料随机种子')
+    parser.add_argument('--pages', type=int, default=3, help='每个文档的页数')
+    parser.add_argument('--dpi', type=int, action='append', help='页面分辨率，可重复，默认150和300')
+    parser.add_argument('--repeat', type=int, default=1, help='每个文档和选项组合的重复次数')
+    parser.add_argument('--full', action='store_true', help='测量全部选项组合，而不是每次只改变一个选项')
+    parser.add_argument('--font', help='英文字体文件')
+    parser.add_argument('--cjk-font', help='中文字体文件')
+    parser.add_argument('--timeout', type=int, default=1800, help='单个文档的超时秒数')
+    parser.add_argument('--page-cache', action='store_true', help='启用页面OCR缓存（默认关闭以测量实际识别耗时）')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='ocr-matrix-')
+    try:
+        run_matrix(args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_matrix(args, work_dir):
+    corpus_dir = os.path.join(work_dir, 'corpus')
+    upload_dir = os.path.join(work_dir, 'uploads')
+    os.makedirs(corpus_dir)
+    os.makedirs(upload_dir)
+
+    # 任务逐个执行，避免相互影响；环境变量需要在导入server之前设置
+    os.environ['OCR_WORKERS'] = '1'
+    os.environ.setdefault('OCR_MAX_QUEUE', '0')
+    os.environ['OCR_PAGE_CACHE_MB'] = '1024' if args.page_cache else '0'
+    import server
+    server.app.config['UPLOAD_FOLDER'] = upload_dir
+    server.retention.folder = upload_dir
+    client = server.app.test_client()
+
+    latin_font = find_font(args.font, LATIN_FONT_CANDIDATES)
+    cjk_font = find_font(args.cjk_font, CJK_FONT_CANDIDATES)
+    documents = build_corpus(corpus_dir, args.seed, args.pages, args.dpi or [150, 300], latin_font, cjk_font)
+    if not documents:
+        sys.exit("没有可用的字体，无法生成语料")
+
+    results = []
+    for label, options in option_matrix(args.full):
+        for language in sorted({doc['language'] for doc in documents}):
+            latencies, output_ratios, peaks = [], [], []
+            output_bytes, pages, failures = 0, 0, 0
+            for doc in (d for d in documents if d['language'] == language):
+                for _ in range(args.repeat):
+                    elapsed, size, peak = run_document(client, server, os.path.join(corpus_dir, doc['name']),
+                                                       dict(options, language=language), args.timeout)
+                    peaks.append(peak)
+                    if size is None:
+                        failures += 1
+                        continue
+                    latencies.append(elapsed)
+                    output_bytes += size
+                    output_ratios.append(size / doc['bytes'])
+                    pages += doc['pages']
+            total = sum(latencies)
+            result = {
+                'label': label,
+                'language': language,
+                'options': options,
+                'runs': len(latencies),
+                'failures': failures,
+                'pages': pages,
+                'pages_per_second': round(pages / total, 4) if total else None,
+                'p50_s': round(statistics.median(latencies), 3) if latencies else None,
+                'p99_s': round(percentile(latencies, 0.99), 3) if latencies else None,
+                'peak_rss_mb': round(max(peaks) / (1024 * 1024), 1) if peaks else None,
+                'output_bytes': output_bytes,
+                'output_ratio_avg': round(statistics.mean(output_ratios), 4) if output_ratios else None,
+            }
+            results.append(result)
+            print(f"{language:8} {label:40} {result['pages_per_second'] or 0:8.3f} 页/秒  "
+                  f"p50 {result['p50_s'] or 0:7.2f}s  p99 {result['p99_s'] or 0:7.2f}s  "
+                  f"内存 {result['peak_rss_mb'] or 0:7.1f} MB  失败 {failures}", flush=True)
+
+    report = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'engine': server.app.config['OCR_ENGINE'],
+            'ocrmypdf': tool_version(['ocrmypdf', '--version']),
+            'tesseract': tool_version(['tesseract', '--version']),
+            'args': vars(args),
+        },
+        'corpus': documents,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""对比快速预处理（preprocess插件）与ocrmypdf内置的倾斜校正、去除背景
+
+生成带随机倾斜、噪点和不均匀背景（阴影、污渍）的合成扫描件，记录每页的真实
+文本和倾斜角度，分两部分测量：
+
+* 预处理阶段：逐页测量插件的倾斜估计误差和耗时，以及拉平背景和二值化的耗时；
+* 端到端：用 server.build_ocrmypdf_cmd 构建的命令以几组选项分别运行ocrmypdf，
+  输出处理速度（页/秒）和识别文本相对真实文本的字符错误率（CER）。
+
+    python benchmarks/preprocess_stage.py --output preprocess.json
+    python benchmarks/preprocess_stage.py --stage-only
+
+语料由 --seed 决定。中文语料需要CJK字体，找不到时通过 --cjk-font 指定。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+from PIL import Image
+
+from ocr_matrix import (CJK_FONT_CANDIDATES, LATIN_FONT_CANDIDATES, find_font, git_commit, percentile,
+                        render_page, tool_version)
+
+# (名称, 选项)，前三组为ocrmypdf内置的处理
+CONFIGS = (
+    ('none', {}),
+    ('deskew', {'deskew': True}),
+    ('deskew+remove_background', {'deskew': True, 'remove_background': True}),
+    ('fast:deskew', {'deskew': True, 'fast_preprocess': True}),
+    ('fast:deskew+remove_background', {'deskew': True, 'remove_background': True, 'fast_preprocess': True}),
+)
+MAX_SKEW = 5.0
+
+
+def degrade(image, rng):
+    """模拟扫描件：文字变灰，叠加从一侧变暗的阴影和几块污渍"""
+    pixels = np.asarray(image, dtype=np.float32)
+    height, width = pixels.shape
+    ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+    side = rng.choice((xs / width, 1 - xs / width, ys / height, 1 - ys / height))
+    shade = 0.55 + 0.45 * side
+    for _ in range(rng.randrange(1, 4)):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        radius = rng.uniform(0.05, 0.2) * width
+        shade *= 1 - rng.uniform(0.2, 0.4) * np.exp(-((xs - cx) ** 2 + (ys - cy) ** 2) / (2 * radius ** 2))
+    pixels = (30 + pixels * (225 / 255)) * shade
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'L')
+
+
+def build_corpus(folder, seed, pages, dpi, latin_font, cjk_font):
+    """生成合成语料，返回文档描述列表，每页包含真实文本和倾斜角度"""
+    documents = []
+    for language, font_path in (('eng', latin_font), ('chi_sim', cjk_font)):
+        if font_path is None:
+            print(f"未找到 {language} 字体，跳过该语言（可用 --cjk-font 指定）", file=sys.stderr)
+            continue
+        name = f"{language}_{dpi}dpi_degraded.pdf"
+        rng = random.Random(f"{seed}:{name}")
+        images, truth = [], []
+        for _ in range(pages):
+            lines = []
+            skew = round(rng.uniform(-MAX_SKEW, MAX_SKEW), 2)
+            image = degrade(render_page(rng, language, dpi, font_path, skew, True, lines), rng)
+            image.info['dpi'] = (dpi, dpi)
+            images.append(image)
+            truth.append({'skew': skew, 'text': '\n'.join(lines)})
+        path = os.path.join(folder, name)
+        images[0].save(path, 'PDF', resolution=dpi, save_all=True, append_images=images[1:])
+        documents.append({'name': name, 'path': path, 'language': language, 'dpi': dpi,
+                          'images': images, 'pages': truth})
+    return documents
+
+
+def normalize_text(text, language):
+    """英文合并空白，中文去掉所有空白（tesseract在汉字之间输出空格）"""
+    if language == 'eng':
+        return ' '.join(text.split())
+    return ''.join(text.split())
+
+
+def edit_distance(a, b):
+    """Levenshtein距离，每行的插入链用累积最小值一次算出"""
+    if not a or not b:
+        return max(len(a), len(b))
+    source = np.frombuffer(a.encode('utf-32-le'), dtype=np.uint32)
+    target = np.frombuffer(b.encode('utf-32-le'), dtype=np.uint32)
+    offsets = np.arange(len(b) + 1)
+    previous = offsets.copy()
+    for i, char in enumerate(source):
+        cost = target != char
+        current = np.empty_like(previous)
+        current[0] = i + 1
+        current[1:] = np.minimum(previous[1:] + 1, previous[:-1] + cost)
+        # current[j] = min(current[j], current[j-1] + 1) 等价于对 current - j 取累积最小值
+        previous = np.minimum.accumulate(current - offsets) + offsets
+    return int(previous[-1])
+
+
+def character_error_rate(recognized, truth, language):
+    truth = normalize_text(truth, language)
+    recognized = normalize_text(recognized, language)
+    return edit_distance(recognized, truth) / max(1, len(truth))
+
+
+def measure_stage(documents, preprocess):
+    """逐页测量插件的倾斜估计和二值化"""
+    results = []
+    for doc in documents:
+        skew_errors, skew_ms, clean_ms = [], [], []
+        for image, page in zip(doc['images'], doc['pages']):
+            start = time.perf_counter()
+            angle = preprocess.page_skew(image)
+            skew_ms.append((time.perf_counter() - start) * 1000)
+            # 倾斜由 rotate(skew) 产生，校正角度应为 -skew
+            skew_errors.append(abs(angle + page['skew']))
+            start = time.perf_counter()
+            preprocess.clean_image(image)
+            clean_ms.append((time.perf_counter() - start) * 1000)
+        result = {
+            'document': doc['name'],
+            'pages': len(doc['pages']),
+            'skew_error_mean_deg': round(statistics.mean(skew_errors), 3),
+            'skew_error_max_deg': round(max(skew_errors), 3),
+            'skew_ms_p50': round(statistics.median(skew_ms), 1),
+            'clean_ms_p50': round(statistics.median(clean_ms), 1),
+            'clean_ms_p99': round(percentile(clean_ms, 0.99), 1),
+        }
+        results.append(result)
+        print(f"{doc['name']:28} 倾斜误差 平均 {result['skew_error_mean_deg']:.2f}° 最大 "
+              f"{result['skew_error_max_deg']:.2f}°  倾斜估计 {result['skew_ms_p50']:.0f} ms/页  "
+              f"拉平和二值化 {result['clean_ms_p50']:.0f} ms/页", flush=True)
+    return results
+
+
+def run_ocrmypdf(server, doc, options, work_dir, timeout):
+    """运行一次ocrmypdf，返回 (耗时秒数, 每页识别文本)，失败时文本为None"""
+    output_path = os.path.join(work_dir, 'output.pdf')
+    sidecar_path = os.path.join(work_dir, 'output.txt')
+    options = dict(options, language=doc['language'], optimize_level=0, sidecar=sidecar_path)
+    cmd = server.build_ocrmypdf_cmd(doc['path'], output_path, options)
+    start = time.perf_counter()
+    try:
+        completed = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return time.perf_counter() - start, None
+    elapsed = time.perf_counter() - start
+    if completed.returncode != 0:
+        print(f"  ocrmypdf失败（{completed.returncode}）: {completed.stderr.strip()[-300:]}", file=sys.stderr)
+        return elapsed, None
+    from search_index import read_sidecar
+    return elapsed, read_sidecar(sidecar_path, len(doc['pages']))
+
+
+def measure_end_to_end(server, documents, args, work_dir):
+    results = []
+    for label, options in CONFIGS:
+        for doc in documents:
+            latencies, errors, failures = [], [], 0
+            for _ in range(args.repeat):
+                elapsed, texts = run_ocrmypdf(server, doc, options, work_dir, args.timeout)
+                if texts is None:
+                    failures += 1
+                    continue
+                latencies.append(elapsed)
+                errors = [character_error_rate(text, page['text'], doc['language'])
+                          for text, page in zip(texts, doc['pages'])]
+            total = sum(latencies)
+            pages = len(doc['pages']) * len(latencies)
+            result = {
+                'label': label,
+                'document': doc['name'],
+                'language': doc['language'],
+                'options': options,
+                'runs': len(latencies),
+                'failures': failures,
+                'pages_per_second': round(pages / total, 4) if total else None,
+                'p50_s': round(statistics.median(latencies), 3) if latencies else None,
+                'cer': round(statistics.mean(errors), 4) if errors else None,
+            }
+            results.append(result)
+            print(f"{doc['language']:8} {label:32} {result['pages_per_second'] or 0:7.3f} 页/秒  "
+                  f"p50 {result['p50_s'] or 0:7.2f}s  CER {result['cer'] if errors else '-':>7}  "
+                  f"失败 {failures}", flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', default='preprocess_stage.json', help='结果JSON文件')
+    parser.add_argument('--seed', default='preprocess-v1', help='语料随机种子')
+    parser.add_argument('--pages', type=int, default=4, help='每个文档的页数')
+    parser.add_argument('--dpi', type=int, default=300, help='页面分辨率')
+    parser.add_argument('--repeat', type=int, default=1, help='每个文档和选项组合的重复次数')
+    parser.add_argument('--font', help='英文字体文件')
+    parser.add_argument('--cjk-font', help='中文字体文件')
+    parser.add_argument('--timeout', type=int, default=1800, help='单次运行的超时秒数')
+    parser.add_argument('--stage-only', action='store_true', help='只测量预处理阶段，不运行ocrmypdf')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='preprocess-bench-')
+    try:
+        run(args, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run(args, work_dir):
+    # 不使用页面缓存，重复运行时也重新识别；环境变量需要在导入server之前设置
+    os.environ['OCR_PAGE_CACHE_MB'] = '0'
+    os.environ.pop('OCR_PAGE_CACHE_DIR', None)
+    import preprocess
+
+    documents = build_corpus(work_dir, args.seed, args.pages, args.dpi,
+                             find_font(args.font, LATIN_FONT_CANDIDATES),
+                             find_font(args.cjk_font, CJK_FONT_CANDIDATES))
+    if not documents:
+        sys.exit("没有可用的字体，无法生成语料")
+
+    stage = measure_stage(documents, preprocess)
+    end_to_end = []
+    if not args.stage_only:
+        import server
+        end_to_end = measure_end_to_end(server, documents, args, work_dir)
+
+    report = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'ocrmypdf': tool_version(['ocrmypdf', '--version']),
+            'tesseract': tool_version(['tesseract', '--version']),
+            'args': vars(args),
+        },
+        'corpus': [{'name': doc['name'], 'language': doc['language'], 'dpi': doc['dpi'],
+                    'skews': [page['skew'] for page in doc['pages']]} for doc in documents],
+        'stage': stage,
+        'end_to_end': end_to_end,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
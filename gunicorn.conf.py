@@ -0,0 +1,60 @@
+# gunicorn生产环境配置：gunicorn -c gunicorn.conf.py server:app
+import os
+import sys
+import signal
+import importlib
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# CPU和内存预算、公平调度队列、长连接上限和进度信息都保存在进程内存中，任务库也按
+# 单个进程接管任务，多个工作进程会各自按整台机器的预算运行任务。只能启动一个工作进程，
+# 通过线程处理并发请求
+workers = 1
+if os.environ.get('GUNICORN_WORKERS', '1').strip() != '1':
+    sys.exit("GUNICORN_WORKERS 只能为1：资源预算和任务队列按进程保存，增加并发请调整 GUNICORN_THREADS")
+worker_class = 'gthread'
+# 进度事件流和批量结果ZIP下载在连接期间各占用一个线程，同时打开的数量由 OCR_MAX_STREAMS
+# 限制（默认比线程数少4个），剩余线程处理上传和状态查询；需要更多长连接时同时增加两者
+threads = int(os.environ.get('GUNICORN_THREADS', '16'))
+# 每个工作进程同时保持的最大连接数（包括进度事件流）
+worker_connections = int(os.environ.get('GUNICORN_MAX_CONNECTIONS', '256'))
+
+# 大文件上传可能耗时较长，OCR本身在后台任务中执行
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '600'))
+keepalive = 5
+
+# 收到SIGTERM后等待正在处理的任务完成的最长时间
+graceful_timeout = int(os.environ.get('OCR_DRAIN_TIMEOUT', '600'))
+
+# 预加载应用，工作进程共享导入后的代码；后台线程在工作进程中按需启动
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    """命令行参数 -w 同样不能超过1"""
+    if server.cfg.workers != 1:
+        sys.exit(f"gunicorn工作进程数只能为1（当前为 {server.cfg.workers}）：资源预算和任务队列按进程保存")
+
+
+def post_worker_init(worker):
+    """收到SIGTERM时先停止接受新任务，再交给gunicorn停止接收请求"""
+    ocr_server = importlib.import_module('server')
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_term(signum, frame):
+        ocr_server.begin_drain()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle_term)
+    # 不等第一个请求，启动后立即恢复任务库中排队和被中断的任务
+    ocr_server.start_workers()
+
+
+def worker_exit(server, worker):
+    """工作进程退出前等待已提交的任务完成"""
+    ocr_server = importlib.import_module('server')
+    ocr_server.drain_jobs(graceful_timeout)
@@ -0,0 +1,210 @@
+"""任务记录的SQLite存储
+
+每个提交的任务保存输入文件、处理选项、状态、尝试次数、各时间点和输出文件，
+服务重启或被OOM杀掉后，排队中和运行中被中断的任务可以重新放入队列；
+任务状态查询和任务列表也由这里的索引查询提供，不需要把所有历史任务留在内存中。
+
+批量提交（batches 表）记录每个文件对应的任务，开启性能分析的任务的处理时间线
+（traces 表）在处理结束后写入，服务重启后仍可下载。
+
+数据库使用WAL模式，写入时不阻塞查询。每条未完成的任务记录
+属于写入它的进程（owner 为进程ID），启动时只接管所属进程已经退出的任务。
+"""
+import os
+import json
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    input_path TEXT NOT NULL,
+    output_path TEXT,
+    options TEXT NOT NULL,
+    cache_key TEXT NOT NULL,
+    client TEXT,
+    cost INTEGER,
+    priority TEXT,
+    memory_mb INTEGER,
+    cores INTEGER,
+    cached INTEGER NOT NULL DEFAULT 0,
+    remove_input_on_failure INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    optimization TEXT,
+    owner INTEGER,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at, id);
+CREATE INDEX IF NOT EXISTS jobs_state_created ON jobs (state, created_at, id);
+CREATE INDEX IF NOT EXISTS jobs_client_created ON jobs (client, created_at, id);
+CREATE INDEX IF NOT EXISTS jobs_done_cache_key ON jobs (cache_key, finished_at) WHERE state = 'done';
+CREATE INDEX IF NOT EXISTS jobs_unfinished ON jobs (created_at)
+    WHERE state IN ('queued', 'running') OR optimization IN ('queued', 'running');
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    client TEXT,
+    options TEXT NOT NULL,
+    entries TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS traces (
+    job_id TEXT PRIMARY KEY,
+    trace TEXT NOT NULL
+);
+"""
+
+# 任务字典中需要保存的字段
+FIELDS = (
+    'id', 'state', 'input_path', 'output_path', 'options', 'cache_key', 'client', 'cost', 'priority',
+    'memory_mb', 'cores', 'cached', 'remove_input_on_failure', 'attempts', 'error', 'optimization',
+    'created_at', 'started_at', 'finished_at',
+)
+
+FINISHED_STATES = ('done', 'failed')
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _record(row):
+    record = dict(row)
+    record['options'] = json.loads(record['options'])
+    record['cached'] = bool(record['cached'])
+    record['remove_input_on_failure'] = bool(record['remove_input_on_failure'])
+    return record
+
+
+class JobStore:
+    """任务记录表，所有方法都可以在多个线程中调用"""
+
+    def __init__(self, path, owner=None):
+        self.path = path
+        self.owner = owner if owner is not None else os.getpid()
+        self._lock = threading.Lock()
+        # 自动提交模式，需要原子性的地方显式开启事务
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+
+    def save(self, job):
+        """写入任务字典中的 FIELDS 字段，已存在时整行替换"""
+        values = [json.dumps(job[field], ensure_ascii=False) if field == 'options' else job[field]
+                  for field in FIELDS]
+        columns = ', '.join(FIELDS + ('owner',))
+        placeholders = ', '.join('?' * (len(FIELDS) + 1))
+        with self._lock:
+            self._conn.execute(f'INSERT OR REPLACE INTO jobs ({columns}) VALUES ({placeholders})',
+                               values + [self.owner])
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return _record(row) if row is not None else None
+
+    def find_result(self, cache_key):
+        """相同内容和选项最近一次成功处理的输出文件路径"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT output_path FROM jobs WHERE cache_key = ? AND state = 'done' "
+                "ORDER BY finished_at DESC LIMIT 1", (cache_key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def list(self, state=None, client=None, before=None, limit=50):
+        """按提交时间倒序分页列出任务
+
+        before 为上一页返回的游标 (created_at, id)，返回 (任务列表, 下一页游标)，
+        没有下一页时游标为None。
+        """
+        conditions = []
+        params = []
+        if state:
+            conditions.append('state = ?')
+            params.append(state)
+        if client:
+            conditions.append('client = ?')
+            params.append(client)
+        if before:
+            conditions.append('(created_at, id) < (?, ?)')
+            params.extend(before)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT * FROM jobs {where} ORDER BY created_at DESC, id DESC LIMIT ?',
+                params + [limit + 1]).fetchall()
+        records = [_record(row) for row in rows[:limit]]
+        cursor = (records[-1]['created_at'], records[-1]['id']) if len(rows) > limit else None
+        return records, cursor
+
+    def counts(self):
+        """各状态的任务数"""
+        with self._lock:
+            rows = self._conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        return {state: count for state, count in rows}
+
+    def claim_unfinished(self, is_alive=process_alive):
+        """接管所属进程已经退出的未完成任务，按提交时间返回
+
+        未完成包括排队中、运行中，以及已完成但后台优化还没有结束的任务。
+        """
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._conn.execute(
+                    "SELECT * FROM jobs WHERE state IN ('queued', 'running') "
+                    "OR optimization IN ('queued', 'running') ORDER BY created_at").fetchall()
+                claimed = [row for row in rows
+                           if row['owner'] is None or row['owner'] == self.owner or not is_alive(row['owner'])]
+                self._conn.executemany('UPDATE jobs SET owner = ? WHERE id = ?',
+                                       [(self.owner, row['id']) for row in claimed])
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return [_record(row) for row in claimed]
+
+    def save_batch(self, batch):
+        """保存一次批量提交，entries 为每个文件的 {name, job_id, error}"""
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO batches (id, client, options, entries, created_at) VALUES (?, ?, ?, ?, ?)',
+                (batch['id'], batch['client'], json.dumps(batch['options'], ensure_ascii=False),
+                 json.dumps(batch['entries'], ensure_ascii=False), batch['created_at']))
+
+    def get_batch(self, batch_id):
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM batches WHERE id = ?', (batch_id,)).fetchone()
+        if row is None:
+            return None
+        batch = dict(row)
+        batch['options'] = json.loads(batch['options'])
+        batch['entries'] = json.loads(batch['entries'])
+        return batch
+
+    def save_trace(self, job_id, trace):
+        """保存任务的处理时间线（Chrome trace格式的字典），已存在时替换"""
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO traces (job_id, trace) VALUES (?, ?)',
+                               (job_id, json.dumps(trace, ensure_ascii=False)))
+
+    def get_trace(self, job_id):
+        with self._lock:
+            row = self._conn.execute('SELECT trace FROM traces WHERE job_id = ?', (job_id,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
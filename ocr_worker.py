@@ -0,0 +1,320 @@
+"""常驻OCR工作进程
+
+每个工作进程启动时导入ocrmypdf，之后通过标准输入/输出按行收发JSON，
+反复调用 ocrmypdf.ocr()，省去每个文档启动解释器、发现插件和导入依赖的开销。
+
+请求:  {"input": "...", "output": "...", "kwargs": {...}, "debug": false}  debug为true时转发DEBUG日志
+响应:  {"log": "..."}                             ocrmypdf日志，可能有多行
+       {"result": {"ok": true, "error": null, "exit_code": 0, "cpu": 1.5, "rss": 123}}  处理结束
+
+本模块不依赖 server.py，工作进程以 `python ocr_worker.py` 独立运行。
+"""
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import resource
+import threading
+import subprocess
+from collections import deque
+
+
+def _current_rss():
+    """当前进程的常驻内存（字节）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def virtual_size(pid):
+    """进程当前的虚拟内存大小（字节），读取失败时返回0"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def process_tree(root):
+    """root 及其全部子孙进程的常驻内存 {进程ID: 字节}"""
+    parents, rss = {}, {}
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            parents[int(entry)] = int(fields[1])
+            rss[int(entry)] = int(fields[21]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+    tree = {}
+    for pid in rss:
+        current = pid
+        while current and current != root:
+            current = parents.get(current)
+        if current == root:
+            tree[pid] = rss[pid]
+    return tree
+
+
+class MemoryWatch:
+    """任务运行期间定期汇总进程树的常驻内存，超过上限时杀掉整个进程树
+
+    RLIMIT_AS 只限制单个进程，ocrmypdf的多个页面进程和tesseract子进程合起来
+    仍可能超出任务预留的内存，这里按整个进程树计算。relative 为True时只计算
+    开始之后增加的部分（常驻工作进程已经导入的模块和缓存的语言模型不算在内）。
+    """
+
+    def __init__(self, pid, limit, interval=0.5, relative=False):
+        self.pid = pid
+        self.limit = limit
+        self.interval = interval
+        self.relative = relative
+        self.exceeded = False
+        self.peak = 0
+        self._baseline = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            tree = process_tree(self.pid)
+            if not tree:
+                return
+            used = sum(tree.values()) - self._baseline
+            self.peak = max(self.peak, used)
+            if used > self.limit:
+                self.exceeded = True
+                logging.error(f"进程 {self.pid} 及其子进程占用 {used / (1024 * 1024):.0f} MB，"
+                              f"超过上限 {self.limit / (1024 * 1024):.0f} MB，终止处理")
+                for pid in tree:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                return
+
+    def __enter__(self):
+        if self.relative:
+            self._baseline = sum(process_tree(self.pid).values())
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _cpu_seconds():
+    """本进程及已结束的子进程消耗的CPU时间（秒）"""
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+class _ForwardHandler(logging.Handler):
+    """把ocrmypdf的日志转发给父进程，带页码的日志与命令行输出格式一致"""
+
+    def __init__(self, send):
+        super().__init__()
+        self.send = send
+
+    def emit(self, record):
+        try:
+            pageno = getattr(record, 'pageno', None)
+            prefix = f"{pageno:5d} " if isinstance(pageno, int) else ''
+            self.send({'log': prefix + record.getMessage()})
+        except Exception:
+            self.handleError(record)
+
+
+def worker_main():
+    # 协议使用原始标准输出，其余打印到标准输出的内容转到标准错误
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), 'w', encoding='utf-8')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            protocol.write(json.dumps(message, ensure_ascii=False) + '\n')
+            protocol.flush()
+
+    import ocrmypdf
+
+    ocr_logger = logging.getLogger('ocrmypdf')
+    ocr_logger.addHandler(_ForwardHandler(send))
+    ocr_logger.propagate = False
+
+    for line in sys.stdin:
+        task = json.loads(line)
+        # 与命令行的默认输出相同，只有需要逐页时间线的任务才转发详细日志
+        ocr_logger.setLevel(logging.DEBUG if task.get('debug') else logging.INFO)
+        cpu_start = _cpu_seconds()
+        try:
+            exit_code = int(ocrmypdf.ocr(task['input'], task['output'], **task['kwargs']))
+            ok = exit_code == 0
+            error = None if ok else f"ocrmypdf返回 {exit_code}"
+        except Exception as e:
+            ok = False
+            error = f"{type(e).__name__}: {e}"
+            # ocrmypdf的异常带有与命令行相同的退出码
+            exit_code = int(getattr(e, 'exit_code', 15))
+        send({'result': {'ok': ok, 'error': error, 'exit_code': exit_code,
+                         'cpu': _cpu_seconds() - cpu_start, 'rss': _current_rss()}})
+
+
+class WarmWorker:
+    """父进程中对单个常驻工作进程的封装"""
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            bufsize=1,
+        )
+        self.jobs_done = 0
+        self.rss = 0
+        self.started_at = time.time()
+
+    def run(self, input_path, output_path, kwargs, on_line, tail, debug=False):
+        """执行一个任务，返回工作进程的结果字典；工作进程意外退出时抛出 EOFError"""
+        self.process.stdin.write(json.dumps({'input': input_path, 'output': output_path, 'kwargs': kwargs,
+                                             'debug': debug}) + '\n')
+        self.process.stdin.flush()
+        for line in self.process.stdout:
+            message = json.loads(line)
+            if 'log' in message:
+                tail.append(message['log'])
+                if on_line is not None:
+                    on_line(message['log'])
+                continue
+            result = message['result']
+            self.jobs_done += 1
+            self.rss = result['rss']
+            return result
+        raise EOFError(f"OCR工作进程 {self.process.pid} 意外退出，返回码 {self.process.wait()}")
+
+    def set_memory_limit(self, limit):
+        """设置工作进程的虚拟内存上限（RLIMIT_AS软限制），None表示不限制
+
+        limit 是本任务可以新增的部分：工作进程已经导入的ocrmypdf和缓存的语言模型
+        占用的地址空间不计入，上限为当前虚拟内存大小加上 limit。之后fork的页面
+        进程继承同样的映射，按同一上限计算。
+        """
+        hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+        soft = virtual_size(self.process.pid) + limit if limit else hard
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.prlimit(self.process.pid, resource.RLIMIT_AS, (soft, hard))
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def stop(self):
+        if self.alive():
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+class WarmWorkerPool:
+    """常驻OCR工作进程池
+
+    工作进程按需启动；处理 max_jobs 个任务后或常驻内存超过 max_rss 字节时
+    退出并在下次使用时重新启动，避免内存泄漏累积。
+    """
+
+    def __init__(self, size, max_jobs, max_rss, tail_lines=200):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self.tail_lines = tail_lines
+        self.recycled = 0
+        self._idle = []
+        self._started = 0
+        self._cond = threading.Condition()
+
+    def _acquire(self):
+        with self._cond:
+            while not self._idle and self._started >= self.size:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._started += 1
+        try:
+            return WarmWorker()
+        except Exception:
+            with self._cond:
+                self._started -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, worker):
+        recycle = (not worker.alive()
+                   or (self.max_jobs and worker.jobs_done >= self.max_jobs)
+                   or (self.max_rss and worker.rss >= self.max_rss))
+        if recycle:
+            worker.stop()
+            logging.info(f"回收OCR工作进程 {worker.process.pid}：已处理 {worker.jobs_done} 个任务，"
+                         f"内存 {worker.rss / (1024 * 1024):.0f} MB")
+        with self._cond:
+            if recycle:
+                self._started -= 1
+                self.recycled += 1
+            else:
+                self._idle.append(worker)
+            self._cond.notify()
+
+    def run(self, input_path, output_path, kwargs, on_line=None, memory_limit=None, rss_limit=None, debug=False):
+        """在空闲的工作进程中执行任务，返回 (结果字典, 最后若干行日志)
+        
+        结果字典包含 ok、error、exit_code（工作进程崩溃时为None）、cpu（秒）和
+        memory_exceeded。memory_limit 为本任务期间工作进程及其子进程各自可以新增的
+        虚拟内存（字节，在工作进程已有的地址空间之上）；rss_limit 为本任务期间整个进程树新增常驻内存的上限，
+        超过时杀掉工作进程，任务失败。debug 为True时转发ocrmypdf的DEBUG日志。
+        """
+        tail = deque(maxlen=self.tail_lines)
+        worker = self._acquire()
+        watch = None
+        try:
+            worker.set_memory_limit(memory_limit)
+            if rss_limit:
+                watch = MemoryWatch(worker.process.pid, rss_limit, relative=True)
+                with watch:
+                    result = worker.run(input_path, output_path, kwargs, on_line, tail, debug)
+            else:
+                result = worker.run(input_path, output_path, kwargs, on_line, tail, debug)
+        except (EOFError, OSError, ValueError) as e:
+            result = {'ok': False, 'error': str(e), 'exit_code': None, 'cpu': None}
+        finally:
+            self._release(worker)
+        result['memory_exceeded'] = watch is not None and watch.exceeded
+        if result['error']:
+            tail.append(result['error'])
+        return result, tail
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+
+
+if __name__ == '__main__':
+    worker_main()
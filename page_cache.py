@@ -0,0 +1,158 @@
+"""ocrmypdf插件：按页面图像内容缓存OCR结果
+
+以送入OCR的页面图像内容、识别语言和引擎设置的哈希为键，把每页的hOCR和
+文本保存在磁盘上。只修改了优化级别等不影响页面图像的选项重新处理同一文档，
+或者不同文档中有相同的封面、表格页时，命中缓存的页面不再重新识别。
+
+插件只读写条目，不检查目录大小；超过上限时由服务端的定期清理按最近使用
+时间淘汰（server.prune_page_cache），OCR进程中不扫描缓存目录。每页命中或
+未命中都会写一行日志（见 HIT_MESSAGE / MISS_MESSAGE），由服务端从ocrmypdf
+输出中统计命中率。
+
+    OCR_PAGE_CACHE_DIR  缓存目录，未设置时不启用缓存
+    OCR_TESSERACT_API   为1时识别使用 tesserocr_engine 插件中的引擎
+"""
+import os
+import sys
+import hashlib
+import logging
+import threading
+
+from ocrmypdf import hookimpl
+from ocrmypdf.builtin_plugins.tesseract_ocr import TesseractOcrEngine
+
+# 挂在ocrmypdf日志器下，命令行和常驻工作进程都会输出这些日志
+log = logging.getLogger('ocrmypdf.page_cache')
+
+HIT_MESSAGE = 'page-cache: hit'
+MISS_MESSAGE = 'page-cache: miss'
+
+
+def _base_engine_class():
+    if os.environ.get('OCR_TESSERACT_API') == '1':
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        try:
+            import tesserocr_engine
+            if tesserocr_engine.tesserocr is not None:
+                return tesserocr_engine.TesserocrEngine
+        except ImportError:
+            log.warning("无法加载tesserocr_engine，使用内置tesseract引擎")
+    return TesseractOcrEngine
+
+
+class PageCache:
+    """磁盘上的页面OCR结果缓存，多个进程可以同时读写"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key):
+        folder = os.path.join(self.directory, key[:2])
+        return os.path.join(folder, key + '.hocr'), os.path.join(folder, key + '.txt')
+
+    def get(self, key):
+        """返回 (hOCR, 文本)，未命中返回None"""
+        hocr_path, text_path = self._paths(key)
+        try:
+            with open(hocr_path, 'rb') as f:
+                hocr = f.read()
+            with open(text_path, 'rb') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        # 更新访问时间，淘汰时按最近使用排序
+        for path in (hocr_path, text_path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return hocr, text
+
+    def put(self, key, hocr, text):
+        hocr_path, text_path = self._paths(key)
+        os.makedirs(os.path.dirname(hocr_path), exist_ok=True)
+        # 先写文本再写hOCR，读取方以hOCR存在作为完整条目
+        for path, data in ((text_path, text), (hocr_path, hocr)):
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+
+
+_cache = None
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = PageCache(os.environ['OCR_PAGE_CACHE_DIR'])
+    return _cache
+
+
+def _page_key(engine_id, input_file, options):
+    """页面图像内容 + 语言 + 引擎设置的哈希"""
+    sha = hashlib.sha256()
+    with open(input_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    settings = [
+        engine_id,
+        '+'.join(options.languages),
+        str(options.tesseract_oem),
+        str(options.tesseract_pagesegmode),
+        ' '.join(str(config) for config in (getattr(options, 'tesseract_config', None) or [])),
+        str(getattr(options, 'tesseract_thresholding', None)),
+        str(getattr(options, 'user_words', None)),
+        str(getattr(options, 'user_patterns', None)),
+    ]
+    sha.update('\0'.join(settings).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def cached_engine(base_class):
+    """为OCR引擎类加上页面缓存"""
+    # 引擎名称包含tesseract版本，升级后旧的缓存条目自然失效
+    engine_id = str(base_class())
+
+    class CachedOcrEngine(base_class):
+        @staticmethod
+        def generate_hocr(input_file, output_hocr, output_text, options):
+            # OCR被禁用（只做优化）时不缓存
+            if getattr(options, 'tesseract_timeout', None) == 0:
+                return base_class.generate_hocr(input_file, output_hocr, output_text, options)
+            cache = _get_cache()
+            key = _page_key(engine_id, input_file, options)
+            cached = cache.get(key)
+            if cached is not None:
+                log.info(HIT_MESSAGE)
+                hocr, text = cached
+                with open(output_hocr, 'wb') as f:
+                    f.write(hocr)
+                with open(output_text, 'wb') as f:
+                    f.write(text)
+                return
+            log.info(MISS_MESSAGE)
+            base_class.generate_hocr(input_file, output_hocr, output_text, options)
+            with open(output_hocr, 'rb') as f:
+                hocr = f.read()
+            with open(output_text, 'rb') as f:
+                text = f.read()
+            cache.put(key, hocr, text)
+
+    return CachedOcrEngine
+
+
+def engine_class():
+    """当前配置下的OCR引擎类，启用页面缓存时加上缓存"""
+    base_class = _base_engine_class()
+    if not os.environ.get('OCR_PAGE_CACHE_DIR'):
+        return base_class
+    return cached_engine(base_class)
+
+
+@hookimpl
+def get_ocr_engine():
+    if not os.environ.get('OCR_PAGE_CACHE_DIR'):
+        return None
+    return engine_class()()
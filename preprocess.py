@@ -0,0 +1,203 @@
+"""ocrmypdf插件：在缩小的代理图像上用NumPy/Pillow快速预处理页面
+
+内置的 --deskew 对每页整幅图像运行一次tesseract版面分析来估计倾斜角度，
+--remove-background 在高DPI扫描件上尤其慢（新版ocrmypdf中已不可用）。本插件：
+
+* 倾斜估计：在约 PROXY_DPI 的代理图像上取前景像素，一次计算所有候选角度下的
+  行投影直方图（先粗后细），取投影最集中的角度。替换OCR引擎的 get_deskew，
+  旋转仍由ocrmypdf完成，输出页面和文字层保持对齐；
+* 拉平背景和二值化（--flatten-background）：在更粗的网格上用最大值滤波和模糊
+  估计纸张背景，阈值由代理图像上的Otsu算法确定，再逐段与整页像素比较得到
+  二值图像。只替换送入OCR的图像，输出PDF中的页面图像不变。
+
+每页在ocrmypdf的页面工作进程中处理。插件提供的OCR引擎在 page_cache 插件的
+引擎（页面缓存、tesserocr）基础上替换倾斜估计，启用本插件时不需要再加载
+page_cache。未安装numpy时不做预处理，使用ocrmypdf内置的处理。
+"""
+import os
+import sys
+import logging
+
+from PIL import Image, ImageFilter
+from ocrmypdf import hookimpl
+
+try:
+    import numpy as np
+except ImportError:  # 未安装时不替换任何处理
+    np = None
+
+# 挂在ocrmypdf日志器下，命令行和常驻工作进程都会输出这些日志
+log = logging.getLogger('ocrmypdf.preprocess')
+
+# 代理图像的分辨率，倾斜估计和阈值计算都在代理图像上进行
+PROXY_DPI = 100
+DEFAULT_DPI = 300
+# 背景估计网格相对代理图像的缩小倍数、最大值滤波窗口（网格像素）和模糊半径
+BACKGROUND_REDUCE = 4
+BACKGROUND_WINDOW = 5
+BACKGROUND_BLUR = 2
+# 拉平后灰度的二值化阈值范围，空白页上Otsu阈值会落在纸张噪点中
+THRESHOLD_MIN = 64
+THRESHOLD_MAX = 200
+# 倾斜估计的搜索范围和粗、细两轮的步长（度）
+MAX_SKEW = 10.0
+COARSE_STEP = 0.5
+FINE_STEP = 0.05
+# 参与投影的前景像素数上限，前景太少（空白页）时不校正
+MAX_POINTS = 60000
+MIN_POINTS = 500
+# 整页二值化时每次处理的行数，限制uint16中间数组的内存
+BAND_ROWS = 512
+
+
+def _dpi(image):
+    dpi = image.info.get('dpi')
+    try:
+        return float(max(dpi)) or DEFAULT_DPI
+    except (TypeError, ValueError):
+        return DEFAULT_DPI
+
+
+def make_proxy(gray, dpi):
+    """按块平均缩小到约 PROXY_DPI，返回代理图像"""
+    factor = max(1, round(dpi / PROXY_DPI))
+    return gray.reduce(factor) if factor > 1 else gray
+
+
+def estimate_background(proxy):
+    """估计纸张背景亮度，返回网格图像，需要时放大到目标尺寸
+
+    块平均后文字变成较暗的像素，行间和字间仍是纸张的亮度，最大值滤波取出
+    附近最亮的网格作为背景，再模糊去掉网格边界。
+    """
+    grid = proxy.reduce(BACKGROUND_REDUCE) if min(proxy.size) >= BACKGROUND_REDUCE * BACKGROUND_WINDOW else proxy
+    return grid.filter(ImageFilter.MaxFilter(BACKGROUND_WINDOW)).filter(ImageFilter.GaussianBlur(BACKGROUND_BLUR))
+
+
+def flatten(pixels, background):
+    """灰度除以背景，纸张变为255，文字保持深色"""
+    flat = pixels.astype(np.uint16) * 255 // np.maximum(background, 1)
+    return np.minimum(flat, 255).astype(np.uint8)
+
+
+def otsu_threshold(pixels):
+    """Otsu阈值：小于阈值的像素为前景"""
+    hist = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    weight = np.cumsum(hist)
+    mass = np.cumsum(hist * levels)
+    total, total_mass = weight[-1], mass[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (total_mass * weight - total * mass) ** 2 / (weight * (total - weight))
+    between = np.nan_to_num(between, nan=0.0, posinf=0.0)
+    # between[t] 为 <= t 与 > t 两类的类间方差，阈值取 t + 1
+    return int(np.argmax(between)) + 1
+
+
+def _threshold(flat):
+    return min(max(otsu_threshold(flat), THRESHOLD_MIN), THRESHOLD_MAX)
+
+
+def _best_angle(xs, ys, angles):
+    """所有候选角度的行投影直方图一次算出，返回平方和最大的角度"""
+    radians = np.deg2rad(angles).astype(np.float32)[:, None]
+    # 按PIL的逆时针旋转方向，旋转后像素所在的行
+    rows = np.rint(ys[None, :] * np.cos(radians) - xs[None, :] * np.sin(radians)).astype(np.int64)
+    rows -= rows.min()
+    height = int(rows.max()) + 1
+    rows += (np.arange(len(angles)) * height)[:, None]
+    hist = np.bincount(rows.ravel(), minlength=len(angles) * height).reshape(len(angles), height)
+    # 前景像素总数不变，平方和越大说明越集中在少数行上，即文字行越水平
+    scores = np.square(hist, dtype=np.float64).sum(axis=1)
+    return float(angles[int(np.argmax(scores))])
+
+
+def estimate_skew(mask):
+    """根据前景掩码估计倾斜，返回使文字行水平需要逆时针旋转的角度（度）"""
+    ys, xs = np.nonzero(mask)
+    if len(ys) < MIN_POINTS:
+        return 0.0
+    step = -(-len(ys) // MAX_POINTS)
+    ys = (ys[::step] - mask.shape[0] / 2).astype(np.float32)
+    xs = (xs[::step] - mask.shape[1] / 2).astype(np.float32)
+    best = _best_angle(xs, ys, np.arange(-MAX_SKEW, MAX_SKEW + COARSE_STEP / 2, COARSE_STEP))
+    best = _best_angle(xs, ys, best + np.arange(-COARSE_STEP, COARSE_STEP + FINE_STEP / 2, FINE_STEP))
+    return round(best, 2) or 0.0
+
+
+def _flat_proxy(gray, dpi):
+    proxy = make_proxy(gray, dpi)
+    background = estimate_background(proxy)
+    flat = flatten(np.asarray(proxy), np.asarray(background.resize(proxy.size, Image.BILINEAR)))
+    return flat, background
+
+
+def page_skew(image):
+    """估计页面图像的倾斜角度（度），可直接传给 Image.rotate"""
+    flat, _ = _flat_proxy(image.convert('L'), _dpi(image))
+    return estimate_skew(flat < _threshold(flat))
+
+
+def clean_image(image):
+    """拉平背景并二值化，返回与输入尺寸相同的L模式图像（0为文字，255为背景）"""
+    gray = image.convert('L')
+    flat, background = _flat_proxy(gray, _dpi(image))
+    threshold = _threshold(flat)
+    background = np.asarray(background.resize(gray.size, Image.BILINEAR)).astype(np.uint16) * threshold
+    pixels = np.asarray(gray)
+    out = np.empty(pixels.shape, dtype=np.uint8)
+    for top in range(0, pixels.shape[0], BAND_ROWS):
+        band = slice(top, top + BAND_ROWS)
+        # 拉平后的灰度 = 灰度 * 255 / 背景，与阈值比较时把除法换成乘法
+        out[band] = np.where(pixels[band].astype(np.uint16) * 255 < background[band], 0, 255)
+    result = Image.fromarray(out, 'L')
+    if 'dpi' in image.info:
+        result.info['dpi'] = image.info['dpi']
+    return result
+
+
+def preprocess_engine(base_class):
+    """用代理图像上的倾斜估计替换OCR引擎的 get_deskew"""
+
+    class PreprocessOcrEngine(base_class):
+        @staticmethod
+        def get_deskew(input_file, options):
+            with Image.open(input_file) as image:
+                angle = page_skew(image)
+            log.debug(f"preprocess: deskew {angle:.2f}")
+            return angle
+
+    return PreprocessOcrEngine
+
+
+def _base_engine_class():
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import page_cache
+    return page_cache.engine_class()
+
+
+@hookimpl
+def add_options(parser):
+    group = parser.add_argument_group('Preprocess', '快速预处理（preprocess插件）')
+    group.add_argument('--flatten-background', action='store_true',
+                       help='拉平背景并二值化送入OCR的图像，不改变输出页面')
+
+
+@hookimpl
+def check_options(options):
+    if np is None:
+        log.warning("未安装numpy，快速预处理不可用，使用ocrmypdf内置的处理")
+
+
+@hookimpl
+def get_ocr_engine():
+    if np is None:
+        return None
+    return preprocess_engine(_base_engine_class())()
+
+
+@hookimpl
+def filter_ocr_image(page, image):
+    if np is None or not page.options.flatten_background or image.mode == '1':
+        return image
+    return clean_image(image)
@@ -0,0 +1,139 @@
+"""任务处理时间线，导出为Chrome trace格式
+
+时间线由两部分组成：
+* 服务端自己的区间（排队、等待CPU份额、预扫描、每个分片、合并、后台优化等）；
+* ocrmypdf详细日志中带页码的行。每行按内容归入一个阶段（栅格化、倾斜校正、
+  去除背景、tesseract、hOCR渲染……），同一页相邻两个阶段之间的时间计入前一个
+  阶段。日志没有自带时间戳，以服务端收到该行的时间为准。
+
+导出的JSON可以用 chrome://tracing 或 https://ui.perfetto.dev 打开，每页一行。
+"""
+import re
+import time
+import threading
+from contextlib import contextmanager
+
+# ocrmypdf日志内容 -> 阶段，按顺序匹配（hocr要在ocr之前）
+STAGE_PATTERNS = [
+    ('page_cache', re.compile(r'page-cache', re.IGNORECASE)),
+    ('rasterize', re.compile(r'rasteri[sz]', re.IGNORECASE)),
+    ('rotate', re.compile(r'rotat|orientation|facing', re.IGNORECASE)),
+    ('deskew', re.compile(r'deskew', re.IGNORECASE)),
+    ('remove_background', re.compile(r'background', re.IGNORECASE)),
+    ('hocr_render', re.compile(r'hocr|graft|render', re.IGNORECASE)),
+    ('tesseract', re.compile(r'tesseract|\bocr\b', re.IGNORECASE)),
+    ('optimize', re.compile(r'optimi[sz]|jbig2|pngquant', re.IGNORECASE)),
+]
+
+# 文档级阶段（不带页码）所在的行
+DOCUMENT_TRACK = 'document'
+WORKER_TRACK = 'worker'
+
+
+def classify_line(text):
+    """判断一行日志属于哪个阶段，无法判断时返回None"""
+    for stage, pattern in STAGE_PATTERNS:
+        if pattern.search(text):
+            return stage
+    return None
+
+
+class JobTrace:
+    """记录一个任务的处理时间线"""
+
+    def __init__(self, origin=None):
+        self.origin = origin if origin is not None else time.time()
+        self.events = []
+        self._open = {}   # 行 -> [阶段, 开始时间, 第一行日志, 最后一行日志的时间]
+        self._lock = threading.Lock()
+
+    def _us(self, timestamp):
+        return int((timestamp - self.origin) * 1e6)
+
+    def _complete(self, track, name, start, end, category, args=None):
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': self._us(start),
+            'dur': max(0, self._us(end) - self._us(start)),
+            'pid': 1,
+            'tid': track,
+        }
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def add_span(self, name, start, end, track=WORKER_TRACK, **args):
+        """记录已知起止时间的区间"""
+        with self._lock:
+            self._complete(track, name, start, end, 'worker', args)
+
+    @contextmanager
+    def span(self, name, track=WORKER_TRACK, **args):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(name, start, time.time(), track, **args)
+
+    def mark(self, track, stage, text=None, timestamp=None):
+        """track 行进入 stage 阶段，结束该行上一个阶段"""
+        now = timestamp if timestamp is not None else time.time()
+        with self._lock:
+            current = self._open.get(track)
+            if current is not None and current[0] == stage:
+                current[3] = now
+                return
+            if current is not None:
+                self._close(track, current, now)
+            self._open[track] = [stage, now, text, now]
+
+    def _close(self, track, current, end):
+        stage, start, text, _ = current
+        self._complete(track, stage, start, end, 'ocrmypdf', {'first_line': text[:200]} if text else None)
+
+    def page_line(self, page, text):
+        """记录一行带页码的ocrmypdf日志"""
+        track = f"page {page:05d}"
+        stage = classify_line(text)
+        if stage is None:
+            with self._lock:
+                current = self._open.get(track)
+                if current is not None:
+                    current[3] = time.time()
+                    return
+            stage = 'page'
+        self.mark(track, stage, text)
+
+    def finish(self, timestamp=None):
+        """结束所有未结束的阶段
+
+        每页最后一个阶段结束于该页最后一行日志的时间，之后的时间属于其他页面
+        或文档级的处理。
+        """
+        now = timestamp if timestamp is not None else time.time()
+        with self._lock:
+            for track, current in self._open.items():
+                self._close(track, current, now if track == DOCUMENT_TRACK else current[3])
+            self._open.clear()
+
+    def chrome_trace(self, metadata=None):
+        """返回Chrome trace格式的字典"""
+        with self._lock:
+            events = list(self.events)
+            now = time.time()
+            for track, current in self._open.items():
+                stage, start = current[0], current[1]
+                events.append({'name': stage, 'cat': 'ocrmypdf', 'ph': 'X', 'ts': self._us(start),
+                               'dur': self._us(now) - self._us(start), 'pid': 1, 'tid': track})
+        # 行名换成整数线程ID，顺序为服务端区间、文档阶段、各页
+        tracks = sorted({event['tid'] for event in events},
+                        key=lambda track: (track != WORKER_TRACK, track != DOCUMENT_TRACK, track))
+        tids = {track: index + 1 for index, track in enumerate(tracks)}
+        events = [dict(event, tid=tids[event['tid']]) for event in events]
+        for track, tid in tids.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': track}})
+            events.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': 1, 'tid': tid,
+                           'args': {'sort_index': tid}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': metadata or {}}
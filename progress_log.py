@@ -0,0 +1,41 @@
+"""ocrmypdf插件：以INFO级别日志报告逐页进度
+
+ocrmypdf只在详细（DEBUG）日志中为每页输出带页码的行，为了统计进度而给每个任务
+打开详细日志会多出大量输出。这里提供ocrmypdf的进度条类：每处理完一页输出一行
+PAGE_MESSAGE，后面是已完成页数和总页数，由服务端从ocrmypdf输出中统计进度。
+关闭进度条（progress_bar=False或输出不是终端）时ocrmypdf同样创建进度条对象，
+只是传入 disable=True，日志照常输出。
+"""
+import logging
+
+from ocrmypdf import hookimpl
+
+# 挂在ocrmypdf日志器下，命令行和常驻工作进程都会输出这些日志
+log = logging.getLogger('ocrmypdf.progress_log')
+
+PAGE_MESSAGE = 'page-progress:'
+
+
+class LogProgressBar:
+    """只对以页为单位的进度（逐页OCR）输出日志，其余阶段不输出"""
+
+    def __init__(self, *, total=None, desc=None, unit=None, disable=False, **kwargs):
+        self.total = total
+        self.unit = unit
+        self.completed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def update(self, n=1, *, completed=None):
+        self.completed = completed if completed is not None else self.completed + n
+        if self.unit == 'page':
+            log.info(f"{PAGE_MESSAGE} {int(self.completed)}/{int(self.total or 0)}")
+
+
+@hookimpl
+def get_progressbar_class():
+    return LogProgressBar
@@ -0,0 +1,187 @@
+"""OCR文本的全文索引（SQLite FTS5）
+
+每个处理完成的文档按页写入索引，/search 查询返回命中的文档、页码和摘要。
+
+FTS5的 unicode61 分词器把连续的汉字当作一个词，无法按词查询中文。写入前在
+每个汉字（以及日文假名、韩文）两侧加空格，按单字建立索引；查询时中文词语
+按单字组成短语（"扫 描 件"），要求各字相邻出现，效果等同于子串匹配，不需要
+中文分词词典。摘要中汉字之间的空格在返回前去掉。
+
+prescan或 --skip-text 跳过的页面在sidecar中只有占位文本，这些页面已有的文字层
+用pdfminer.six（ocrmypdf的依赖）从输出PDF中提取。
+"""
+import re
+import logging
+import sqlite3
+import threading
+
+try:
+    from pdfminer.high_level import extract_pages
+    from pdfminer.layout import LTTextContainer
+except ImportError:  # 未安装时跳过的页面不写入索引
+    extract_pages = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    cache_key TEXT NOT NULL UNIQUE,
+    job_id TEXT,
+    filename TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    language TEXT,
+    page_count INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(text, tokenize = 'unicode61 remove_diacritics 2');
+"""
+
+# 页面行的rowid为 文档ID << PAGE_BITS | 页码，删除文档时按rowid范围删除，不需要扫描全表
+PAGE_BITS = 20
+
+# 按单字索引的字符：CJK统一汉字及扩展A、兼容汉字、假名、韩文音节
+CJK_CHARS = '぀-ヿ㐀-䶿一-鿿가-힯豈-﫿'
+CJK_RE = re.compile(f'([{CJK_CHARS}])')
+# 摘要中标记命中词的控制字符，由调用方转义后替换为HTML标签
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+SNIPPET_TOKENS = 24
+MATCH_MARKS = f'{MATCH_START}{MATCH_END}'
+# 摘要中两侧都是汉字（或中文标点、全角字符）的空格，包括写入时加上的和tesseract在汉字之间
+# 输出的，都去掉；汉字和空格之间可能隔着命中标记
+CJK_JOINED = CJK_CHARS + '　-〿＀-￯'
+CJK_GAP_RE = re.compile(f'(?<=[{CJK_JOINED}])([{MATCH_MARKS}]?) +(?=[{MATCH_MARKS}]?[{CJK_JOINED}])')
+# 汉字与其他文字之间写入时加上的一个空格，原文中的空格保留
+CJK_EDGE_RE = re.compile(f'(?<=[{CJK_CHARS}]) (?= )|(?<=[{CJK_CHARS}][{MATCH_MARKS}]) (?= )'
+                         f'| (?= [{MATCH_MARKS}]?[{CJK_CHARS}])')
+
+# 命中页数超过该值时不计算相关度（需要遍历所有命中），按最新写入的文档排序
+RANK_MAX_MATCHES = 5000
+
+# ocrmypdf在sidecar中为未识别的页面写入的占位文本
+SKIPPED_PAGE_RE = re.compile(r'^\s*\[OCR skipped on page', re.IGNORECASE)
+
+
+def segment(text):
+    """在每个汉字两侧加空格，使分词器按单字建立索引"""
+    return CJK_RE.sub(r' \1 ', text)
+
+
+def unsegment(text):
+    """去掉 segment 在汉字两侧加上的空格，汉字与英文、数字之间原有的空格保留"""
+    return CJK_EDGE_RE.sub('', CJK_GAP_RE.sub(r'\1', text))
+
+
+def build_query(query):
+    """把用户输入转换为FTS5查询：每个词作为一个短语，所有词都要出现
+
+    用户输入中的引号、运算符等都按普通文字处理，不会造成查询语法错误。
+    """
+    terms = []
+    for word in query.split():
+        tokens = segment(word).split()
+        if tokens:
+            terms.append('"' + ' '.join(tokens).replace('"', '""') + '"')
+    return ' '.join(terms)
+
+
+def read_sidecar(path, page_count=None):
+    """读取ocrmypdf的sidecar文本，返回每页文本的列表，未识别的页面为空字符串"""
+    with open(path, encoding='utf-8', errors='replace') as f:
+        pages = f.read().split('\f')
+    # 每页文本后都有换页符，最后多出一个空段
+    if page_count is not None:
+        pages = (pages + [''] * page_count)[:page_count]
+    elif pages and not pages[-1].strip():
+        pages.pop()
+    return ['' if SKIPPED_PAGE_RE.match(text) else text for text in pages]
+
+
+def extract_pdf_text(path, page_numbers):
+    """从PDF已有的文字层中提取指定页（从1开始）的文本，返回 {页码: 文本}，失败时返回空字典"""
+    if extract_pages is None or not page_numbers:
+        return {}
+    texts = {}
+    try:
+        for page in extract_pages(path, page_numbers=[number - 1 for number in page_numbers]):
+            texts[page.pageid] = ''.join(element.get_text() for element in page
+                                         if isinstance(element, LTTextContainer))
+    except Exception as e:
+        logging.warning(f"无法提取PDF文字层 {path}: {str(e)}")
+    return texts
+
+
+class SearchIndex:
+    """全文索引，所有方法都可以在多个线程中调用"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+
+    def add_document(self, document, page_texts):
+        """写入一个文档的各页文本，相同 cache_key 的文档先删除旧的索引
+
+        document 包含 cache_key、job_id、filename、output_path、language、indexed_at。
+        返回写入索引的页数（空白页不写入）。
+        """
+        page_texts = page_texts[:(1 << PAGE_BITS) - 1]
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute('SELECT id FROM documents WHERE cache_key = ?',
+                                         (document['cache_key'],)).fetchone()
+                if row is not None:
+                    self._delete_pages(row[0])
+                    self._conn.execute('DELETE FROM documents WHERE id = ?', (row[0],))
+                cursor = self._conn.execute(
+                    'INSERT INTO documents (cache_key, job_id, filename, output_path, language, page_count, indexed_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (document['cache_key'], document['job_id'], document['filename'], document['output_path'],
+                     document['language'], len(page_texts), document['indexed_at']))
+                base = cursor.lastrowid << PAGE_BITS
+                rows = [(base | number, segment(text)) for number, text in enumerate(page_texts, start=1)
+                        if text.strip()]
+                self._conn.executemany('INSERT INTO pages (rowid, text) VALUES (?, ?)', rows)
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        return len(rows)
+
+    def _delete_pages(self, document_id):
+        self._conn.execute('DELETE FROM pages WHERE rowid BETWEEN ? AND ?',
+                           (document_id << PAGE_BITS, ((document_id + 1) << PAGE_BITS) - 1))
+
+    def search(self, query, limit=20, offset=0):
+        """返回 (命中的页面, 是否按相关度排序)，每项包含文档信息、页码和摘要"""
+        match = build_query(query)
+        if not match:
+            return [], True
+        with self._lock:
+            ranked = self._conn.execute('SELECT 1 FROM pages WHERE pages MATCH ? LIMIT 1 OFFSET ?',
+                                        (match, RANK_MAX_MATCHES)).fetchone() is None
+            order = 'rank' if ranked else 'pages.rowid DESC'
+            rows = self._conn.execute(
+                'SELECT pages.rowid AS rowid, '
+                f"snippet(pages, 0, ?, ?, '…', {SNIPPET_TOKENS}) AS snippet, "
+                'documents.cache_key, documents.job_id, documents.filename, documents.output_path, '
+                'documents.page_count '
+                'FROM pages JOIN documents ON documents.id = (pages.rowid >> ?) '
+                f'WHERE pages MATCH ? ORDER BY {order} LIMIT ? OFFSET ?',
+                (MATCH_START, MATCH_END, PAGE_BITS, match, limit, offset)).fetchall()
+        hits = []
+        for row in rows:
+            hit = dict(row)
+            hit['page'] = hit.pop('rowid') & ((1 << PAGE_BITS) - 1)
+            hit['snippet'] = unsegment(hit['snippet']).strip()
+            hits.append(hit)
+        return hits, ranked
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
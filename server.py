@@ -3,11 +3,47 @@ import tempfile
 import subprocess
 import logging
 import base64
+import html
+import urllib.parse
 import sys
-from datetime import datetime
-from flask import Flask, render_template, request, send_file, redirect, url_for, flash
+import time
+import atexit
+import uuid
+import json
+import queue
+import re
+import shutil
+import zipfile
+import hashlib
+import resource
+import sqlite3
+import threading
+import contextlib
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, render_template, request, send_file, redirect, url_for, flash, jsonify, Response, stream_with_context
+from werkzeug.exceptions import ClientDisconnected
 from werkzeug.utils import secure_filename
 
+import metrics
+from job_store import JobStore, FINISHED_STATES
+from ocr_worker import WarmWorkerPool, MemoryWatch
+from search_index import SearchIndex, read_sidecar, extract_pdf_text, MATCH_START, MATCH_END
+from profiling import JobTrace, DOCUMENT_TRACK
+
+
+try:
+    import pikepdf
+except ImportError:  # 未安装时禁用分片处理
+    pikepdf = None
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # 未安装时文件列表每次请求重新扫描目录
+    Observer = None
+    FileSystemEventHandler = None
+
 # 配置日志 - 增强日志设置，确保信息被打印出来
 logging.basicConfig(
     # level=logging.DEBUG,  # 修改为DEBUG级别以显示更多日志
@@ -46,459 +82,2674 @@ app.config['UPLOAD_FOLDER'] = '/tmp'
 # 创建必要的目录
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# OCR处理函数
-def process_pdf_file(input_path, options):
-    """处理PDF文件，应用OCR并返回新文件路径"""
+# 静态资源：URL中带内容哈希，浏览器可长期缓存，内容变化后URL随之变化
+STATIC_MAX_AGE = 365 * 24 * 3600
+_static_versions = {}
+
+@app.template_global()
+def static_url(filename):
+    """返回带内容哈希版本号的静态资源URL"""
+    version = _static_versions.get(filename)
+    if version is None:
+        with open(os.path.join(app.static_folder, filename), 'rb') as f:
+            version = _static_versions[filename] = hashlib.sha256(f.read()).hexdigest()[:12]
+    return url_for('static', filename=filename, v=version)
+
+@app.after_request
+def cache_static_assets(response):
+    # 静态资源同时带ETag（由send_file生成）和长期缓存头
+    if request.endpoint == 'static' and response.status_code in (200, 304):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+    return response
+
+def get_env_int(name, default):
+    """从环境变量读取整数配置，无效或未设置时使用默认值"""
+    value = os.environ.get(name)
+    if not value:
+        return default
     try:
-        # 定义输出路径
-        output_path = input_path + '_ocr.pdf'
+        return int(value)
+    except ValueError:
+        logging.warning(f"无效的{name}值: {value}，使用默认值{default}")
+        return default
+
+# 后台OCR工作线程数量
+app.config['OCR_WORKERS'] = max(1, get_env_int('OCR_WORKERS', 2))
+
+# 全局CPU核心预算，每个ocrmypdf进程通过 --jobs 获得其中一份
+app.config['OCR_CPU_BUDGET'] = max(1, get_env_int('OCR_CPU_BUDGET', os.cpu_count() or 1))
+app.config['OCR_JOB_CORES'] = max(1, get_env_int('OCR_JOB_CORES', app.config['OCR_CPU_BUDGET'] // app.config['OCR_WORKERS']))
+app.config['OCR_JOB_MIN_CORES'] = max(1, min(get_env_int('OCR_JOB_MIN_CORES', 1), app.config['OCR_JOB_CORES']))
+# 排队任务上限，超过后拒绝新的提交，0表示不限制
+app.config['OCR_MAX_QUEUE'] = max(0, get_env_int('OCR_MAX_QUEUE', 100))
+def detect_memory_limit():
+    """容器的内存上限（字节），依次读取cgroup v2、cgroup v1和 /proc/meminfo"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # 未设置上限时cgroup v2为max，v1为接近2^63的数
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+# 内存准入：按页数、页面尺寸和图像分辨率估算每个任务的内存峰值，预算不足时等待
+_memory_limit = detect_memory_limit()
+app.config['OCR_MEMORY_RESERVE_MB'] = max(0, get_env_int('OCR_MEMORY_RESERVE_MB', 384))
+app.config['OCR_MEMORY_BUDGET_MB'] = max(256, get_env_int(
+    'OCR_MEMORY_BUDGET_MB',
+    (_memory_limit // (1024 * 1024) - app.config['OCR_MEMORY_RESERVE_MB']) if _memory_limit else 2048))
+# 每个OCR进程的虚拟内存上限（RLIMIT_AS）为估算值中每个并行页面份额的若干倍，且不低于最小值，0表示不限制
+app.config['OCR_MEMORY_AS_FACTOR'] = max(0, get_env_int('OCR_MEMORY_AS_FACTOR', 3))
+app.config['OCR_MEMORY_AS_MIN_MB'] = max(256, get_env_int('OCR_MEMORY_AS_MIN_MB', 1536))
+# 任务的整个进程树（ocrmypdf、页面进程、tesseract等）常驻内存超过预留值的该百分比时终止任务，0表示不检查
+app.config['OCR_MEMORY_RSS_PERCENT'] = max(0, get_env_int('OCR_MEMORY_RSS_PERCENT', 120))
+logging.info(f"内存预算: {app.config['OCR_MEMORY_BUDGET_MB']} MB")
+
+# 任务调度：按估算成本优先处理小文件，按客户端公平分配，等待过久的任务优先
+# 估算成本以页为单位，页数未知时按文件大小折算
+app.config['OCR_SCHED_BYTES_PER_PAGE'] = max(1, get_env_int('OCR_SCHED_BYTES_PER_PAGE', 100 * 1024))
+app.config['OCR_SCHED_SMALL_PAGES'] = max(1, get_env_int('OCR_SCHED_SMALL_PAGES', 20))
+app.config['OCR_SCHED_LARGE_PAGES'] = max(app.config['OCR_SCHED_SMALL_PAGES'], get_env_int('OCR_SCHED_LARGE_PAGES', 200))
+# 排队每经过这么多秒，任务的有效成本按比例降低
+app.config['OCR_SCHED_AGING_SECONDS'] = max(1, get_env_int('OCR_SCHED_AGING_SECONDS', 60))
+# 排队超过该秒数的任务不再参与成本比较，按提交顺序最先执行
+app.config['OCR_SCHED_MAX_WAIT'] = max(1, get_env_int('OCR_SCHED_MAX_WAIT', 600))
+# 用于识别客户端的请求头（例如反向代理设置的 X-Forwarded-For），为空时使用连接地址
+app.config['OCR_SCHED_CLIENT_HEADER'] = os.environ.get('OCR_SCHED_CLIENT_HEADER', '').strip()
+logging.info(f"CPU预算: {app.config['OCR_CPU_BUDGET']} 核，每个任务最多 {app.config['OCR_JOB_CORES']} 核，"
+             f"工作线程 {app.config['OCR_WORKERS']} 个，排队上限 {app.config['OCR_MAX_QUEUE']}")
+
+# 大文件分片处理配置：页数达到阈值时按页范围拆分，并行OCR后合并，0表示禁用
+app.config['OCR_SHARD_MIN_PAGES'] = max(0, get_env_int('OCR_SHARD_MIN_PAGES', 200))
+app.config['OCR_SHARD_PAGES'] = max(1, get_env_int('OCR_SHARD_PAGES', 50))
+
+# 处理失败时写入日志的ocrmypdf输出行数
+app.config['OCR_STDERR_TAIL_LINES'] = max(1, get_env_int('OCR_STDERR_TAIL_LINES', 200))
+
+# OCR引擎：cli 每个文档启动ocrmypdf命令行；warm 使用常驻工作进程调用ocrmypdf API
+app.config['OCR_ENGINE'] = os.environ.get('OCR_ENGINE', 'cli').strip().lower()
+if app.config['OCR_ENGINE'] not in ('cli', 'warm'):
+    logging.warning(f"无效的OCR_ENGINE值: {app.config['OCR_ENGINE']}，使用默认值cli")
+    app.config['OCR_ENGINE'] = 'cli'
+# 常驻工作进程数默认与任务线程数相同；分片处理时可适当调大
+app.config['OCR_WARM_WORKERS'] = max(1, get_env_int('OCR_WARM_WORKERS', app.config['OCR_WORKERS']))
+# 工作进程处理多少个任务或常驻内存超过多少MB后重启，0表示不限制
+app.config['OCR_WARM_MAX_JOBS'] = max(0, get_env_int('OCR_WARM_MAX_JOBS', 50))
+app.config['OCR_WARM_MAX_RSS_MB'] = max(0, get_env_int('OCR_WARM_MAX_RSS_MB', 1024))
+# 常驻工作进程中通过tesserocr复用已加载语言模型的Tesseract API（tesserocr_engine插件）
+app.config['OCR_TESSERACT_API'] = get_env_int('OCR_TESSERACT_API', 0) == 1
+if app.config['OCR_TESSERACT_API'] and app.config['OCR_ENGINE'] != 'warm':
+    logging.warning("OCR_TESSERACT_API 只在 OCR_ENGINE=warm 时生效")
+# 任务记录数据库，默认保存在上传目录中
+app.config['OCR_JOB_DB'] = os.environ.get('OCR_JOB_DB', '').strip()
+# 运行中被中断（服务重启、进程被OOM杀掉）的任务最多尝试的次数，超过后标记为失败
+app.config['OCR_JOB_MAX_ATTEMPTS'] = max(1, get_env_int('OCR_JOB_MAX_ATTEMPTS', 3))
+# 内存中保留的任务数，更早的已结束任务只从数据库查询
+app.config['OCR_JOBS_IN_MEMORY'] = max(100, get_env_int('OCR_JOBS_IN_MEMORY', 1000))
+# 后台优化在OCR队列非空时最多推迟的秒数，超过后以低优先级照常运行，避免持续负载下永远不优化
+app.config['OCR_OPTIMIZE_MAX_DEFER'] = max(0, get_env_int('OCR_OPTIMIZE_MAX_DEFER', 600))
+# 未完成的分块上传超过该秒数没有写入时删除
+app.config['RESUMABLE_UPLOAD_TTL'] = max(60, get_env_int('RESUMABLE_UPLOAD_TTL', 24 * 3600))
+# OCR文本全文索引，默认保存在上传目录中，OCR_SEARCH_INDEX=0 时不生成
+app.config['OCR_SEARCH_INDEX'] = get_env_int('OCR_SEARCH_INDEX', 1) == 1
+app.config['OCR_SEARCH_DB'] = os.environ.get('OCR_SEARCH_DB', '').strip()
+# 热文件夹：放入该目录的PDF自动按默认选项处理，结果写入单独的输出目录，留空时不启用
+app.config['OCR_INGEST_DIR'] = os.environ.get('OCR_INGEST_DIR', '').strip()
+app.config['OCR_INGEST_OUTPUT_DIR'] = os.environ.get('OCR_INGEST_OUTPUT_DIR', '').strip() or \
+    (app.config['OCR_INGEST_DIR'].rstrip('/') + '_ocr' if app.config['OCR_INGEST_DIR'] else '')
+# 文件大小和修改时间保持不变多少秒后才认为写入完成
+app.config['OCR_INGEST_SETTLE_SECONDS'] = max(1, get_env_int('OCR_INGEST_SETTLE_SECONDS', 5))
+# 热文件夹的处理选项，格式与表单相同，例如 ocr_enabled=1&language=chi_sim&deskew=1&optimize_level=2
+app.config['OCR_INGEST_OPTIONS'] = os.environ.get('OCR_INGEST_OPTIONS', 'ocr_enabled=1&language=eng+chi_sim&optimize_level=1')
+# 一次批量提交最多包含的文件数
+app.config['OCR_BATCH_MAX_FILES'] = max(1, get_env_int('OCR_BATCH_MAX_FILES', 1000))
+# 同时打开的长连接响应（进度事件流、批量结果ZIP）上限，超过时返回503。gthread模式下每个长连接
+# 占用一个请求线程，默认比 GUNICORN_THREADS 少 STREAM_SPARE_THREADS 个，留给上传和状态查询等普通请求
+STREAM_SPARE_THREADS = 4
+app.config['OCR_MAX_STREAMS'] = max(1, get_env_int(
+    'OCR_MAX_STREAMS', get_env_int('GUNICORN_THREADS', 16) - STREAM_SPARE_THREADS))
+# 按页面图像内容缓存OCR结果（page_cache插件）的磁盘上限，默认0不启用。缓存目录不计入存储配额，
+# 由定期清理（RETENTION_SWEEP_INTERVAL）按最近使用时间压到上限以内
+app.config['OCR_PAGE_CACHE_MB'] = max(0, get_env_int('OCR_PAGE_CACHE_MB', 0))
+app.config['OCR_PAGE_CACHE_DIR'] = os.environ.get('OCR_PAGE_CACHE_DIR') or os.path.join(app.config['UPLOAD_FOLDER'], '.page-cache')
+PAGE_CACHE_PLUGIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'page_cache.py')
+# 逐页进度（progress_log插件），每处理完一页输出一行INFO日志
+PROGRESS_PLUGIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'progress_log.py')
+# 快速预处理（preprocess插件）：代理图像上估计倾斜，拉平背景和二值化代替 --remove-background
+PREPROCESS_PLUGIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'preprocess.py')
+if app.config['OCR_PAGE_CACHE_MB']:
+    # 插件在ocrmypdf进程或常驻工作进程中运行，通过环境变量传递配置
+    os.environ['OCR_PAGE_CACHE_DIR'] = app.config['OCR_PAGE_CACHE_DIR']
+else:
+    os.environ.pop('OCR_PAGE_CACHE_DIR', None)
+
+def build_ocrmypdf_cmd(input_path, output_path, options):
+    """根据处理选项构建OCRmyPDF命令"""
+    # 获取OCR选项
+    ocr_enabled = options.get('ocr_enabled', True)
+    language = options.get('language', 'eng+chi_sim')
+    deskew = options.get('deskew', False)
+    optimize_level = options.get('optimize_level', 1)
+    rotate_pages = options.get('rotate_pages', False)
+    remove_background = options.get('remove_background', False)
+    force_ocr = options.get('force_ocr', False)
+    fast_preprocess = options.get('fast_preprocess', False)
+    jobs = options.get('jobs')
+    pages = options.get('pages')
+    sidecar = options.get('sidecar')
+    
+    # 构建OCRmyPDF命令
+    cmd = ['ocrmypdf', '--optimize', str(optimize_level)]
+    
+    # 限制并行核心数，避免多个任务同时占满所有核心
+    if jobs:
+        cmd.extend(['--jobs', str(jobs)])
+    
+    # 添加语言选项
+    if language:
+        cmd.extend(['-l', language])
+    
+    # 添加其他选项
+    if deskew:
+        cmd.append('--deskew')
+    
+    if rotate_pages:
+        cmd.append('--rotate-pages')
+    
+    if remove_background:
+        cmd.append('--flatten-background' if fast_preprocess else '--remove-background')
+    
+    if force_ocr:
+        cmd.append('--force-ocr')
         
-        # 获取OCR选项
-        ocr_enabled = options.get('ocr_enabled', True)
-        language = options.get('language', 'eng+chi_sim')
-        deskew = options.get('deskew', False)
-        optimize_level = options.get('optimize_level', 1)
-        rotate_pages = options.get('rotate_pages', False)
-        remove_background = options.get('remove_background', False)
-        force_ocr = options.get('force_ocr', False)
+    if not ocr_enabled:
+        cmd.append('--skip-text')
+    elif pages is not None:
+        # 只识别预扫描选出的页面，其余页面原样保留；没有需要识别的页面时不运行OCR
+        if pages:
+            cmd.extend(['--pages', format_page_ranges(pages)])
+        else:
+            cmd.extend(['--tesseract-timeout', '0'])
+        cmd.append('--skip-text')
+    
+    # 进度由progress_log插件以INFO日志报告；记录时间线时才需要带页码的详细日志
+    if options.get('profile'):
+        cmd.extend(['-v', '1'])
+    cmd.extend(['--plugin', PROGRESS_PLUGIN])
+    
+    # 添加引擎选项
+    cmd.extend(['--pdf-renderer', 'hocr'])
+    cmd.extend(['--tesseract-oem', '1'])
+    
+    if fast_preprocess:
+        # preprocess插件的OCR引擎包含页面缓存
+        cmd.extend(['--plugin', PREPROCESS_PLUGIN])
+    elif app.config['OCR_PAGE_CACHE_MB']:
+        cmd.extend(['--plugin', PAGE_CACHE_PLUGIN])
+    
+    # 每页识别出的文本，用于全文索引
+    if sidecar:
+        cmd.extend(['--sidecar', sidecar])
+    
+    # 添加输入和输出路径
+    cmd.extend([input_path, output_path])
+    return cmd
+
+# ocrmypdf详细日志中以页码开头的行，例如 "   12 [tesseract] ..."
+PAGE_LINE_RE = re.compile(r'^\s*(\d+)\s')
+# progress_log插件每处理完一页输出的日志，见 progress_log.PAGE_MESSAGE
+PAGE_PROGRESS_RE = re.compile(r'page-progress: (\d+)/(\d+)')
+# page_cache插件每页输出的命中/未命中日志，见 page_cache.HIT_MESSAGE
+PAGE_CACHE_RE = re.compile(r'page-cache: (hit|miss)\b')
+
+def build_ocrmypdf_kwargs(options):
+    """根据处理选项构建 ocrmypdf.ocr() 的参数，与 build_ocrmypdf_cmd 对应"""
+    language = options.get('language', 'eng+chi_sim')
+    fast_preprocess = bool(options.get('fast_preprocess', False))
+    remove_background = bool(options.get('remove_background', False))
+    kwargs = {
+        'optimize': int(options.get('optimize_level', 1)),
+        'deskew': bool(options.get('deskew', False)),
+        'rotate_pages': bool(options.get('rotate_pages', False)),
+        'remove_background': remove_background and not fast_preprocess,
+        'force_ocr': bool(options.get('force_ocr', False)),
+        'pdf_renderer': 'hocr',
+        'tesseract_oem': 1,
+        'progress_bar': False,
+    }
+    if options.get('jobs'):
+        kwargs['jobs'] = options['jobs']
+    if options.get('sidecar'):
+        kwargs['sidecar'] = options['sidecar']
+    if language:
+        kwargs['language'] = language.split('+')
+    if app.config['OCR_TESSERACT_API']:
+        # 页面在工作进程的线程中处理，缓存的Tesseract API才能跨页面和文档复用
+        kwargs['plugins'] = ['tesserocr_engine']
+        kwargs['use_threads'] = True
+    if app.config['OCR_PAGE_CACHE_MB']:
+        # page_cache插件自己包装tesserocr引擎，两个插件不能同时提供OCR引擎
+        kwargs['plugins'] = ['page_cache']
+    if fast_preprocess:
+        # preprocess插件的OCR引擎包含页面缓存和tesserocr
+        kwargs['plugins'] = ['preprocess']
+        if remove_background:
+            kwargs['flatten_background'] = True
+    kwargs['plugins'] = kwargs.get('plugins', []) + ['progress_log']
+    if not options.get('ocr_enabled', True):
+        kwargs['skip_text'] = True
+    elif options.get('pages') is not None:
+        if options['pages']:
+            kwargs['pages'] = format_page_ranges(options['pages'])
+        else:
+            kwargs['tesseract_timeout'] = 0
+        kwargs['skip_text'] = True
+    return kwargs
+
+# 运行指标，通过 /metrics 以Prometheus格式输出
+UPLOAD_BYTES = metrics.Histogram('ocr_upload_bytes', '上传文件大小（字节）', metrics.BYTES_BUCKETS)
+UPLOAD_SECONDS = metrics.Histogram('ocr_upload_duration_seconds', '接收并保存上传文件的耗时（秒）',
+                                   metrics.SECONDS_BUCKETS)
+QUEUE_WAIT = metrics.Histogram('ocr_queue_wait_seconds', '任务排队等待时间（秒）', metrics.SECONDS_BUCKETS,
+                               labels=('priority',))
+JOB_WALL = metrics.Histogram('ocr_job_wall_seconds', '任务从开始处理到得到结果的耗时（秒）',
+                             metrics.SECONDS_BUCKETS, labels=('engine',))
+RUN_CPU = metrics.Histogram('ocr_run_cpu_seconds', '每次运行ocrmypdf消耗的CPU时间，包括tesseract等子进程（秒）',
+                            metrics.SECONDS_BUCKETS, labels=('engine',))
+PAGES_PER_SECOND = metrics.Histogram('ocr_pages_per_second', '任务处理速度（页/秒）', metrics.RATE_BUCKETS)
+OUTPUT_RATIO = metrics.Histogram('ocr_output_size_ratio', '输出文件与输入文件大小之比', metrics.RATIO_BUCKETS,
+                                 labels=('optimize_level',))
+JOBS_FINISHED = metrics.Counter('ocr_jobs_total', '已结束的任务数', labels=('state',))
+RUN_FAILURES = metrics.Counter('ocr_run_failures_total', 'ocrmypdf运行失败次数', labels=('cause',))
+RESULT_CACHE = metrics.Counter('ocr_result_cache_requests_total', '提交任务时的结果缓存查询，inflight表示复用处理中的任务',
+                               labels=('result',))
+PAGE_CACHE = metrics.Counter('ocr_page_cache_pages_total', '页面OCR缓存的查询页数', labels=('result',))
+STREAMS_REJECTED = metrics.Counter('ocr_streams_rejected_total', '长连接数达到上限时拒绝的请求数',
+                                   labels=('route',))
+INGEST_FILES = metrics.Counter('ocr_ingest_files_total', '热文件夹中的文件数，submitted 为已提交，delivered 为结果已写入输出目录',
+                               labels=('result',))
+metrics.Gauge('ocr_queue_jobs', '排队中的任务数', callback=lambda: job_queue.qsize())
+metrics.Gauge('ocr_cores_in_use', '正在使用的CPU核心预算', callback=lambda: cpu_budget.snapshot()['in_use'])
+metrics.Gauge('ocr_memory_reserved_mb', '正在运行的任务预留的内存（MB）',
+              callback=lambda: memory_budget.snapshot()['in_use'])
+metrics.Gauge('ocr_streams_open', '正在打开的进度事件流和批量结果ZIP下载数',
+              callback=lambda: stream_budget.snapshot()['in_use'])
+metrics.Gauge('ocr_upload_folder_bytes', '上传目录中PDF文件的总大小（字节）',
+              callback=lambda: get_file_index().total_bytes)
+metrics.Gauge('ocr_upload_folder_free_bytes', '上传目录所在磁盘的空闲空间（字节）',
+              callback=lambda: shutil.disk_usage(app.config['UPLOAD_FOLDER']).free)
+
+# ocrmypdf退出码对应的失败原因
+EXIT_CODE_CAUSES = {
+    1: 'bad_args', 2: 'input_file', 3: 'missing_dependency', 4: 'invalid_output_pdf',
+    5: 'file_access_error', 6: 'already_done_ocr', 7: 'child_process_error', 8: 'encrypted_pdf',
+    9: 'invalid_config', 10: 'pdfa_conversion_failed', 15: 'other_error', 130: 'ctrl_c',
+}
+
+def _track_progress(line, progress, page_offset):
+    """从一行ocrmypdf日志中提取页码、处理阶段和页面缓存命中情况"""
+    cache_match = PAGE_CACHE_RE.search(line)
+    if cache_match:
+        field = 'hits' if cache_match.group(1) == 'hit' else 'misses'
+        PAGE_CACHE.inc(result=cache_match.group(1))
+        if progress is not None:
+            progress.page_cache(field)
+    if progress is None:
+        return
+    completed = PAGE_PROGRESS_RE.search(line)
+    if completed:
+        # 各页并行处理，只知道完成的页数，按页码顺序计入
+        progress.pages(range(page_offset + 1, page_offset + int(completed.group(1)) + 1))
+        return
+    match = PAGE_LINE_RE.match(line)
+    if match:
+        page_number = page_offset + int(match.group(1))
+        progress.page(page_number)
+        if progress.trace is not None:
+            progress.trace.page_line(page_number, line[match.end():])
+    elif line.startswith('Postprocessing'):
+        progress.stage('postprocessing')
+    elif line.startswith('Optimize'):
+        progress.stage('optimizing')
+
+def address_space_limit(options):
+    """每个OCR进程的虚拟内存上限（字节），未估算内存或已禁用时返回None
+    
+    RLIMIT_AS 按进程计算，tesseract等子进程各自继承一份，因此按估算值中
+    每个并行页面的份额设置，而不是整个任务的估算值。
+    """
+    factor = app.config['OCR_MEMORY_AS_FACTOR']
+    if not factor or not options.get('memory_mb'):
+        return None
+    share = options['memory_mb'] / max(1, options.get('jobs') or 1)
+    limit = int(max(app.config['OCR_MEMORY_AS_MIN_MB'], share * factor)) * 1024 * 1024
+    hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+    return limit if hard == resource.RLIM_INFINITY else min(limit, hard)
+
+def rss_limit(options):
+    """任务进程树的常驻内存上限（字节），未估算内存或已禁用时返回None"""
+    percent = app.config['OCR_MEMORY_RSS_PERCENT']
+    if not percent or not options.get('memory_mb'):
+        return None
+    return options['memory_mb'] * percent // 100 * 1024 * 1024
+
+def _set_address_space(limit):
+    """在子进程exec之前设置虚拟内存上限，进程从启动开始就受限制"""
+    def apply():
+        resource.setrlimit(resource.RLIMIT_AS, (limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+    return apply
+
+def _memory_failure(tail):
+    """输出中有内存不足的错误时返回失败原因 memory_limit"""
+    for line in tail:
+        if 'MemoryError' in line or 'Cannot allocate memory' in line or 'std::bad_alloc' in line:
+            return 'memory_limit'
+    return None
+
+def run_ocrmypdf(input_path, output_path, options, progress=None, page_offset=0, nice=0):
+    """运行OCRmyPDF，逐行读取输出并报告进度，成功返回True
+    
+    OCR_ENGINE=warm 时在常驻工作进程中调用ocrmypdf API，否则启动命令行进程。
+    只保留最后 OCR_STDERR_TAIL_LINES 行输出用于错误日志。分片处理时
+    page_offset 为分片第一页在原文件中的偏移。nice 大于0时以较低的调度
+    优先级启动命令行进程。options 中的 memory_mb 为任务的估算内存，
+    据此为每个OCR进程设置虚拟内存上限，并监视整个进程树的常驻内存，
+    超出的文档单独失败。
+    """
+    on_line = lambda line: _track_progress(line, progress, page_offset)
+    memory_limit = address_space_limit(options)
+    tree_limit = rss_limit(options)
+    
+    engine = app.config['OCR_ENGINE']
+    if engine == 'warm':
+        result, tail = get_warm_pool().run(input_path, output_path, build_ocrmypdf_kwargs(options), on_line,
+                                           memory_limit=memory_limit, rss_limit=tree_limit,
+                                           debug=bool(options.get('profile')))
+        if result['cpu'] is not None:
+            RUN_CPU.observe(result['cpu'], engine=engine)
+        if not result['ok']:
+            cause = 'worker_crash' if result['exit_code'] is None else EXIT_CODE_CAUSES.get(result['exit_code'], 'other_error')
+            if result['memory_exceeded']:
+                cause = 'memory_limit'
+            RUN_FAILURES.inc(cause=_memory_failure(tail) or cause)
+            logging.error("OCR处理失败: " + '\n'.join(tail))
+        return result['ok']
+    
+    cmd = build_ocrmypdf_cmd(input_path, output_path, options)
+    return _run_command(cmd, memory_limit, tree_limit, on_line, nice)
+
+def _run_command(cmd, memory_limit, tree_limit, on_line, nice=0, engine='cli'):
+    """启动命令行进程并逐行读取stderr，按返回码统计失败原因，成功返回True"""
+    tail = deque(maxlen=app.config['OCR_STDERR_TAIL_LINES'])
+    if nice:
+        cmd = ['nice', '-n', str(nice)] + cmd
+    # 虚拟内存上限在exec之前设置，之后启动的tesseract等子进程继承该上限
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors='replace',
+        preexec_fn=_set_address_space(memory_limit) if memory_limit else None
+    )
+    watch = MemoryWatch(process.pid, tree_limit) if tree_limit else contextlib.nullcontext()
+    with watch:
+        for line in process.stderr:
+            line = line.rstrip()
+            tail.append(line)
+            on_line(line)
+        # 用wait4同时取得进程及其已回收子进程（tesseract、ghostscript等）的资源用量
+        _, status, usage = os.wait4(process.pid, 0)
+    returncode = process.returncode = os.waitstatus_to_exitcode(status)
+    RUN_CPU.observe(usage.ru_utime + usage.ru_stime, engine=engine)
+    
+    # 检查处理结果
+    if returncode != 0:
+        exceeded = tree_limit and watch.exceeded
+        RUN_FAILURES.inc(cause='memory_limit' if exceeded else _memory_failure(tail)
+                         or EXIT_CODE_CAUSES.get(returncode, 'signal' if returncode < 0 else 'other_error'))
+        logging.error(f"OCR处理失败 (返回码 {returncode}): " + '\n'.join(tail))
+        return False
+    return True
+
+def build_optimize_cmd(input_path, output_path, level):
+    """直接调用ocrmypdf优化器的命令，不经过光栅化、OCR和PDF/A转换
+    
+    第一阶段的输出已经是最终格式（PDF/A），第二阶段只需要重新压缩图像和对象流，
+    优化器保留原有的XMP元数据，结果仍然是PDF/A。
+    """
+    return [sys.executable, '-m', 'ocrmypdf.optimize', input_path, output_path, str(level)]
+
+def run_optimizer(input_path, output_path, options, nice=0):
+    """以 options['optimize_level'] 优化已完成的PDF，内存限制与 run_ocrmypdf 相同，成功返回True"""
+    cmd = build_optimize_cmd(input_path, output_path, options['optimize_level'])
+    return _run_command(cmd, address_space_limit(options), rss_limit(options), lambda line: None,
+                        nice, engine='optimize')
+
+_warm_pool = None
+_warm_pool_lock = threading.Lock()
+
+def get_warm_pool():
+    """按需创建常驻OCR工作进程池"""
+    global _warm_pool
+    with _warm_pool_lock:
+        if _warm_pool is None:
+            _warm_pool = WarmWorkerPool(
+                size=app.config['OCR_WARM_WORKERS'],
+                max_jobs=app.config['OCR_WARM_MAX_JOBS'],
+                max_rss=app.config['OCR_WARM_MAX_RSS_MB'] * 1024 * 1024,
+                tail_lines=app.config['OCR_STDERR_TAIL_LINES'],
+            )
+            atexit.register(_warm_pool.close)
+        return _warm_pool
+
+def count_pages(input_path):
+    """读取PDF页数，无法读取时返回None"""
+    if pikepdf is None:
+        return None
+    try:
+        with pikepdf.open(input_path) as pdf:
+            return len(pdf.pages)
+    except Exception as e:
+        logging.warning(f"无法读取PDF页数 {os.path.basename(input_path)}: {str(e)}")
+        return None
+
+# 预扫描：判断每页是否已有文字层，只把需要的页面交给OCR
+app.config['OCR_PRESCAN_IMAGE_COVERAGE'] = max(0, min(100, get_env_int('OCR_PRESCAN_IMAGE_COVERAGE', 10)))
+TEXT_OPERATORS = {'Tj', 'TJ', "'", '"'}
+
+def format_page_ranges(pages):
+    """将页码列表格式化为ocrmypdf --pages参数，例如 [1, 2, 3, 7] -> "1-3,7" """
+    ranges = []
+    for page in sorted(pages):
+        if ranges and page == ranges[-1][1] + 1:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+    return ','.join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+def _shows_text(operands):
+    """文本绘制操作是否输出了非空字符串"""
+    for operand in operands:
+        if isinstance(operand, pikepdf.String) and len(bytes(operand)):
+            return True
+        if isinstance(operand, pikepdf.Array) and any(
+                isinstance(item, pikepdf.String) and len(bytes(item)) for item in operand):
+            return True
+    return False
+
+def _scan_content(stream, resources, ctm, depth=0):
+    """扫描内容流，返回 (是否有文字, 图像覆盖面积)，面积以默认用户空间计"""
+    image_area = 0.0
+    stack = []
+    xobjects = resources.get('/XObject', {}) if resources is not None else {}
+    for operands, operator in pikepdf.parse_content_stream(stream):
+        op = str(operator)
+        if op in TEXT_OPERATORS:
+            if _shows_text(operands):
+                return True, image_area
+        elif op == 'q':
+            stack.append(ctm)
+        elif op == 'Q':
+            if stack:
+                ctm = stack.pop()
+        elif op == 'cm':
+            ctm = pikepdf.Matrix(*[float(x) for x in operands]) @ ctm
+        elif op == 'INLINE IMAGE':
+            image_area += abs(ctm.a * ctm.d - ctm.b * ctm.c)
+        elif op == 'Do' and operands:
+            xobject = xobjects.get(str(operands[0]))
+            if xobject is None:
+                continue
+            subtype = xobject.get('/Subtype')
+            if subtype == '/Image':
+                image_area += abs(ctm.a * ctm.d - ctm.b * ctm.c)
+            elif subtype == '/Form' and depth < 8:
+                matrix = pikepdf.Matrix(*[float(x) for x in xobject.get('/Matrix', [1, 0, 0, 1, 0, 0])])
+                form_text, form_area = _scan_content(xobject, xobject.get('/Resources', resources),
+                                                     matrix @ ctm, depth + 1)
+                if form_text:
+                    return True, image_area
+                image_area += form_area
+    return False, image_area
+
+def classify_page(page, min_coverage):
+    """判断页面类型：'text' 已有文字层，'image' 需要OCR的扫描页，'empty' 无文字也无明显图像"""
+    box = page.mediabox
+    page_area = abs(float(box[2]) - float(box[0])) * abs(float(box[3]) - float(box[1])) or 1.0
+    has_text, image_area = _scan_content(page, page.obj.get('/Resources'), pikepdf.Matrix())
+    if has_text:
+        return 'text'
+    if image_area / page_area >= min_coverage:
+        return 'image'
+    return 'empty'
+
+def prescan_pdf(input_path):
+    """逐页预扫描PDF，返回需要OCR的页码（从1开始）和各类页面数量"""
+    min_coverage = app.config['OCR_PRESCAN_IMAGE_COVERAGE'] / 100
+    counts = {'text': 0, 'image': 0, 'empty': 0}
+    ocr_pages = []
+    with pikepdf.open(input_path) as pdf:
+        for number, page in enumerate(pdf.pages, start=1):
+            try:
+                kind = classify_page(page, min_coverage)
+            except Exception as e:
+                # 无法解析的页面交给ocrmypdf处理
+                logging.warning(f"预扫描第 {number} 页失败: {str(e)}")
+                kind = 'image'
+            counts[kind] += 1
+            if kind == 'image':
+                ocr_pages.append(number)
+    page_count = sum(counts.values())
+    report = {
+        'pages': page_count,
+        'text_pages': counts['text'],
+        'image_pages': counts['image'],
+        'empty_pages': counts['empty'],
+        'ocr_pages': len(ocr_pages),
+        'skipped_pages': page_count - len(ocr_pages),
+    }
+    logging.info(f"预扫描 {os.path.basename(input_path)}: 共 {page_count} 页，{counts['text']} 页已有文字，"
+                 f"{counts['empty']} 页无图像，{len(ocr_pages)} 页需要OCR")
+    return ocr_pages, report
+
+def _outline_page_index(pdf, item, page_numbers):
+    """解析书签指向的页码，无法解析时返回None"""
+    dest = item.destination
+    if dest is None and item.action is not None and item.action.get('/S') == '/GoTo':
+        dest = item.action.get('/D')
+    if isinstance(dest, (pikepdf.String, pikepdf.Name)):
+        # 命名目标，在 /Dests 或 /Names /Dests 中查找
+        name = str(dest).lstrip('/')
+        try:
+            if '/Dests' in pdf.Root:
+                dest = pdf.Root.Dests.get('/' + name)
+            else:
+                dest = pikepdf.NameTree(pdf.Root.Names.Dests).get(name)
+        except Exception:
+            return None
+        if isinstance(dest, pikepdf.Dictionary):
+            dest = dest.get('/D')
+    if isinstance(dest, pikepdf.Array) and len(dest) > 0:
+        return page_numbers.get(dest[0].objgen)
+    return None
+
+def _import_object(pdf, obj):
+    """把其他文件中的对象复制到 pdf 中
+
+    copy_foreign 只接受间接对象；/MarkInfo、/Lang、/OutputIntents 等常以直接对象
+    出现，直接的字典和数组逐项重建，其中的间接对象（如 /DestOutputProfile）再复制。
+    """
+    if not isinstance(obj, pikepdf.Object):
+        return obj
+    if obj.is_indirect:
+        return pdf.copy_foreign(obj)
+    if isinstance(obj, pikepdf.Dictionary):
+        return pikepdf.Dictionary({key: _import_object(pdf, value) for key, value in obj.items()})
+    if isinstance(obj, pikepdf.Array):
+        return pikepdf.Array([_import_object(pdf, value) for value in obj])
+    return obj
+
+def _copy_outline(source, merged):
+    """将原始文件的书签复制到合并后的文件，按页码重新定位"""
+    page_numbers = {page.obj.objgen: index for index, page in enumerate(source.pages)}
+    
+    def convert(items):
+        converted = []
+        for item in items:
+            page_index = _outline_page_index(source, item, page_numbers)
+            new_item = pikepdf.OutlineItem(item.title, page_index)
+            new_item.is_closed = item.is_closed
+            new_item.children.extend(convert(item.children))
+            converted.append(new_item)
+        return converted
+    
+    with source.open_outline() as src_outline, merged.open_outline() as dst_outline:
+        dst_outline.root.extend(convert(src_outline.root))
+
+def write_skipped_sidecar(path, page_count):
+    """为没有识别的页面写入与ocrmypdf相同的占位文本"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for number in range(1, page_count + 1):
+            f.write(f"[OCR skipped on page {number}]\f")
+
+def copy_without_ocr(input_path, output_path, options, page_count):
+    """预扫描没有找到需要识别的页面时不运行ocrmypdf，不栅格化任何页面
+
+    优化级别为0时直接复制；否则用pikepdf压缩内容流并生成对象流（相当于
+    无损优化中不涉及图像的部分）。
+    """
+    if pikepdf is not None and int(options.get('optimize_level', 1)) > 0:
+        with pikepdf.open(input_path) as pdf:
+            pdf.save(output_path, compress_streams=True,
+                     object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    else:
+        shutil.copyfile(input_path, output_path)
+    if options.get('sidecar'):
+        write_skipped_sidecar(options['sidecar'], page_count)
+    return True
+
+def process_sharded(input_path, output_path, options, page_count, progress=None):
+    """按页范围拆分大文件，并行运行多个ocrmypdf进程后合并结果"""
+    shard_pages = app.config['OCR_SHARD_PAGES']
+    ranges = [(start, min(start + shard_pages, page_count)) for start in range(0, page_count, shard_pages)]
+    # 本任务分到的核心在各分片之间平分
+    cores = options.get('jobs') or 1
+    parallel = max(1, min(cores, len(ranges)))
+    shard_options = []
+    for start, end in ranges:
+        shard_option = dict(options, jobs=max(1, cores // parallel))
+        if options.get('memory_mb'):
+            # 各分片进程平分任务预留的内存
+            shard_option['memory_mb'] = max(1, options['memory_mb'] // parallel)
+        if options.get('pages') is not None:
+            # 预扫描的页码换算为分片内的页码
+            shard_option['pages'] = [page - start for page in options['pages'] if start < page <= end]
+        shard_options.append(shard_option)
+    sidecar = options.get('sidecar')
+    logging.info(f"将 {os.path.basename(input_path)} 的 {page_count} 页拆分为 {len(ranges)} 个分片，"
+                 f"并行 {parallel} 个")
+    
+    with tempfile.TemporaryDirectory(prefix='ocr-shards-', dir=app.config['UPLOAD_FOLDER']) as work_dir:
+        with trace_span(progress, 'split'), pikepdf.open(input_path) as source:
+            shard_inputs = []
+            for index, (start, end) in enumerate(ranges):
+                shard_path = os.path.join(work_dir, f"shard_{index:04d}.pdf")
+                with pikepdf.new() as shard:
+                    shard.pages.extend(source.pages[start:end])
+                    shard.docinfo = shard.make_indirect(_import_object(shard, source.docinfo))
+                    shard.save(shard_path)
+                shard_inputs.append(shard_path)
         
-        # 构建OCRmyPDF命令
-        cmd = ['ocrmypdf', '--optimize', str(optimize_level)]
+        shard_outputs = [path + '_ocr.pdf' for path in shard_inputs]
+        if sidecar:
+            for shard_option, shard_path in zip(shard_options, shard_inputs):
+                shard_option['sidecar'] = shard_path + '.txt'
         
-        # 添加语言选项
-        if language:
-            cmd.extend(['-l', language])
+        def run_shard(index):
+            start, end = ranges[index]
+            if shard_options[index].get('pages') == []:
+                # 分片中没有需要识别的页面，原样合并
+                shard_outputs[index] = shard_inputs[index]
+                if sidecar:
+                    write_skipped_sidecar(shard_options[index]['sidecar'], end - start)
+                return True
+            with trace_span(progress, 'ocrmypdf', track=f"shard {index:04d}", pages=f"{start + 1}-{end}"):
+                return run_ocrmypdf(shard_inputs[index], shard_outputs[index], shard_options[index],
+                                    progress, page_offset=start)
         
-        # 添加其他选项
-        if deskew:
-            cmd.append('--deskew')
+        with ThreadPoolExecutor(max_workers=parallel) as pool:
+            results = list(pool.map(run_shard, range(len(ranges))))
+        if not all(results):
+            logging.error(f"{results.count(False)} 个分片处理失败: {os.path.basename(input_path)}")
+            return False
         
-        if rotate_pages:
-            cmd.append('--rotate-pages')
+        # 合并分片，保留原文件的书签、页码标签和文档信息
+        if progress is not None:
+            progress.stage('merging')
+        with trace_span(progress, 'merge'), pikepdf.open(input_path) as source, pikepdf.new() as merged:
+            opened = [pikepdf.open(path) for path in shard_outputs]
+            try:
+                for shard in opened:
+                    merged.pages.extend(shard.pages)
+                first = opened[0]
+                # XMP元数据和输出意图来自ocrmypdf生成的分片，保持PDF/A信息
+                for key in ('/Metadata', '/OutputIntents', '/MarkInfo', '/Lang'):
+                    if key in first.Root:
+                        merged.Root[key] = _import_object(merged, first.Root[key])
+                if '/PageLabels' in source.Root:
+                    merged.Root.PageLabels = _import_object(merged, source.Root.PageLabels)
+                merged.docinfo = merged.make_indirect(_import_object(merged, first.docinfo))
+                _copy_outline(source, merged)
+                merged.save(output_path)
+            finally:
+                for shard in opened:
+                    shard.close()
+        if sidecar:
+            # 按页拼接各分片的文本
+            with open(sidecar, 'w', encoding='utf-8') as f:
+                for (start, end), shard_option in zip(ranges, shard_options):
+                    for text in read_sidecar(shard_option['sidecar'], end - start):
+                        f.write(text + '\f')
+    return True
+
+def trace_span(progress, name, **args):
+    """任务开启性能分析时记录一个区间，否则什么也不做"""
+    if progress is None or progress.trace is None:
+        return contextlib.nullcontext()
+    return progress.trace.span(name, **args)
+
+# OCR处理函数
+def process_pdf_file(input_path, options, output_path=None, progress=None):
+    """处理PDF文件，应用OCR并返回新文件路径
+    
+    progress 不为空时，通过它报告总页数、已开始处理的页和当前阶段；
+    任务开启了性能分析时，同时记录各阶段的时间线。
+    """
+    try:
+        # 定义输出路径
+        if output_path is None:
+            output_path = input_path + '_ocr.pdf'
         
-        if remove_background:
-            cmd.append('--remove-background')
+        with trace_span(progress, 'count_pages'):
+            page_count = count_pages(input_path)
+        if progress is not None:
+            progress.start(page_count)
         
-        if force_ocr:
-            cmd.append('--force-ocr')
-            
-        if not ocr_enabled:
-            cmd.append('--skip-text')
+        # 预扫描文字层，跳过已有文字的页面
+        if (options.get('prescan') and options.get('ocr_enabled', True) and not options.get('force_ocr')
+                and page_count):
+            if progress is not None:
+                progress.stage('prescan')
+            with trace_span(progress, 'prescan'):
+                ocr_pages, report = prescan_pdf(input_path)
+            options = dict(options, pages=ocr_pages)
+            if progress is not None:
+                progress.prescan(report)
+                progress.stage('ocr')
         
-        # 添加引擎选项
-        cmd.extend(['--pdf-renderer', 'hocr'])
-        cmd.extend(['--tesseract-oem', '1'])
+        if options.get('pages') == []:
+            logging.info(f"{os.path.basename(input_path)} 没有需要OCR的页面，不运行ocrmypdf")
+            return output_path if copy_without_ocr(input_path, output_path, options, page_count) else None
         
-        # 添加输入和输出路径
-        cmd.extend([input_path, output_path])
+        # 页数较多的文件拆分后并行处理
+        shard_min_pages = app.config['OCR_SHARD_MIN_PAGES']
+        if shard_min_pages and page_count and page_count >= shard_min_pages and page_count > app.config['OCR_SHARD_PAGES']:
+            return output_path if process_sharded(input_path, output_path, options, page_count, progress) else None
         
         # 运行OCRmyPDF命令
-        process = subprocess.run(
-            cmd, 
-            capture_output=True, 
-            text=True
-        )
-        
-        # 检查处理结果
-        if process.returncode != 0:
-            logging.error(f"OCR处理失败: {process.stderr}")
+        with trace_span(progress, 'ocrmypdf'):
+            ok = run_ocrmypdf(input_path, output_path, options, progress)
+        if not ok:
             return None
         
         return output_path
     
     except Exception as e:
+        RUN_FAILURES.inc(cause='exception')
         logging.exception(f"处理文件时出错: {str(e)}")
         return None
 
-# 生成HTML模板
-@app.route('/')
-def index():
-    # 获取/tmp目录下的所有PDF文件
-    pdf_files = []
-    for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-        if filename.lower().endswith('.pdf') and not filename.lower().endswith('_ocr.pdf'):
-            pdf_files.append(filename)
-    
-    # 生成简单的HTML页面
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>OCRmyPDF Web 界面</title>
-        <meta charset="utf-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                max-width: 900px;
-                margin: 0 auto;
-                padding: 20px;
-                line-height: 1.6;
-            }
-            .header {
-                text-align: center;
-                color: #1E88E5;
-                margin-bottom: 30px;
-            }
-            .container {
-                display: flex;
-                flex-wrap: wrap;
-                gap: 20px;
-            }
-            .column {
-                flex: 1;
-                min-width: 300px;
-            }
-            .section {
-                background-color: #f9f9f9;
-                border-radius: 8px;
-                padding: 20px;
-                margin-bottom: 20px;
-            }
-            .section-title {
-                font-size: 18px;
-                margin-bottom: 15px;
-                color: #333;
-            }
-            .form-group {
-                margin-bottom: 15px;
-            }
-            label {
-                display: block;
-                margin-bottom: 5px;
-            }
-            input, select {
-                width: 100%;
-                padding: 8px;
-                box-sizing: border-box;
-                border: 1px solid #ddd;
-                border-radius: 4px;
-            }
-            input[type="checkbox"] {
-                width: auto;
-                margin-right: 10px;
-            }
-            input[type="submit"] {
-                background-color: #1E88E5;
-                color: white;
-                border: none;
-                padding: 10px 20px;
-                cursor: pointer;
-                font-size: 16px;
-                margin-top: 20px;
-            }
-            input[type="submit"]:hover {
-                background-color: #1976D2;
-            }
-            .info-box {
-                background-color: #E3F2FD;
-                padding: 15px;
-                border-radius: 8px;
-                margin-bottom: 20px;
-            }
-            .file-input {
-                margin-top: 20px;
-            }
-            .sidebar {
-                background-color: #f0f0f0;
-                padding: 20px;
-                border-radius: 8px;
-            }
-            .message {
-                padding: 15px;
-                border-radius: 8px;
-                margin-bottom: 20px;
-            }
-            .success {
-                background-color: #D5F5E3;
-                color: #1E8449;
-            }
-            .error {
-                background-color: #FADBD8;
-                color: #C0392B;
-            }
-            .tabs {
-                display: flex;
-                margin-bottom: 20px;
-            }
-            .tab {
-                padding: 10px 20px;
-                cursor: pointer;
-                background-color: #f0f0f0;
-                border: 1px solid #ddd;
-                border-bottom: none;
-                border-radius: 5px 5px 0 0;
-                margin-right: 5px;
-            }
-            .tab.active {
-                background-color: #1E88E5;
-                color: white;
-            }
-            .tab-content {
-                display: none;
-            }
-            .tab-content.active {
-                display: block;
-            }
-            .file-list {
-                max-height: 200px;
-                overflow-y: auto;
-                border: 1px solid #ddd;
-                border-radius: 4px;
-                padding: 10px;
-                margin-bottom: 15px;
-            }
-            .file-item {
-                padding: 8px;
-                border-bottom: 1px solid #eee;
-                cursor: pointer;
-            }
-            .file-item:hover {
-                background-color: #f5f5f5;
-            }
-            .file-item.selected {
-                background-color: #E3F2FD;
+class JobRejected(Exception):
+    """服务繁忙时拒绝提交新任务"""
+
+class ResourceBudget:
+    """全局资源预算（CPU核心数、内存MB），按份额分配给正在运行的任务"""
+    
+    def __init__(self, total):
+        self.total = total
+        self.in_use = 0
+        self._cond = threading.Condition()
+    
+    def acquire(self, wanted, minimum=1):
+        """阻塞直到至少有 minimum 份空闲资源，返回实际分配的份额"""
+        wanted = max(1, min(wanted, self.total))
+        minimum = max(1, min(minimum, wanted))
+        with self._cond:
+            while self.total - self.in_use < minimum:
+                self._cond.wait()
+            granted = min(wanted, self.total - self.in_use)
+            self.in_use += granted
+            return granted
+    
+    def try_acquire(self, amount=1):
+        """不等待，有 amount 份空闲资源时分配并返回True"""
+        with self._cond:
+            if self.total - self.in_use < amount:
+                return False
+            self.in_use += amount
+            return True
+    
+    def release(self, amount):
+        with self._cond:
+            self.in_use -= amount
+            self._cond.notify_all()
+    
+    def snapshot(self):
+        with self._cond:
+            return {'total': self.total, 'in_use': self.in_use}
+
+cpu_budget = ResourceBudget(app.config['OCR_CPU_BUDGET'])
+memory_budget = ResourceBudget(app.config['OCR_MEMORY_BUDGET_MB'])
+stream_budget = ResourceBudget(app.config['OCR_MAX_STREAMS'])
+
+# 优先级按估算成本划分，只用于统计排队等待时间
+PRIORITY_CLASSES = ('small', 'medium', 'large')
+
+class JobScheduler:
+    """按估算成本和客户端公平份额选择下一个任务
+    
+    每个客户端累计已分配任务的成本作为虚拟时间，选择任务时比较
+    “客户端虚拟时间 + 任务有效成本”，同一客户端内小任务优先，多个客户端
+    之间按已获得的处理量轮流。有效成本随排队时间降低，排队超过 max_wait
+    秒的任务按提交顺序最先执行，大文件不会一直被插队。
+    """
+    
+    def __init__(self, aging_seconds, max_wait, small_cost, large_cost):
+        self.aging_seconds = aging_seconds
+        self.max_wait = max_wait
+        self.small_cost = small_cost
+        self.large_cost = large_cost
+        self._queued = {}     # 客户端 -> 排队中的任务列表
+        self._served = {}     # 客户端 -> 虚拟时间（已分配任务的成本之和）
+        self._count = 0
+        self._waits = {name: deque(maxlen=1000) for name in PRIORITY_CLASSES}
+        self._dispatched = {name: 0 for name in PRIORITY_CLASSES}
+        self._cond = threading.Condition()
+    
+    def classify(self, cost):
+        if cost <= self.small_cost:
+            return 'small'
+        if cost <= self.large_cost:
+            return 'medium'
+        return 'large'
+    
+    def put(self, job_id, cost, client):
+        with self._cond:
+            if not self._queued.get(client):
+                # 重新开始排队的客户端从当前最小虚拟时间起算，空闲期间不积累额度
+                backlogged = [self._served[c] for c, entries in self._queued.items() if entries]
+                floor = min(backlogged) if backlogged else 0
+                self._served[client] = max(self._served.get(client, 0), floor)
+            self._queued.setdefault(client, []).append({
+                'job_id': job_id,
+                'cost': cost,
+                'client': client,
+                'priority': self.classify(cost),
+                'queued_at': time.monotonic(),
+            })
+            self._count += 1
+            self._cond.notify()
+    
+    def _pick(self, now):
+        best, best_score = None, None
+        for client, entries in self._queued.items():
+            for entry in entries:
+                waited = now - entry['queued_at']
+                if waited >= self.max_wait:
+                    score = (0, entry['queued_at'])
+                else:
+                    score = (1, self._served[client] + entry['cost'] / (1 + waited / self.aging_seconds))
+                if best_score is None or score < best_score:
+                    best, best_score = entry, score
+        return best
+    
+    def get(self):
+        """阻塞直到有排队的任务，返回下一个要执行的任务ID"""
+        with self._cond:
+            while not self._count:
+                self._cond.wait()
+            now = time.monotonic()
+            entry = self._pick(now)
+            client = entry['client']
+            self._queued[client].remove(entry)
+            if not self._queued[client]:
+                del self._queued[client]
+            self._count -= 1
+            self._served[client] += entry['cost']
+            if not self._count:
+                self._served.clear()
+            self._waits[entry['priority']].append(now - entry['queued_at'])
+            QUEUE_WAIT.observe(now - entry['queued_at'], priority=entry['priority'])
+            self._dispatched[entry['priority']] += 1
+            return entry['job_id']
+    
+    def qsize(self):
+        with self._cond:
+            return self._count
+    
+    def stats(self):
+        """每个优先级的排队数和最近的排队等待时间（秒）"""
+        now = time.monotonic()
+        with self._cond:
+            queued = {name: 0 for name in PRIORITY_CLASSES}
+            for entries in self._queued.values():
+                for entry in entries:
+                    queued[entry['priority']] += 1
+            classes = {}
+            for name in PRIORITY_CLASSES:
+                waits = sorted(self._waits[name])
+                classes[name] = {
+                    'queued': queued[name],
+                    'dispatched': self._dispatched[name],
+                    'wait_avg': sum(waits) / len(waits) if waits else None,
+                    'wait_p50': waits[len(waits) // 2] if waits else None,
+                    'wait_p95': waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else None,
+                    'wait_max': waits[-1] if waits else None,
+                }
+            oldest = min((entry['queued_at'] for entries in self._queued.values() for entry in entries), default=None)
+            return {
+                'queued': self._count,
+                'clients': {client: len(entries) for client, entries in self._queued.items()},
+                'oldest_wait': now - oldest if oldest is not None else None,
+                'classes': classes,
             }
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>OCRmyPDF Web 界面</h1>
-        </div>
+
+# 任务队列 - 提交后立即返回任务ID，由后台工作线程执行OCR
+jobs = {}
+jobs_lock = threading.Lock()
+# 任务状态变化时通知等待中的进度订阅者
+jobs_changed = threading.Condition(jobs_lock)
+job_queue = JobScheduler(app.config['OCR_SCHED_AGING_SECONDS'], app.config['OCR_SCHED_MAX_WAIT'],
+                         app.config['OCR_SCHED_SMALL_PAGES'], app.config['OCR_SCHED_LARGE_PAGES'])
+# 两阶段处理：先返回未优化的结果，再由后台线程按请求的级别优化并替换
+optimize_queue = queue.Queue()
+optimizing_outputs = {}   # 输出文件路径 -> 等待或正在优化的任务
+_workers = []
+_optimizer = None
+_recovered = False
+_workers_lock = threading.Lock()
+
+# 结果缓存 - 以输入文件内容哈希+规范化选项为键，相同提交直接复用结果
+result_cache = {}     # 缓存键 -> 输出文件路径
+inflight_jobs = {}    # 缓存键 -> 排队中或运行中的任务
+active_inputs = {}    # 输入文件路径 -> 正在使用它的任务数
+job_aliases = {}      # 任务ID -> 恢复时合并到该任务的重复任务记录，任务结束时一起写入任务库
+_digest_memo = OrderedDict()   # (路径, 大小, 修改时间) -> 内容哈希，按最近使用排序
+_digest_memo_lock = threading.Lock()
+# 记住的文件哈希数上限，超过后丢弃最久未使用的
+DIGEST_MEMO_SIZE = 10000
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def normalize_options(options):
+    """将处理选项规范化为稳定的JSON字符串，用于计算缓存键"""
+    normalized = {
+        'ocr_enabled': bool(options.get('ocr_enabled', True)),
+        'language': (options.get('language') or '').strip(),
+        'deskew': bool(options.get('deskew', False)),
+        'optimize_level': int(options.get('optimize_level', 1)),
+        'rotate_pages': bool(options.get('rotate_pages', False)),
+        'remove_background': bool(options.get('remove_background', False)),
+        'force_ocr': bool(options.get('force_ocr', False)),
+        'prescan': bool(options.get('prescan', False)),
+        'profile': bool(options.get('profile', False)),
+    }
+    # 只在启用时加入，已有结果的缓存键保持不变
+    if options.get('fast_preprocess'):
+        normalized['fast_preprocess'] = True
+    return json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+
+def make_cache_key(digest, options):
+    return hashlib.sha256(f"{digest}:{normalize_options(options)}".encode('utf-8')).hexdigest()
+
+def file_digest(path):
+    """计算文件内容的SHA-256，文件未变化时复用上次结果"""
+    stat = os.stat(path)
+    memo_key = (path, stat.st_size, stat.st_mtime_ns)
+    with _digest_memo_lock:
+        digest = _digest_memo.get(memo_key)
+        if digest is not None:
+            _digest_memo.move_to_end(memo_key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        _remember_digest(memo_key, digest)
+    return digest
+
+def _remember_digest(memo_key, digest):
+    with _digest_memo_lock:
+        _digest_memo[memo_key] = digest
+        _digest_memo.move_to_end(memo_key)
+        while len(_digest_memo) > DIGEST_MEMO_SIZE:
+            _digest_memo.popitem(last=False)
+
+def forget_digest(path):
+    """文件被删除后丢弃记住的哈希"""
+    with _digest_memo_lock:
+        for memo_key in [memo_key for memo_key in _digest_memo if memo_key[0] == path]:
+            del _digest_memo[memo_key]
+
+def _commit_upload(temp_path, digest, filename):
+    """把写完的临时文件改名为以内容哈希命名的输入文件，返回 (文件路径, 是否新建了文件)"""
+    input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{digest[:16]}_{filename}")
+    created = not os.path.exists(input_path)
+    if created:
+        os.replace(temp_path, input_path)
+    else:
+        os.remove(temp_path)
+    stat = os.stat(input_path)
+    _remember_digest((input_path, stat.st_size, stat.st_mtime_ns), digest)
+    return input_path, created
+
+def save_upload(file, filename):
+    """边写入边计算哈希保存上传文件，以内容哈希命名，重复内容不再保存副本
+    
+    返回 (文件路径, 内容哈希, 是否新建了文件)
+    """
+    return save_stream(file.stream, filename)
+
+def save_stream(stream, filename):
+    """与 save_upload 相同，数据来自任意可读的文件对象（例如ZIP中的文件）"""
+    folder = app.config['UPLOAD_FOLDER']
+    temp_path = os.path.join(folder, f".upload-{uuid.uuid4().hex}.part")
+    sha = hashlib.sha256()
+    try:
+        with open(temp_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+                sha.update(chunk)
+                f.write(chunk)
+        digest = sha.hexdigest()
+        input_path, created = _commit_upload(temp_path, digest, filename)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return input_path, digest, created
+
+# 可续传的分块上传
+UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+class ResumableUpload:
+    """一次分块上传：数据按偏移顺序直接写入临时文件，同时增量计算内容哈希
+    
+    上传信息保存在 .upload-<id>.json 中，服务重启后从磁盘恢复，
+    已写入的部分重新读取一遍以恢复哈希状态。
+    """
+    
+    def __init__(self, upload_id, filename, size, created_at):
+        folder = app.config['UPLOAD_FOLDER']
+        self.id = upload_id
+        self.filename = filename
+        self.size = size
+        self.created_at = created_at
+        self.path = os.path.join(folder, f".upload-{upload_id}.part")
+        self.meta_path = os.path.join(folder, f".upload-{upload_id}.json")
+        self.offset = 0
+        self.sha = hashlib.sha256()
+        self.lock = threading.Lock()
+    
+    @classmethod
+    def create(cls, filename, size):
+        upload = cls(uuid.uuid4().hex, filename, size, time.time())
+        open(upload.path, 'wb').close()
+        with open(upload.meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'filename': filename, 'size': size, 'created_at': upload.created_at}, f)
+        return upload
+    
+    @classmethod
+    def load(cls, upload_id):
+        """从磁盘恢复上传状态，不存在时返回None"""
+        folder = app.config['UPLOAD_FOLDER']
+        try:
+            with open(os.path.join(folder, f".upload-{upload_id}.json"), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        upload = cls(upload_id, meta['filename'], meta['size'], meta['created_at'])
+        if not os.path.exists(upload.path):
+            return None
+        with open(upload.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                upload.sha.update(chunk)
+                upload.offset += len(chunk)
+        return upload
+    
+    def write(self, stream, offset):
+        """从 offset 开始写入一个分块，返回写入后的偏移
         
-        <div class="container">
-            <div class="column">
-                <div class="tabs">
-                    <div class="tab active" onclick="switchTab('upload-tab')">上传新文件</div>
-                    <div class="tab" onclick="switchTab('existing-tab')">使用已有文件</div>
-                </div>
+        连接中断时已经收到的数据仍然有效，客户端查询偏移后从断点继续。
+        """
+        if offset != self.offset:
+            raise ValueError(f"偏移不匹配，当前已写入 {self.offset} 字节")
+        with open(self.path, 'r+b') as f:
+            f.seek(offset)
+            try:
+                for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+                    chunk = chunk[:self.size - self.offset]
+                    f.write(chunk)
+                    self.sha.update(chunk)
+                    self.offset += len(chunk)
+                    if self.offset >= self.size:
+                        break
+            except ClientDisconnected:
+                logging.info(f"分块上传 {self.id} 连接中断，已写入 {self.offset} 字节")
+            f.truncate(self.offset)
+        return self.offset
+    
+    def remove(self):
+        for path in (self.path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def status(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.offset,
+            'complete': self.offset == self.size,
+            'url': url_for('resumable_upload', upload_id=self.id),
+        }
+
+uploads = {}          # 上传ID -> ResumableUpload
+uploads_lock = threading.Lock()
+
+def get_upload(upload_id):
+    """查找分块上传，内存中没有时从磁盘恢复"""
+    if not UPLOAD_ID_RE.match(upload_id):
+        return None
+    with uploads_lock:
+        upload = uploads.get(upload_id)
+        if upload is not None and not upload.lock.locked():
+            # 多个gunicorn工作进程时分块可能由其他进程写入，文件大小不一致则重新恢复
+            try:
+                stale = os.path.getsize(upload.path) != upload.offset
+            except FileNotFoundError:
+                stale = True
+            if stale:
+                del uploads[upload_id]
+                upload = None
+        if upload is None:
+            upload = ResumableUpload.load(upload_id)
+            if upload is not None:
+                uploads[upload_id] = upload
+        return upload
+
+def remove_stale_uploads(ttl):
+    """删除超过 ttl 秒没有写入的未完成上传"""
+    folder = app.config['UPLOAD_FOLDER']
+    expire_before = time.time() - ttl
+    for entry in os.scandir(folder):
+        if not entry.name.startswith('.upload-'):
+            continue
+        try:
+            if entry.stat().st_mtime >= expire_before:
+                continue
+            upload_id = entry.name[len('.upload-'):].split('.', 1)[0]
+            with uploads_lock:
+                uploads.pop(upload_id, None)
+            os.remove(entry.path)
+            logging.info(f"删除过期的未完成上传: {entry.name}")
+        except FileNotFoundError:
+            pass
+
+class JobProgress:
+    """从ocrmypdf输出中收集任务进度，并通知进度订阅者"""
+    
+    def __init__(self, job):
+        self.job = job
+        self.trace = job.get('trace')
+        self.pages_seen = set()
+    
+    def _update(self, **changes):
+        # 调用方已持有 jobs_lock
+        self.job['progress'].update(changes)
+        self.job['version'] += 1
+        jobs_changed.notify_all()
+    
+    def start(self, pages_total):
+        with jobs_lock:
+            self._update(pages_total=pages_total, stage='ocr')
+    
+    def page(self, page_number):
+        self.pages([page_number])
+    
+    def pages(self, page_numbers):
+        with jobs_lock:
+            added = set(page_numbers) - self.pages_seen
+            if not added:
+                return
+            self.pages_seen.update(added)
+            self._update(pages_started=len(self.pages_seen))
+    
+    def prescan(self, report):
+        with jobs_lock:
+            self.job['prescan'] = report
+            self.job['version'] += 1
+            jobs_changed.notify_all()
+    
+    def page_cache(self, field):
+        with jobs_lock:
+            counts = self.job['progress'].setdefault('page_cache', {'hits': 0, 'misses': 0})
+            counts[field] += 1
+            self.job['version'] += 1
+            jobs_changed.notify_all()
+    
+    def stage(self, name):
+        if self.trace is not None:
+            self.trace.mark(DOCUMENT_TRACK, name)
+        with jobs_lock:
+            if self.job['progress'].get('stage') != name:
+                self._update(stage=name)
+
+def _job_public(job):
+    """返回可以对外展示的任务状态"""
+    return {
+        'id': job['id'],
+        'state': job['state'],
+        'filename': os.path.basename(job['input_path']),
+        'created_at': job['created_at'],
+        'started_at': job['started_at'],
+        'finished_at': job['finished_at'],
+        'error': job['error'],
+        'cores': job.get('cores'),
+        'cached': job['cached'],
+        'cost': job['cost'],
+        'memory_mb': job['memory_mb'],
+        'priority': job['priority'],
+        'progress': dict(job['progress']),
+        'prescan': job['prescan'],
+        'optimization': job['optimization'],
+        'result_url': url_for('job_result', job_id=job['id']) if job['state'] == 'done' else None,
+        'trace_url': url_for('job_trace', job_id=job['id']) if job['options'].get('profile') else None,
+    }
+
+def get_job(job_id):
+    """查找任务，内存中没有的已结束任务从任务库中读取"""
+    with jobs_lock:
+        job = jobs.get(job_id)
+    if job is None:
+        record = get_job_store().get(job_id)
+        if record is not None and record['state'] in FINISHED_STATES:
+            job = _job_from_record(record)
+    return job
+
+def _new_job(input_path, options, cache_key, remove_input_on_failure=False, client=None, cost=None):
+    now = time.time()
+    return {
+        'id': uuid.uuid4().hex,
+        'state': 'queued',  # queued / running / done / failed
+        'input_path': input_path,
+        'options': options,
+        'cache_key': cache_key,
+        'cached': False,
+        'output_path': None,
+        'error': None,
+        'remove_input_on_failure': remove_input_on_failure,
+        'client': client,
+        'cost': cost,
+        'priority': job_queue.classify(cost) if cost is not None else None,
+        'memory_mb': None,
+        'cores': None,
+        'attempts': 0,
+        'progress': {'pages_total': None, 'pages_started': 0, 'stage': 'queued'},
+        'prescan': None,
+        'optimization': None,  # 两阶段处理时: queued / running / done / failed / skipped
+        'trace': JobTrace(now) if options.get('profile') else None,
+        'version': 0,
+        'created_at': now,
+        'started_at': None,
+        'finished_at': None,
+    }
+
+def _job_from_record(record):
+    """由任务库中的记录重建任务字典"""
+    job = _new_job(record['input_path'], record['options'], record['cache_key'],
+                   record['remove_input_on_failure'], record['client'], record['cost'])
+    job.update({field: record[field] for field in (
+        'id', 'state', 'output_path', 'error', 'cached', 'priority', 'memory_mb', 'cores', 'attempts',
+        'optimization', 'created_at', 'started_at', 'finished_at')})
+    job['progress']['stage'] = record['state']
+    # 重新排队的任务从头记录时间线，已结束任务的时间线从任务库读取
+    job['trace'] = JobTrace(record['created_at']) if record['options'].get('profile') and \
+        record['state'] not in FINISHED_STATES else None
+    return job
+
+_job_store = None
+_job_store_lock = threading.Lock()
+_persist_lock = threading.Lock()
+
+def get_job_store():
+    """按需打开任务库，gunicorn预加载时不在主进程中打开，连接不会跨fork共享"""
+    global _job_store
+    with _job_store_lock:
+        if _job_store is None:
+            path = app.config['OCR_JOB_DB'] or os.path.join(app.config['UPLOAD_FOLDER'], '.jobs.sqlite3')
+            _job_store = JobStore(path)
+            logging.info(f"任务库: {path}")
+        return _job_store
+
+def persist_job(job):
+    """把任务当前状态写入任务库，写入失败只记录日志，不影响任务处理
+    
+    调用方不能持有 jobs_lock。
+    """
+    try:
+        with _persist_lock:
+            with jobs_lock:
+                snapshot = dict(job)
+            get_job_store().save(snapshot)
+    except sqlite3.Error:
+        logging.exception(f"保存任务 {job['id']} 的状态失败")
+
+def _trace_metadata(job):
+    """时间线附带的任务信息，调用方需持有 jobs_lock"""
+    return {
+        'job_id': job['id'],
+        'filename': os.path.basename(job['input_path']),
+        'state': job['state'],
+        'options': {key: value for key, value in job['options'].items() if key != 'jobs'},
+        'engine': app.config['OCR_ENGINE'],
+        'cores': job.get('cores'),
+        'pages_total': job['progress'].get('pages_total'),
+    }
+
+def persist_trace(job):
+    """把任务的处理时间线写入任务库，写入失败只记录日志"""
+    with jobs_lock:
+        metadata = _trace_metadata(job)
+    try:
+        get_job_store().save_trace(job['id'], job['trace'].chrome_trace(metadata))
+    except sqlite3.Error:
+        logging.exception(f"保存任务 {job['id']} 的时间线失败")
+
+def forget_finished_jobs():
+    """内存中的任务超过上限时丢弃最早的已结束任务，它们仍可从任务库查询"""
+    limit = app.config['OCR_JOBS_IN_MEMORY']
+    with jobs_lock:
+        if len(jobs) <= limit:
+            return
+        excess = len(jobs) - int(limit * 0.9)
+        finished = [job_id for job_id, job in jobs.items()
+                    if job['state'] in FINISHED_STATES and job['optimization'] not in ('queued', 'running')]
+        for job_id in finished[:excess]:
+            del jobs[job_id]
+
+def estimate_cost(input_path, page_count=None):
+    """按页数估算任务成本，页数未知时按文件大小折算；page_count 为已读取的页数"""
+    pages = (page_count if page_count is not None else count_pages(input_path)) or 0
+    size_pages = os.path.getsize(input_path) / app.config['OCR_SCHED_BYTES_PER_PAGE']
+    return max(1, pages, round(size_pages))
+
+# 内存估算参数：每个ocrmypdf进程的固定开销、每种语言模型的开销（MB），
+# 以及处理一页时同时存在的栅格图像份数
+PROCESS_BASE_MB = 150
+LANGUAGE_MODEL_MB = 60
+PAGE_IMAGE_COPIES = 4
+OPTION_IMAGE_COPIES = {'deskew': 2, 'remove_background': 3, 'rotate_pages': 1}
+# 快速预处理在灰度图像上拉平背景（灰度、放大后的背景和分段的中间结果）
+FAST_OPTION_IMAGE_COPIES = dict(OPTION_IMAGE_COPIES, remove_background=1)
+DEFAULT_RASTER_DPI = 300
+MEMORY_SAMPLE_PAGES = 50
+
+def _page_raster_bytes(page):
+    """估算ocrmypdf栅格化一页后的图像字节数"""
+    box = [float(value) for value in page.mediabox]
+    width_in, height_in = abs(box[2] - box[0]) / 72, abs(box[3] - box[1]) / 72
+    if width_in <= 0 or height_in <= 0:
+        return 0
+    dpi, components = 0, 1
+    # 旧版pikepdf没有 get_images，新版中 images 已弃用
+    images = page.get_images() if hasattr(page, 'get_images') else page.images
+    for image in images.values():
+        width, height = int(image.get('/Width', 0)), int(image.get('/Height', 0))
+        # 按图像铺满整页估算分辨率，ocrmypdf按页面中分辨率最高的图像栅格化
+        dpi = max(dpi, width / width_in, height / height_in)
+        colorspace = image.get('/ColorSpace')
+        if colorspace is not None and str(colorspace) != '/DeviceGray' and str(colorspace) != '/CalGray':
+            components = 3
+    dpi = min(max(dpi, 72), 1200) if dpi else DEFAULT_RASTER_DPI
+    return width_in * dpi * height_in * dpi * components
+
+def estimate_job_memory(input_path, options, cores):
+    """按页数、页面尺寸和图像分辨率估算任务的内存峰值（MB）
+    
+    ocrmypdf同时处理 cores 页，每页的栅格图像在栅格化、预处理和tesseract
+    中同时存在若干份；倾斜校正、去除背景等选项会增加份数。只抽样检查
+    最多 MEMORY_SAMPLE_PAGES 页，取其中最大的一页。
+    """
+    return _memory_estimator(input_path, options)(cores)
+
+def plan_job_memory(input_path, options, measured=None):
+    """返回 (最多使用的核心数, 预留内存MB)
+    
+    按 OCR_JOB_CORES 估算超过内存预算时减少核心数（同时处理的页数），
+    使估算值不超过预算；按最少核心数仍超过预算时抛出 JobRejected。
+    measured 为 measure_pdf 已读取的结果。
+    """
+    estimate = _memory_estimator(input_path, options, measured)
+    memory_total = app.config['OCR_MEMORY_BUDGET_MB']
+    min_cores = app.config['OCR_JOB_MIN_CORES']
+    cores = app.config['OCR_JOB_CORES']
+    while cores > min_cores and estimate(cores) > memory_total:
+        cores -= 1
+    memory_mb = estimate(cores)
+    if memory_mb > memory_total:
+        raise JobRejected(f"文件页面分辨率过高，预计需要 {memory_mb} MB 内存，"
+                          f"超过服务的内存上限 {memory_total} MB。")
+    return cores, memory_mb
+
+def measure_pdf(input_path):
+    """打开一次PDF，返回 (页数, 抽样页面中最大的栅格图像字节数)，无法读取时为None"""
+    page_count = page_bytes = None
+    if pikepdf is not None:
+        try:
+            with pikepdf.open(input_path) as pdf:
+                page_count = len(pdf.pages)
+                step = max(1, page_count // MEMORY_SAMPLE_PAGES)
+                page_bytes = max((_page_raster_bytes(pdf.pages[index]) for index in range(0, page_count, step)),
+                                 default=0)
+        except Exception as e:
+            logging.warning(f"无法读取PDF {os.path.basename(input_path)}: {str(e)}")
+    return page_count, page_bytes
+
+def _memory_estimator(input_path, options, measured=None):
+    """按 measure_pdf 的结果（没有时读取一次文件），返回按核心数计算估算值（MB）的函数"""
+    languages = len((options.get('language') or 'eng').split('+'))
+    page_count, page_bytes = measured if measured is not None else measure_pdf(input_path)
+    if page_bytes is None:
+        page_bytes = DEFAULT_RASTER_DPI ** 2 * 8.27 * 11.69 * 3
+    image_copies = FAST_OPTION_IMAGE_COPIES if options.get('fast_preprocess') else OPTION_IMAGE_COPIES
+    copies = PAGE_IMAGE_COPIES + sum(extra for option, extra in image_copies.items() if options.get(option))
+    per_page = page_bytes * copies / (1024 * 1024) + languages * LANGUAGE_MODEL_MB
+    shard_min_pages = app.config['OCR_SHARD_MIN_PAGES']
+    sharded = bool(shard_min_pages and page_count and page_count >= shard_min_pages
+                   and page_count > app.config['OCR_SHARD_PAGES'])
+    
+    def estimate(cores):
+        parallel = max(1, min(cores, page_count or cores))
+        # 分片处理时每个分片各有一个ocrmypdf进程
+        processes = parallel if sharded else 1
+        return int(processes * PROCESS_BASE_MB + parallel * per_page)
+    
+    return estimate
+
+def _reuse_job(input_path, options, cache_key, stored_output):
+    """命中结果缓存时返回新建的已完成任务，相同的任务正在处理时返回该任务，否则返回None
+    
+    调用方持有 jobs_lock。
+    """
+    cached_output = result_cache.get(cache_key) or stored_output
+    # 开启性能分析的任务总是重新处理，才能记录时间线
+    if cached_output and os.path.exists(cached_output) and not options.get('profile'):
+        job = _new_job(input_path, options, cache_key)
+        job.update(state='done', cached=True, output_path=cached_output,
+                   started_at=job['created_at'], finished_at=job['created_at'])
+        jobs[job['id']] = job
+        result_cache[cache_key] = cached_output
+        logging.info(f"任务 {job['id']} 命中结果缓存: {os.path.basename(cached_output)}")
+        RESULT_CACHE.inc(result='hit')
+        return job
+    result_cache.pop(cache_key, None)
+    
+    running = inflight_jobs.get(cache_key)
+    if running is not None:
+        RESULT_CACHE.inc(result='inflight')
+        logging.info(f"相同内容和选项的任务 {running['id']} 正在处理，复用该任务")
+    return running
+
+def submit_job(input_path, options, digest=None, remove_input_on_failure=False, client=None,
+               check_queue_limit=True):
+    """创建OCR任务并放入队列，返回任务字典；队列已满时抛出 JobRejected
+    
+    命中结果缓存时直接返回已完成的任务；相同内容和选项的任务正在处理时，
+    返回该任务而不再启动新的ocrmypdf进程。client 为提交任务的客户端标识，
+    用于在客户端之间公平调度。批量提交时整批检查一次排队上限，
+    check_queue_limit 为False。
+    """
+    if digest is None:
+        digest = file_digest(input_path)
+    cache_key = make_cache_key(digest, options)
+    # 内存中没有时查询任务库中以前的结果，服务重启后缓存仍然有效
+    stored_output = None if cache_key in result_cache else get_job_store().find_result(cache_key)
+    # 先查结果缓存和处理中的任务，复用时不需要读取文件，也不受内存预算限制
+    created = False
+    with jobs_lock:
+        job = _reuse_job(input_path, options, cache_key, stored_output)
+    if job is None:
+        measured = measure_pdf(input_path)
+        cost = estimate_cost(input_path, measured[0] or 0)
+        # 内存预算容纳不下时减少核心数；按最少核心数仍超过预算的文件永远无法运行，直接拒绝
+        max_cores, memory_mb = plan_job_memory(input_path, options, measured)
+        with jobs_lock:
+            # 读取文件期间可能有相同的任务提交或完成
+            job = _reuse_job(input_path, options, cache_key, stored_output)
+            if job is None:
+                if draining.is_set():
+                    raise JobRejected('服务正在停止，暂不接受新任务，请稍后再试。')
                 
-                <div id="upload-tab" class="tab-content active">
-                    <form action="/upload" method="post" enctype="multipart/form-data">
-                        <div class="section">
-                            <h2 class="section-title">OCR选项</h2>
-                            
-                            <div class="form-group">
-                                <input type="checkbox" id="ocr_enabled" name="ocr_enabled" value="true" checked>
-                                <label for="ocr_enabled">启用OCR文字识别</label>
-                            </div>
-                            
-                            <div class="form-group">
-                                <label for="language">识别语言</label>
-                                <select id="language" name="language">
-                                    <option value="eng+chi_sim">英语+简体中文</option>
-                                    <option value="eng">英语</option>
-                                    <option value="chi_sim">简体中文</option>
-                                    <option value="chi_sim_vert">简体中文垂直文本</option>
-                                </select>
-                            </div>
-                            
-                            <div class="form-group">
-                                <label for="optimize_level">文件优化级别 (0=不优化; 1=无损优化; 2=轻度有损; 3=最大压缩)</label>
-                                <input type="range" id="optimize_level" name="optimize_level" min="0" max="3" value="1">
-                            </div>
-                        </div>
-                        
-                        <div class="section">
-                            <h2 class="section-title">高级选项</h2>
-                            
-                            <div class="form-group">
-                                <input type="checkbox" id="deskew" name="deskew" value="true">
-                                <label for="deskew">自动校正倾斜</label>
-                            </div>
-                            
-                            <div class="form-group">
-                                <input type="checkbox" id="rotate_pages" name="rotate_pages" value="true">
-                                <label for="rotate_pages">自动旋转页面</label>
-                            </div>
-                            
-                            <div class="form-group">
-                                <input type="checkbox" id="remove_background" name="remove_background" value="true">
-                                <label for="remove_background">移除背景</label>
-                            </div>
-                            
-                            <div class="form-group">
-                                <input type="checkbox" id="force_ocr" name="force_ocr" value="true">
-                                <label for="force_ocr">强制OCR</label>
-                            </div>
-                        </div>
-                        
-                        <div class="section">
-                            <h2 class="section-title">上传PDF文件</h2>
-                            
-                            <div class="info-box">
-                                上传PDF文件后，系统将根据您选择的设置自动处理。请等待处理完成。
-                            </div>
-                            
-                            <div class="file-input">
-                                <input type="file" name="pdf_file" accept=".pdf" required>
-                            </div>
-                            
-                            <input type="submit" value="上传并处理">
-                        </div>
-                    </form>
-                </div>
+                max_queue = app.config['OCR_MAX_QUEUE']
+                if check_queue_limit and max_queue and job_queue.qsize() >= max_queue:
+                    logging.warning(f"排队任务已达上限 {max_queue}，拒绝新任务: {os.path.basename(input_path)}")
+                    raise JobRejected('服务器繁忙，排队任务已满，请稍后再试。')
                 
-                <div id="existing-tab" class="tab-content">
-                    <form action="/process-existing" method="post">
-                        <div class="section">
-                            <h2 class="section-title">OCR选项</h2>
-                            
-                            <div class="form-group">
-                                <input type="checkbox" id="ocr_enabled_ex" name="ocr_enabled" value="true" checked>
-                                <label for="ocr_enabled_ex">启用OCR文字识别</label>
-                            </div>
-                            
-                            <div class="form-group">
-                                <label for="language_ex">识别语言</label>
-                                <select id="language_ex" name="language">
-                                    <option value="eng+chi_sim">英语+简体中文</option>
-                                    <option value="eng">英语</option>
-                                    <option value="chi_sim">简体中文</option>
-                                    <option value="chi_sim_vert">简体中文垂直文本</option>
-                                </select>
-                            </div>
-                            
-                            <div class="form-group">
-                                <label for="optimize_level_ex">文件优化级别 (0=不优化; 1=无损优化; 2=轻度有损; 3=最大压缩)</label>
-                                <input type="range" id="optimize_level_ex" name="optimize_level" min="0" max="3" value="1">
-                            </div>
-                        </div>
-                        
-                        <div class="section">
-                            <h2 class="section-title">高级选项</h2>
-                            
-                            <div class="form-group">
-                                <input type="checkbox" id="deskew_ex" name="deskew" value="true">
-                                <label for="deskew_ex">自动校正倾斜</label>
-                            </div>
-                            
-                            <div class="form-group">
-                                <input type="checkbox" id="rotate_pages_ex" name="rotate_pages" value="true">
-                                <label for="rotate_pages_ex">自动旋转页面</label>
-                            </div>
-                            
-                            <div class="form-group">
-                                <input type="checkbox" id="remove_background_ex" name="remove_background" value="true">
-                                <label for="remove_background_ex">移除背景</label>
-                            </div>
-                            
-                            <div class="form-group">
-                                <input type="checkbox" id="force_ocr_ex" name="force_ocr" value="true">
-                                <label for="force_ocr_ex">强制OCR</label>
-                            </div>
-                        </div>
-                        
-                        <div class="section">
-                            <h2 class="section-title">选择现有PDF文件</h2>
-                            
-                            <div class="info-box">
-                                从已经存在的文件中选择一个PDF文件进行处理。这些文件已经存在于服务器上，无需重新上传。
-                            </div>
-                            
-                            <div class="form-group">
-                                <label for="existing_file">选择文件:</label>
-                                <div class="file-list" id="file-list">
-                                    """
-    
-    # 添加PDF文件列表
-    for i, pdf_file in enumerate(pdf_files):
-        html += f'<div class="file-item" onclick="selectFile(this, \'{pdf_file}\')">{pdf_file}</div>'
-    
-    if not pdf_files:
-        html += '<div>没有找到PDF文件。请先上传文件或将文件放入uploads目录。</div>'
-    
-    html += """
-                                </div>
-                                <input type="hidden" id="selected_file" name="selected_file" required>
-                            </div>
-                            
-                            <input type="submit" value="处理选中文件" id="process-btn" disabled>
-                        </div>
-                    </form>
-                </div>
-            </div>
-            
-            <div class="column">
-                <div class="sidebar">
-                    <h2>关于</h2>
-                    <p>这是一个基于 <a href="https://github.com/jbarlow83/OCRmyPDF" target="_blank">OCRmyPDF</a> 的网页工具。</p>
-                    
-                    <h3>特点:</h3>
-                    <ul>
-                        <li>对PDF文件进行OCR识别</li>
-                        <li>支持多种语言</li>
-                        <li>文件优化选项</li>
-                        <li>简单易用的界面</li>
-                    </ul>
-                    
-                    <h3>如何使用</h3>
-                    <ol>
-                        <li>选择OCR选项</li>
-                        <li>上传PDF文件或选择已有文件</li>
-                        <li>等待处理完成</li>
-                        <li>下载处理后的PDF</li>
-                    </ol>
-                    
-                    <hr>
-                    <p>基于 jbarlow83/ocrmypdf-alpine</p>
-                </div>
-            </div>
-        </div>
+                RESULT_CACHE.inc(result='miss')
+                job = _new_job(input_path, options, cache_key, remove_input_on_failure, client, cost)
+                job['memory_mb'] = memory_mb
+                # 开始运行前为核心数上限，运行时为实际分到的核心数
+                job['cores'] = max_cores
+                jobs[job['id']] = job
+                inflight_jobs[cache_key] = job
+                active_inputs[input_path] = active_inputs.get(input_path, 0) + 1
+                created = True
+    if not (created or job['cached']):
+        return job  # 复用处理中的任务
+    # 先写入任务库再放入队列，工作线程更新状态时记录已经存在
+    persist_job(job)
+    if job['cached']:
+        touch_artifact(job['output_path'])
+        return job
+    start_workers()
+    job_queue.put(job['id'], cost, client)
+    logging.info(f"任务 {job['id']} 已加入队列: {os.path.basename(input_path)}，"
+                 f"估算成本 {cost} 页，客户端 {client}")
+    return job
+
+def finish_job(job, output_path, error=None):
+    """记录任务结果，更新缓存并释放对输入文件的占用"""
+    with jobs_lock:
+        job['finished_at'] = time.time()
+        if output_path:
+            job['state'] = 'done'
+            job['output_path'] = output_path
+            result_cache[job['cache_key']] = output_path
+        else:
+            job['state'] = 'failed'
+            job['error'] = error or 'PDF处理失败，请检查日志获取更多信息。'
+        job['progress']['stage'] = job['state']
+        job['version'] += 1
+        jobs_changed.notify_all()
+        JOBS_FINISHED.inc(state=job['state'])
+        inflight_jobs.pop(job['cache_key'], None)
+        duplicates = job_aliases.pop(job['id'], [])
+        input_path = job['input_path']
+        active_inputs[input_path] -= 1
+        input_in_use = active_inputs[input_path] > 0
+        if not input_in_use:
+            del active_inputs[input_path]
+    persist_job(job)
+    for duplicate in duplicates:
+        duplicate.update({field: job[field] for field in ('state', 'output_path', 'error', 'started_at', 'finished_at')})
+        duplicate['progress']['stage'] = job['state']
+        persist_job(duplicate)
+    forget_finished_jobs()
+    if hot_folder is not None:
+        hot_folder.job_finished(job)
+    
+    if output_path:
+        logging.info(f"任务 {job['id']} 完成，耗时 {job['finished_at'] - job['started_at']:.1f} 秒")
+    elif job['remove_input_on_failure'] and not input_in_use and os.path.exists(input_path):
+        # 处理失败，删除临时文件
+        os.remove(input_path)
+        forget_digest(input_path)
+
+def job_output_path(job):
+    """任务的输出文件路径，同一输入的不同选项对应不同文件"""
+    return f"{job['input_path']}_{job['cache_key'][:12]}_ocr.pdf"
+
+# 后台优化进程的nice值，让出CPU给OCR任务
+OPTIMIZE_NICE = 10
+
+def is_two_phase(options):
+    """是否先生成不优化的结果，再在后台优化"""
+    return (bool(options.get('fast_first')) and options.get('ocr_enabled', True)
+            and int(options.get('optimize_level', 1)) > 0)
+
+def _file_size(path):
+    """文件大小，文件不存在时返回None"""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+def observe_output_ratio(input_size, output_path, optimize_level):
+    """记录输出/输入大小之比，任一文件已被清理时跳过"""
+    output_size = _file_size(output_path)
+    if input_size and output_size is not None:
+        OUTPUT_RATIO.observe(output_size / input_size, optimize_level=optimize_level)
+
+def record_output_metrics(job, output_path, optimize_level, input_size):
+    """记录处理耗时、速度和输出/输入大小之比"""
+    wall = time.time() - job['started_at']
+    JOB_WALL.observe(wall, engine=app.config['OCR_ENGINE'])
+    pages = job['progress'].get('pages_total')
+    if pages and wall > 0:
+        PAGES_PER_SECOND.observe(pages / wall)
+    observe_output_ratio(input_size, output_path, optimize_level)
+
+def run_job(job):
+    """在工作线程中执行单个任务"""
+    options = job['options']
+    two_phase = is_two_phase(options)
+    if two_phase:
+        # 第一阶段不优化，尽快得到可搜索的文件
+        options = dict(options, optimize_level=0)
+    # 处理期间输入文件可能被删除或被保留策略清理，先记录大小
+    input_size = _file_size(job['input_path'])
+    sidecar = None
+    if app.config['OCR_SEARCH_INDEX'] and options.get('ocr_enabled', True):
+        fd, sidecar = tempfile.mkstemp(prefix='.sidecar-', suffix='.txt', dir=app.config['UPLOAD_FOLDER'])
+        os.close(fd)
+        options = dict(options, sidecar=sidecar)
+    try:
+        output_path = _run_job(job, options, two_phase, input_size)
+        if sidecar is not None and output_path:
+            index_job_text(job, output_path, sidecar)
+    finally:
+        if sidecar is not None and os.path.exists(sidecar):
+            os.remove(sidecar)
+
+def _run_job(job, options, two_phase, input_size):
+    """获取资源份额并处理任务，返回输出文件路径，失败时返回None"""
+    trace = job['trace']
+    dispatched_at = time.time()
+    # 先获取内存份额，再获取CPU份额，预算用完时在此排队
+    memory_mb = memory_budget.acquire(job['memory_mb'], job['memory_mb'])
+    max_cores = min(job['cores'] or app.config['OCR_JOB_CORES'], app.config['OCR_JOB_CORES'])
+    cores = cpu_budget.acquire(max_cores, min(app.config['OCR_JOB_MIN_CORES'], max_cores))
+    try:
+        with jobs_lock:
+            job['state'] = 'running'
+            job['started_at'] = time.time()
+            job['cores'] = cores
+            job['attempts'] += 1
+            job['progress']['stage'] = 'starting'
+            job['version'] += 1
+            jobs_changed.notify_all()
+        persist_job(job)
+        if trace is not None:
+            trace.add_span('queued', job['created_at'], dispatched_at, priority=job['priority'])
+            trace.add_span('wait_resources', dispatched_at, job['started_at'], cores=cores, memory_mb=memory_mb)
+        output_path = process_pdf_file(job['input_path'], dict(options, jobs=cores, memory_mb=memory_mb),
+                                       output_path=job_output_path(job),
+                                       progress=JobProgress(job))
+    finally:
+        cpu_budget.release(cores)
+        memory_budget.release(memory_mb)
+        if trace is not None:
+            trace.finish()
+            persist_trace(job)
+    if output_path:
+        record_output_metrics(job, output_path, options.get('optimize_level', 1), input_size)
+    if output_path and two_phase:
+        with jobs_lock:
+            job['optimization'] = 'queued'
+            optimizing_outputs[output_path] = job
+        optimize_queue.put(job['id'])
+    finish_job(job, output_path)
+    return output_path
+
+_search_index = None
+_search_index_lock = threading.Lock()
+
+def get_search_index():
+    """按需打开全文索引，与任务库一样不在gunicorn主进程中打开"""
+    global _search_index
+    with _search_index_lock:
+        if _search_index is None:
+            path = app.config['OCR_SEARCH_DB'] or os.path.join(app.config['UPLOAD_FOLDER'], '.search.sqlite3')
+            _search_index = SearchIndex(path)
+            logging.info(f"全文索引: {path}")
+        return _search_index
+
+def index_job_text(job, output_path, sidecar):
+    """把任务的sidecar文本按页写入全文索引，失败只记录日志
+    
+    sidecar中为空的页面（prescan或 --skip-text 跳过的已有文字层的页面，只有占位文本）
+    从输出PDF的文字层中提取。
+    """
+    try:
+        started = time.monotonic()
+        page_texts = read_sidecar(sidecar, job['progress'].get('pages_total'))
+        blank = [number for number, text in enumerate(page_texts, start=1) if not text.strip()]
+        for number, text in extract_pdf_text(output_path, blank).items():
+            page_texts[number - 1] = text
+        indexed = get_search_index().add_document({
+            'cache_key': job['cache_key'],
+            'job_id': job['id'],
+            'filename': os.path.basename(job['input_path']),
+            'output_path': output_path,
+            'language': job['options'].get('language'),
+            'indexed_at': time.time(),
+        }, page_texts)
+        logging.info(f"任务 {job['id']} 的 {indexed} 页文本已写入全文索引，"
+                     f"耗时 {time.monotonic() - started:.2f} 秒")
+    except (OSError, sqlite3.Error):
+        logging.exception(f"任务 {job['id']} 写入全文索引失败")
+
+def _set_optimization(job, state):
+    with jobs_lock:
+        job['optimization'] = state
+        job['version'] += 1
+        jobs_changed.notify_all()
+    persist_job(job)
+
+def optimize_job_output(job):
+    """第二阶段：按请求的级别优化已完成的结果，成功后原子替换输出文件
+    
+    优化期间下载链接继续返回未优化的文件；替换后新的下载得到优化后的文件，
+    已经打开的下载不受影响。
+    """
+    output_path = job['output_path']
+    temp_path = output_path + '.optimizing'
+    options = {'optimize_level': job['options'].get('optimize_level', 1)}
+    # 优先处理OCR任务，队列中还有任务时等待，最多推迟 OCR_OPTIMIZE_MAX_DEFER 秒
+    deadline = time.monotonic() + app.config['OCR_OPTIMIZE_MAX_DEFER']
+    with jobs_lock:
+        while job_queue.qsize() and not draining.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            jobs_changed.wait(timeout=min(5, remaining))
+    if draining.is_set() or not os.path.exists(output_path):
+        # 服务停止或文件已被清理，保留未优化的结果
+        _set_optimization(job, 'skipped')
+        return
+    _set_optimization(job, 'running')
+    started = time.time()
+    memory_mb = memory_budget.acquire(job['memory_mb'], job['memory_mb'])
+    cores = cpu_budget.acquire(1)
+    try:
+        ok = run_optimizer(output_path, temp_path, dict(options, jobs=cores, memory_mb=memory_mb), nice=OPTIMIZE_NICE)
+    finally:
+        cpu_budget.release(cores)
+        memory_budget.release(memory_mb)
+        if job['trace'] is not None:
+            job['trace'].add_span('background_optimize', started, time.time(),
+                                  optimize_level=options['optimize_level'])
+            persist_trace(job)
+    if ok and os.path.exists(output_path):
+        saved = os.path.getsize(output_path) - os.path.getsize(temp_path)
+        os.replace(temp_path, output_path)
+        observe_output_ratio(_file_size(job['input_path']), output_path, options['optimize_level'])
+        logging.info(f"任务 {job['id']} 后台优化完成，耗时 {time.time() - started:.1f} 秒，"
+                     f"减小 {saved / (1024 * 1024):.2f} MB")
+        _set_optimization(job, 'done')
+    else:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        _set_optimization(job, 'failed')
+
+def _optimize_worker():
+    while True:
+        job_id = optimize_queue.get()
+        job = get_job(job_id)
+        try:
+            if job is not None:
+                optimize_job_output(job)
+        except Exception:
+            logging.exception(f"后台优化任务 {job_id} 时出错")
+            if job is not None:
+                _set_optimization(job, 'failed')
+        finally:
+            if job is not None:
+                with jobs_lock:
+                    optimizing_outputs.pop(job['output_path'], None)
+            optimize_queue.task_done()
+
+def _job_worker():
+    while True:
+        job_id = job_queue.get()
+        job = None
+        try:
+            job = get_job(job_id)
+            if job is not None:
+                run_job(job)
+        except Exception:
+            RUN_FAILURES.inc(cause='exception')
+            logging.exception(f"执行任务 {job_id} 时出错")
+            if job is not None:
+                finish_job(job, None, '任务执行出错，请检查日志获取更多信息。')
+
+def _fail_recovered(job, error):
+    with jobs_lock:
+        job.update(state='failed', error=error, finished_at=time.time())
+        job['progress']['stage'] = 'failed'
+    JOBS_FINISHED.inc(state='failed')
+    persist_job(job)
+    logging.warning(f"任务 {job['id']} 无法恢复: {error}")
+
+def recover_jobs():
+    """接管上次运行时排队中和被中断的任务，重新放入队列
+    
+    运行中被中断的任务可能就是导致服务被杀掉的原因（例如内存不足），
+    尝试次数达到 OCR_JOB_MAX_ATTEMPTS 后不再重试。后台优化被中断的任务
+    重新排队优化。与已重新排队的任务内容和选项相同的任务与 submit_job 一样
+    复用该任务：查询它的ID得到同一个任务，结束时它的记录一起更新。
+    """
+    try:
+        records = get_job_store().claim_unfinished()
+    except sqlite3.Error:
+        logging.exception("读取未完成的任务失败")
+        return
+    requeued = aliased = 0
+    for record in records:
+        job = _job_from_record(record)
+        if record['state'] == 'done':
+            if os.path.exists(job['output_path']):
+                with jobs_lock:
+                    job['optimization'] = 'queued'
+                    jobs[job['id']] = job
+                    optimizing_outputs[job['output_path']] = job
+                optimize_queue.put(job['id'])
+            else:
+                job['optimization'] = 'skipped'
+                persist_job(job)
+            continue
         
-        <script>
-            function switchTab(tabId) {
-                // 隐藏所有标签内容
-                const tabContents = document.querySelectorAll('.tab-content');
-                tabContents.forEach(content => {
-                    content.classList.remove('active');
-                });
-                
-                // 显示选中的标签内容
-                document.getElementById(tabId).classList.add('active');
-                
-                // 更新标签样式
-                const tabs = document.querySelectorAll('.tab');
-                tabs.forEach(tab => {
-                    tab.classList.remove('active');
-                });
-                
-                // 激活当前标签
-                if (tabId === 'upload-tab') {
-                    tabs[0].classList.add('active');
-                } else {
-                    tabs[1].classList.add('active');
-                }
-            }
+        if not os.path.exists(job['input_path']):
+            _fail_recovered(job, '服务重启后输入文件已不存在，请重新上传。')
+            continue
+        if record['state'] == 'running' and job['attempts'] >= app.config['OCR_JOB_MAX_ATTEMPTS']:
+            RUN_FAILURES.inc(cause='interrupted')
+            _fail_recovered(job, f"任务处理中断了 {job['attempts']} 次（可能因内存不足被终止），不再重试。")
+            continue
+        with jobs_lock:
+            running = inflight_jobs.get(job['cache_key'])
+            if running is not None:
+                # 相同内容和选项的任务已经在队列中，该ID指向同一个任务
+                jobs[job['id']] = running
+                job_aliases.setdefault(running['id'], []).append(job)
+            else:
+                job.update(state='queued', started_at=None, cores=None)
+                job['progress']['stage'] = 'queued'
+                jobs[job['id']] = job
+                inflight_jobs[job['cache_key']] = job
+                active_inputs[job['input_path']] = active_inputs.get(job['input_path'], 0) + 1
+        if running is not None:
+            logging.info(f"任务 {job['id']} 与重新排队的任务 {running['id']} 内容和选项相同，复用该任务")
+            aliased += 1
+            continue
+        persist_job(job)
+        job_queue.put(job['id'], job['cost'] or 1, job['client'])
+        requeued += 1
+    if records:
+        logging.info(f"从任务库恢复了 {requeued} 个排队或中断的任务，{aliased} 个重复任务复用了这些任务")
+
+@app.before_request
+def start_background_threads():
+    # 后台线程在第一次请求时启动，gunicorn预加载时只在工作进程中运行
+    start_workers()
+    retention.start()
+
+def start_workers():
+    """按需启动后台工作线程，第一次启动时恢复任务库中未完成的任务"""
+    global _optimizer, _recovered
+    with _workers_lock:
+        while len(_workers) < app.config['OCR_WORKERS']:
+            worker = threading.Thread(target=_job_worker, name=f"ocr-worker-{len(_workers)}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+        if _optimizer is None:
+            _optimizer = threading.Thread(target=_optimize_worker, name="ocr-optimizer", daemon=True)
+            _optimizer.start()
+        recover = not _recovered
+        _recovered = True
+    if recover:
+        recover_jobs()
+        start_hot_folder()
+
+# 优雅停止：收到SIGTERM后不再接受新任务，等待已提交的任务处理完
+draining = threading.Event()
+
+def begin_drain():
+    """停止接受新任务"""
+    if not draining.is_set():
+        draining.set()
+        with jobs_lock:
+            pending = len(inflight_jobs)
+        logging.info(f"服务正在停止，不再接受新任务，等待 {pending} 个任务完成")
+
+def drain_jobs(timeout):
+    """停止接受新任务并等待排队中和运行中的任务完成，超时返回False"""
+    begin_drain()
+    deadline = time.monotonic() + timeout
+    with jobs_lock:
+        while inflight_jobs:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logging.warning(f"等待任务完成超时，仍有 {len(inflight_jobs)} 个任务未完成")
+                return False
+            jobs_changed.wait(remaining)
+    logging.info("所有任务已完成")
+    return True
+
+def client_id():
+    """当前请求的客户端标识，用于公平调度"""
+    header = app.config['OCR_SCHED_CLIENT_HEADER']
+    value = request.headers.get(header) if header else None
+    if value:
+        # X-Forwarded-For 可能包含多级代理，取最初的客户端
+        return value.split(',')[0].strip()
+    return request.remote_addr or 'unknown'
+
+def collect_options(form):
+    """从表单中收集处理选项"""
+    return {
+        'ocr_enabled': 'ocr_enabled' in form,
+        'language': form.get('language', 'eng+chi_sim'),
+        'deskew': 'deskew' in form,
+        'optimize_level': int(form.get('optimize_level', 1)),
+        'rotate_pages': 'rotate_pages' in form,
+        'remove_background': 'remove_background' in form,
+        'force_ocr': 'force_ocr' in form,
+        'fast_preprocess': 'fast_preprocess' in form,
+        'prescan': 'prescan' in form,
+        'fast_first': 'fast_first' in form,
+        'profile': 'profile' in form
+    }
+
+# 文件索引 - 用watchdog监听上传目录，维护内存中的PDF文件列表，避免每次请求都扫描目录
+FILE_LIST_PAGE_SIZE = 50
+OUTPUT_SUFFIX_RE = re.compile(r'(_[0-9a-f]{12})?_ocr\.pdf$', re.IGNORECASE)
+
+# 服务保存的上传文件以内容哈希的前16位开头（见 _commit_upload）
+SAVED_UPLOAD_RE = re.compile(r'^[0-9a-f]{16}_')
+
+def output_source_name(filename):
+    """由输出文件名推出输入文件名，不是输出文件时返回None"""
+    match = OUTPUT_SUFFIX_RE.search(filename)
+    return filename[:match.start()] if match else None
+
+def is_service_artifact(filename):
+    """是否为服务自己创建的文件（保存的上传文件和OCR输出），而不是用户放入上传目录的文件"""
+    return output_source_name(filename) is not None or bool(SAVED_UPLOAD_RE.match(filename))
+
+class FileIndex:
+    """上传目录中PDF文件的内存索引：文件名、大小、修改时间和OCR状态"""
+    
+    def __init__(self, folder):
+        self.folder = folder
+        self.entries = {}       # 输入文件名 -> (大小, 修改时间)
+        self.outputs = {}       # 输入文件名 -> 已存在的输出文件名集合
+        self.usage = {}         # 所有PDF文件名（包括输出）-> (大小, 最近使用时间)
+        self.total_bytes = 0
+        self.artifact_bytes = 0 # 其中服务创建的文件的总大小
+        self._sorted = None     # 按修改时间倒序的文件名，变化后重建
+        self._lock = threading.Lock()
+    
+    def scan(self):
+        """全量扫描目录，只在启动时或没有watchdog时调用"""
+        entries = {}
+        outputs = {}
+        usage = {}
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.name.startswith('.') or not entry.name.lower().endswith('.pdf') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                usage[entry.name] = (stat.st_size, max(stat.st_atime, stat.st_mtime))
+                source = output_source_name(entry.name)
+                if source is not None:
+                    outputs.setdefault(source, set()).add(entry.name)
+                else:
+                    entries[entry.name] = (stat.st_size, stat.st_mtime)
+        with self._lock:
+            self.entries = entries
+            self.outputs = outputs
+            self.usage = usage
+            self.total_bytes = sum(size for size, _ in usage.values())
+            self.artifact_bytes = sum(size for name, (size, _) in usage.items() if is_service_artifact(name))
+            self._sorted = None
+    
+    def update(self, filename):
+        """文件创建、修改或删除后更新单个条目"""
+        if filename.startswith('.') or not filename.lower().endswith('.pdf'):
+            return
+        path = os.path.join(self.folder, filename)
+        try:
+            stat = os.stat(path)
+            exists = os.path.isfile(path)
+        except OSError:
+            exists = False
+        source = output_source_name(filename)
+        artifact = is_service_artifact(filename)
+        with self._lock:
+            old_size = self.usage.pop(filename, (0, 0))[0]
+            new_size = stat.st_size if exists else 0
+            if exists:
+                self.usage[filename] = (stat.st_size, max(stat.st_atime, stat.st_mtime))
+            self.total_bytes += new_size - old_size
+            if artifact:
+                self.artifact_bytes += new_size - old_size
             
-            function selectFile(element, filename) {
-                // 移除所有选中状态
-                const fileItems = document.querySelectorAll('.file-item');
-                fileItems.forEach(item => {
-                    item.classList.remove('selected');
-                });
-                
-                // 选中当前文件
-                element.classList.add('selected');
-                
-                // 设置隐藏的input值
-                document.getElementById('selected_file').value = filename;
-                
-                // 启用处理按钮
-                document.getElementById('process-btn').disabled = false;
-            }
-        </script>
-    </body>
-    </html>
+            if source is not None:
+                # 输出文件只影响对应输入文件的OCR状态
+                names = self.outputs.setdefault(source, set())
+                if exists:
+                    names.add(filename)
+                else:
+                    names.discard(filename)
+            elif exists:
+                if self.entries.get(filename, (None, None))[1] != stat.st_mtime:
+                    self._sorted = None
+                self.entries[filename] = (stat.st_size, stat.st_mtime)
+            elif self.entries.pop(filename, None) is not None:
+                self._sorted = None
+    
+    def touch(self, filename, when):
+        """记录文件最近一次被使用（下载或复用）的时间"""
+        with self._lock:
+            if filename in self.usage:
+                self.usage[filename] = (self.usage[filename][0], when)
+    
+    def least_recently_used(self):
+        """返回按最近使用时间升序排列的 (文件名, 大小, 最近使用时间)"""
+        with self._lock:
+            rows = [(name, size, last_used) for name, (size, last_used) in self.usage.items()]
+        rows.sort(key=lambda row: row[2])
+        return rows
+    
+    def ocr_status(self, filename):
+        with jobs_lock:
+            if os.path.join(self.folder, filename) in active_inputs:
+                return 'processing'
+        return 'done' if self.outputs.get(filename) else 'none'
+    
+    def page(self, page, per_page):
+        """返回按修改时间倒序排列的一页文件"""
+        with self._lock:
+            if self._sorted is None:
+                self._sorted = sorted(self.entries, key=lambda name: self.entries[name][1], reverse=True)
+            names = self._sorted[(page - 1) * per_page:page * per_page]
+            total = len(self._sorted)
+            rows = [(name,) + self.entries[name] for name in names]
+        return {
+            'files': [{'name': name, 'size': size, 'mtime': mtime, 'ocr_status': self.ocr_status(name)}
+                      for name, size, mtime in rows],
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+        }
+
+if FileSystemEventHandler is not None:
+    class _FileIndexHandler(FileSystemEventHandler):
+        def __init__(self, index):
+            self.index = index
+        
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            self.index.update(os.path.basename(event.src_path))
+            dest_path = getattr(event, 'dest_path', None)
+            if dest_path:
+                self.index.update(os.path.basename(dest_path))
+
+_file_index = None
+_file_index_lock = threading.Lock()
+
+def get_file_index():
+    """按需创建文件索引并启动目录监听，没有watchdog时每次请求重新扫描"""
+    global _file_index
+    with _file_index_lock:
+        if _file_index is None:
+            index = FileIndex(app.config['UPLOAD_FOLDER'])
+            if Observer is not None:
+                # 先开始监听再扫描，扫描期间的变化不会丢失
+                observer = Observer()
+                observer.schedule(_FileIndexHandler(index), app.config['UPLOAD_FOLDER'], recursive=False)
+                observer.daemon = True
+                observer.start()
+                index.scan()
+                _file_index = index
+                logging.info(f"文件索引已建立，共 {len(index.entries)} 个PDF文件")
+            else:
+                index.scan()
+                return index
+        return _file_index
+
+# 存储保留策略：按配额、过期时间和磁盘空闲空间清理上传目录中的输入和输出文件，默认都不启用
+app.config['RETENTION_QUOTA_BYTES'] = max(0, get_env_int('RETENTION_QUOTA_BYTES', 0))
+app.config['RETENTION_TTL_SECONDS'] = max(0, get_env_int('RETENTION_TTL_SECONDS', 0))
+app.config['RETENTION_MIN_FREE_BYTES'] = max(0, get_env_int('RETENTION_MIN_FREE_BYTES', 0))
+# 默认只淘汰服务保存的上传文件和OCR输出，设为1时也淘汰用户放入上传目录（例如挂载的目录）的PDF
+app.config['RETENTION_EVICT_USER_FILES'] = get_env_int('RETENTION_EVICT_USER_FILES', 0) == 1
+app.config['RETENTION_SWEEP_INTERVAL'] = max(10, get_env_int('RETENTION_SWEEP_INTERVAL', 300))
+
+class RetentionManager:
+    """按最近下载时间淘汰文件，保证用量不超过配额、磁盘留有空闲空间
+    
+    正在被排队或运行中的任务使用的输入和输出文件不会被删除。默认只淘汰
+    服务创建的文件，配额也只统计这些文件；用户自己放入上传目录的PDF
+    只有在 RETENTION_EVICT_USER_FILES=1 时才会被淘汰和计入配额。
+    """
+    
+    def __init__(self, folder):
+        self.folder = folder
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def _protected_paths(self):
+        with jobs_lock:
+            protected = set(active_inputs)
+            for job in inflight_jobs.values():
+                protected.add(job_output_path(job))
+            protected.update(optimizing_outputs)
+        return protected
+    
+    def _evict(self, should_evict):
+        """按最近使用时间从旧到新删除文件，直到 should_evict 返回False"""
+        index = get_file_index()
+        protected = self._protected_paths()
+        evict_user_files = app.config['RETENTION_EVICT_USER_FILES']
+        freed = 0
+        for name, size, last_used in index.least_recently_used():
+            if not should_evict(name, last_used, freed):
+                break
+            path = os.path.join(self.folder, name)
+            if path in protected or not (evict_user_files or is_service_artifact(name)):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.warning(f"删除文件 {name} 失败: {str(e)}")
+                continue
+            index.update(name)
+            forget_digest(path)
+            freed += size
+            self.evicted_files += 1
+            self.evicted_bytes += size
+            logging.info(f"清理文件 {name}，释放 {size / (1024 * 1024):.1f} MB")
+        return freed
+    
+    def sweep(self):
+        """删除过期文件，并把用量压到配额以内"""
+        with self._lock:
+            ttl = app.config['RETENTION_TTL_SECONDS']
+            if ttl:
+                expire_before = time.time() - ttl
+                self._evict(lambda name, last_used, freed: last_used < expire_before)
+            self._make_room(0)
+        remove_stale_uploads(app.config['RESUMABLE_UPLOAD_TTL'])
+        if app.config['OCR_PAGE_CACHE_MB']:
+            prune_page_cache(app.config['OCR_PAGE_CACHE_DIR'], app.config['OCR_PAGE_CACHE_MB'] * 1024 * 1024)
+    
+    def _make_room(self, incoming_bytes):
+        quota = app.config['RETENTION_QUOTA_BYTES']
+        min_free = app.config['RETENTION_MIN_FREE_BYTES']
+        used = self.used_bytes()
+        free = shutil.disk_usage(self.folder).free
+        over_quota = used + incoming_bytes - quota if quota else 0
+        under_free = min_free + incoming_bytes - free if min_free else 0
+        needed = max(over_quota, under_free)
+        if needed > 0:
+            self._evict(lambda name, last_used, freed: freed < needed)
+    
+    def ensure_capacity(self, incoming_bytes):
+        """为即将写入的数据腾出空间，无法腾出时抛出 JobRejected"""
+        with self._lock:
+            self._make_room(incoming_bytes)
+            usage = self.usage()
+        quota = app.config['RETENTION_QUOTA_BYTES']
+        if quota and usage['used_bytes'] + incoming_bytes > quota:
+            raise JobRejected('存储配额已满，请稍后再试。')
+        if usage['disk_free_bytes'] - incoming_bytes < app.config['RETENTION_MIN_FREE_BYTES']:
+            raise JobRejected('服务器磁盘空间不足，请稍后再试。')
+    
+    def used_bytes(self):
+        """计入配额的用量"""
+        index = get_file_index()
+        return index.total_bytes if app.config['RETENTION_EVICT_USER_FILES'] else index.artifact_bytes
+    
+    def usage(self):
+        disk = shutil.disk_usage(self.folder)
+        return {
+            'used_bytes': self.used_bytes(),
+            'folder_bytes': get_file_index().total_bytes,
+            'evict_user_files': app.config['RETENTION_EVICT_USER_FILES'],
+            'quota_bytes': app.config['RETENTION_QUOTA_BYTES'],
+            'ttl_seconds': app.config['RETENTION_TTL_SECONDS'],
+            'disk_total_bytes': disk.total,
+            'disk_free_bytes': disk.free,
+            'min_free_bytes': app.config['RETENTION_MIN_FREE_BYTES'],
+            'evicted_files': self.evicted_files,
+            'evicted_bytes': self.evicted_bytes,
+        }
+    
+    def _run(self):
+        while True:
+            time.sleep(app.config['RETENTION_SWEEP_INTERVAL'])
+            try:
+                self.sweep()
+            except Exception:
+                logging.exception("清理存储时出错")
+    
+    def start(self):
+        """按需启动定期清理线程"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+                self._thread.start()
+
+retention = RetentionManager(app.config['UPLOAD_FOLDER'])
+
+def page_cache_entries(directory):
+    """页面缓存目录中的文件，返回 [(最近使用时间, 大小, 路径)]"""
+    entries = []
+    try:
+        folders = list(os.scandir(directory))
+    except FileNotFoundError:
+        return entries
+    for folder in folders:
+        if not folder.is_dir():
+            continue
+        for entry in os.scandir(folder.path):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+def prune_page_cache(directory, max_bytes):
+    """页面缓存超过上限时删除最久未使用的条目，降到上限的90%，返回删除后的大小
+    
+    page_cache插件只写入不清理，清理在这里随定期清理进行，不占用OCR进程的时间。
+    同一页的hOCR和文本一起删除。
+    """
+    entries = {}
+    total = 0
+    for last_used, size, path in page_cache_entries(directory):
+        stem = os.path.splitext(path)[0]
+        previous = entries.get(stem, (0, 0, []))
+        entries[stem] = (max(previous[0], last_used), previous[1] + size, previous[2] + [path])
+        total += size
+    if total <= max_bytes:
+        return total
+    target = max_bytes * 0.9
+    for _, size, paths in sorted(entries.values()):
+        if total <= target:
+            break
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+    logging.info(f"页面缓存清理后大小 {total / (1024 * 1024):.0f} MB")
+    return total
+
+def touch_artifact(path):
+    """更新文件的最近使用时间，使其在淘汰顺序中排到后面"""
+    now = time.time()
+    try:
+        os.utime(path, (now, os.stat(path).st_mtime))
+    except OSError:
+        return
+    get_file_index().touch(os.path.basename(path), now)
+
+# 热文件夹
+INGEST_CLIENT = 'ingest'
+# 排队任务已满或磁盘空间不足时，文件留在目录中，隔多少秒再试
+INGEST_RETRY_SECONDS = 30
+
+class HotFolder:
+    """监听投递目录，文件写入完成后移入上传目录并提交任务，完成后把结果写入输出目录
+    
+    文件被接管后即从投递目录中移走，目录中剩下的都是还没有处理的文件，服务重启后
+    继续处理。等待写入输出目录的任务在输出目录的 .pending 中各有一个标记文件，
+    重启后同样继续。处理失败的文件连同错误原因放入输出目录的 failed 中。
+    """
+    
+    def __init__(self, folder, output_folder, settle_seconds, options):
+        self.folder = folder
+        self.output_folder = output_folder
+        self.pending_folder = os.path.join(output_folder, '.pending')
+        self.failed_folder = os.path.join(output_folder, 'failed')
+        self.settle_seconds = settle_seconds
+        # 没有人等待结果，不需要先返回未优化的文件
+        self.options = dict(options, fast_first=False)
+        self._due = {}          # 文件名 -> 到期检查的时间
+        self._seen = {}         # 文件名 -> 最近一次事件时的 (大小, 修改时间)
+        self._deliveries = {}   # 任务ID -> [(标记文件, 原文件名)]
+        self._changed = threading.Condition()
+        for path in (folder, output_folder, self.pending_folder):
+            os.makedirs(path, exist_ok=True)
+    
+    @staticmethod
+    def _wanted(filename):
+        return not filename.startswith('.') and filename.lower().endswith('.pdf')
+    
+    def notify(self, filename, delay=None):
+        """文件有变化，等待稳定期后再检查；期间再有变化则重新计时"""
+        if not self._wanted(filename):
+            return
+        try:
+            stat = os.stat(os.path.join(self.folder, filename))
+            signature = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            signature = None
+        with self._changed:
+            self._seen[filename] = signature
+            self._due[filename] = time.monotonic() + (delay if delay is not None else self.settle_seconds)
+            self._changed.notify()
+    
+    def _run(self):
+        while True:
+            with self._changed:
+                while True:
+                    now = time.monotonic()
+                    due = [name for name, when in self._due.items() if when <= now]
+                    if due:
+                        break
+                    # 没有待检查的文件时一直等待事件，不轮询目录
+                    self._changed.wait(min(self._due.values()) - now if self._due else None)
+                checks = [(name, self._seen.pop(name, None)) for name in due]
+                for name in due:
+                    del self._due[name]
+            for name, signature in checks:
+                try:
+                    self._check(name, signature)
+                except Exception:
+                    logging.exception(f"热文件夹处理 {name} 时出错")
+    
+    def _check(self, name, signature):
+        path = os.path.join(self.folder, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        if not stat.st_size:
+            return  # 刚创建的空文件，写入时还会收到事件
+        if signature is None or (stat.st_size, stat.st_mtime_ns) != signature:
+            # 仍在写入
+            self.notify(name)
+            return
+        if draining.is_set():
+            return  # 留在目录中，重启后处理
+        max_queue = app.config['OCR_MAX_QUEUE']
+        try:
+            if max_queue and job_queue.qsize() >= max_queue:
+                raise JobRejected('排队任务已满')
+            retention.ensure_capacity(2 * stat.st_size)
+        except JobRejected as e:
+            logging.info(f"热文件夹暂缓处理 {name}: {str(e)}")
+            self.notify(name, INGEST_RETRY_SECONDS)
+            return
+        self._ingest(name, path)
+    
+    def _ingest(self, name, path):
+        # 先在目录内改名接管，多个gunicorn工作进程同时监听时只有一个能成功
+        claimed = os.path.join(self.folder, f".ingest-{os.getpid()}-{name}")
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return
+        filename = secure_filename(name)
+        if not filename.lower().endswith('.pdf'):
+            filename = 'ingest.pdf'
+        try:
+            with open(claimed, 'rb') as f:
+                input_path, digest, created = save_stream(f, filename)
+        except BaseException:
+            os.rename(claimed, path)
+            raise
+        os.remove(claimed)
+        
+        marker = os.path.join(self.pending_folder, f"{uuid.uuid4().hex}.json")
+        try:
+            job = submit_job(input_path, self.options, digest=digest, client=INGEST_CLIENT, check_queue_limit=False)
+        except JobRejected as e:
+            self._fail(name, input_path, str(e))
+            return
+        with open(marker, 'w', encoding='utf-8') as f:
+            json.dump({'job_id': job['id'], 'name': name}, f, ensure_ascii=False)
+        INGEST_FILES.inc(result='submitted')
+        logging.info(f"热文件夹提交 {name}: 任务 {job['id']}")
+        self._expect(job, marker, name)
+    
+    def _expect(self, job, marker, name):
+        with jobs_lock:
+            finished = job['state'] in FINISHED_STATES
+            if not finished:
+                self._deliveries.setdefault(job['id'], []).append((marker, name))
+        if finished:
+            self._deliver(job, marker, name)
+    
+    def job_finished(self, job):
+        """任务结束时由 finish_job 调用"""
+        with jobs_lock:
+            deliveries = self._deliveries.pop(job['id'], [])
+        for marker, name in deliveries:
+            try:
+                self._deliver(job, marker, name)
+            except Exception:
+                logging.exception(f"热文件夹写出 {name} 的结果时出错")
+    
+    def _deliver(self, job, marker, name):
+        output_path = job['output_path']
+        if job['state'] == 'done' and output_path and os.path.exists(output_path):
+            stem = os.path.splitext(name)[0]
+            _copy_atomic(output_path, os.path.join(self.output_folder, f"{stem}_ocr.pdf"))
+            INGEST_FILES.inc(result='delivered')
+            touch_artifact(output_path)
+        else:
+            self._fail(name, job['input_path'], job['error'] or '结果文件已被清理')
+        os.remove(marker)
+    
+    def _fail(self, name, input_path, error):
+        os.makedirs(self.failed_folder, exist_ok=True)
+        if os.path.exists(input_path):
+            _copy_atomic(input_path, os.path.join(self.failed_folder, name))
+        with open(os.path.join(self.failed_folder, name + '.error.txt'), 'w', encoding='utf-8') as f:
+            f.write(error + '\n')
+        INGEST_FILES.inc(result='failed')
+        logging.warning(f"热文件夹处理 {name} 失败: {error}")
+    
+    def _load_pending(self):
+        """重启后继续等待上次提交的任务"""
+        for entry in os.scandir(self.pending_folder):
+            try:
+                with open(entry.path, encoding='utf-8') as f:
+                    pending = json.load(f)
+            except (OSError, ValueError):
+                continue
+            job = get_job(pending['job_id'])
+            if job is None:
+                logging.warning(f"热文件夹等待的任务 {pending['job_id']} 不存在: {pending['name']}")
+                os.remove(entry.path)
+                continue
+            self._expect(job, entry.path, pending['name'])
+    
+    def start(self):
+        self._load_pending()
+        threading.Thread(target=self._run, name='hot-folder', daemon=True).start()
+        if Observer is not None:
+            observer = Observer()
+            observer.schedule(_HotFolderHandler(self), self.folder, recursive=False)
+            observer.daemon = True
+            observer.start()
+        else:
+            logging.warning("未安装watchdog，热文件夹每隔一个稳定期扫描一次目录")
+            threading.Thread(target=self._scan_forever, name='hot-folder-scan', daemon=True).start()
+        # 先开始监听再扫描，启动前已经放入的文件也会处理
+        for entry in os.scandir(self.folder):
+            if entry.is_file():
+                self.notify(entry.name)
+        logging.info(f"热文件夹已启动: {self.folder} -> {self.output_folder}")
+    
+    def _scan_forever(self):
+        while True:
+            time.sleep(self.settle_seconds)
+            for entry in os.scandir(self.folder):
+                if entry.is_file() and entry.name not in self._due:
+                    self.notify(entry.name)
+
+def _copy_atomic(source, target):
+    """复制到同目录的临时文件后改名，读取方不会看到写了一半的文件"""
+    temp_path = os.path.join(os.path.dirname(target), f".{os.path.basename(target)}.{uuid.uuid4().hex}.tmp")
+    try:
+        shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+if FileSystemEventHandler is not None:
+    class _HotFolderHandler(FileSystemEventHandler):
+        def __init__(self, folder):
+            self.folder = folder
+        
+        def on_any_event(self, event):
+            if event.is_directory:
+                return
+            # 写入、关闭、移入目录都重新计时
+            for path in (event.src_path, getattr(event, 'dest_path', None)):
+                if path and os.path.dirname(path) == self.folder.folder:
+                    self.folder.notify(os.path.basename(path))
+
+hot_folder = None
+
+def start_hot_folder():
+    """配置了 OCR_INGEST_DIR 时启动热文件夹"""
+    global hot_folder
+    folder = app.config['OCR_INGEST_DIR']
+    if not folder or hot_folder is not None:
+        return
+    if os.path.realpath(folder) == os.path.realpath(app.config['UPLOAD_FOLDER']):
+        logging.error("OCR_INGEST_DIR 不能与上传目录相同，热文件夹未启动")
+        return
+    try:
+        options = collect_options(dict(urllib.parse.parse_qsl(app.config['OCR_INGEST_OPTIONS'],
+                                                             keep_blank_values=True)))
+    except ValueError:
+        logging.error(f"OCR_INGEST_OPTIONS 无效: {app.config['OCR_INGEST_OPTIONS']}，热文件夹未启动")
+        return
+    hot_folder = HotFolder(os.path.abspath(folder), os.path.abspath(app.config['OCR_INGEST_OUTPUT_DIR']),
+                           app.config['OCR_INGEST_SETTLE_SECONDS'], options)
+    hot_folder.start()
+
+FILE_STATUS_TEXT = {'none': '', 'done': ' · 已处理', 'processing': ' · 处理中'}
+
+@app.template_filter('filesize')
+def format_filesize(size):
+    return f"{size / (1024 * 1024):.1f} MB" if size >= 1024 * 1024 else f"{-(-size // 1024)} KB"
+
+# 首页
+@app.route('/')
+def index():
+    # 从文件索引中取第一页PDF文件，其余通过 /api/files 分页加载
+    listing = get_file_index().page(1, FILE_LIST_PAGE_SIZE)
+    return render_template('index.html', listing=listing, status_text=FILE_STATUS_TEXT)
+
+@app.route('/api/files')
+def list_files():
+    """分页返回上传目录中的PDF文件"""
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = max(1, min(request.args.get('per_page', FILE_LIST_PAGE_SIZE, type=int), 500))
+    return jsonify(get_file_index().page(page, per_page))
+
+@app.route('/api/storage')
+def storage_usage():
+    """返回上传目录的存储用量和保留策略"""
+    return jsonify(retention.usage())
+
+@app.route('/api/queue')
+def queue_status():
+    """返回排队任务数和各优先级的排队等待时间"""
+    status = job_queue.stats()
+    status['cores'] = cpu_budget.snapshot()
+    status['memory_mb'] = memory_budget.snapshot()
+    status['streams'] = stream_budget.snapshot()
+    return jsonify(status)
+
+JOB_LIST_MAX_LIMIT = 500
+SEARCH_MAX_LIMIT = 100
+
+def _snippet_html(snippet):
+    """转义摘要文本，命中的词用 <mark> 标出"""
+    return html.escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+@app.route('/search')
+def search():
+    """在已处理文档的OCR文本中搜索，返回命中的文档、页码和摘要"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return "缺少查询参数q", 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), SEARCH_MAX_LIMIT)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    started = time.perf_counter()
+    hits, ranked = get_search_index().search(query, limit, offset)
+    took_ms = (time.perf_counter() - started) * 1000
+    results = []
+    for hit in hits:
+        available = os.path.exists(hit['output_path'])
+        results.append({
+            'filename': hit['filename'],
+            'page': hit['page'],
+            'page_count': hit['page_count'],
+            'snippet': _snippet_html(hit['snippet']),
+            'job_id': hit['job_id'],
+            'download_url': url_for('download', filename=os.path.basename(hit['output_path'])) if available else None,
+        })
+    return jsonify({'query': query, 'ranked': ranked, 'took_ms': round(took_ms, 2), 'offset': offset,
+                    'hits': results})
+
+@app.route('/api/jobs')
+def list_jobs():
+    """按提交时间倒序分页列出任务，可按状态和客户端过滤
+
+    翻页使用上一页返回的 next 游标，查询走任务库的索引，历史任务很多时也不变慢。
     """
-    return html
+    limit = min(max(request.args.get('limit', 50, type=int), 1), JOB_LIST_MAX_LIMIT)
+    before = request.args.get('before')
+    cursor = None
+    if before:
+        created_at, _, job_id = before.partition('_')
+        try:
+            cursor = (float(created_at), job_id)
+        except ValueError:
+            return "游标无效", 400
+    store = get_job_store()
+    records, next_cursor = store.list(state=request.args.get('state'), client=request.args.get('client'),
+                                      before=cursor, limit=limit)
+    with jobs_lock:
+        # 内存中的任务带有实时进度
+        items = [_job_public(jobs.get(record['id']) or _job_from_record(record)) for record in records]
+    listing = {
+        'jobs': items,
+        'next': f"{next_cursor[0]!r}_{next_cursor[1]}" if next_cursor else None,
+    }
+    if cursor is None:
+        listing['counts'] = store.counts()
+    return jsonify(listing)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus格式的运行指标"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/api/page-cache')
+def page_cache_usage():
+    """返回页面OCR缓存的命中率和占用空间"""
+    stats = {'hits': PAGE_CACHE.value(result='hit'), 'misses': PAGE_CACHE.value(result='miss')}
+    lookups = stats['hits'] + stats['misses']
+    entries = page_cache_entries(app.config['OCR_PAGE_CACHE_DIR'])
+    size = sum(entry[1] for entry in entries)
+    files = len(entries)
+    return jsonify({
+        'enabled': bool(app.config['OCR_PAGE_CACHE_MB']),
+        'hits': stats['hits'],
+        'misses': stats['misses'],
+        'hit_ratio': stats['hits'] / lookups if lookups else None,
+        'size_bytes': size,
+        'entries': files // 2,
+        'max_bytes': app.config['OCR_PAGE_CACHE_MB'] * 1024 * 1024,
+    })
 
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    upload_started = time.monotonic()
     # 记录请求内容长度
     content_length = request.content_length
     logging.info(f"收到上传请求，内容长度: {content_length / (1024 * 1024):.2f}MB")
     
+    # 读取请求体之前为输入文件和输出文件预留空间，磁盘或配额不足时拒绝上传
+    try:
+        retention.ensure_capacity(2 * (content_length or 0))
+    except JobRejected as e:
+        return str(e), 503
+    
     # 检查是否有文件被上传
     if 'pdf_file' not in request.files:
         return "没有文件被上传", 400
@@ -510,96 +2761,26 @@ def upload_file():
         return "未选择文件", 400
     
     # 收集处理选项
-    options = {
-        'ocr_enabled': 'ocr_enabled' in request.form,
-        'language': request.form.get('language', 'eng+chi_sim'),
-        'deskew': 'deskew' in request.form,
-        'optimize_level': int(request.form.get('optimize_level', 1)),
-        'rotate_pages': 'rotate_pages' in request.form,
-        'remove_background': 'remove_background' in request.form,
-        'force_ocr': 'force_ocr' in request.form
-    }
+    options = collect_options(request.form)
     
     try:
-        # 保存上传的文件
+        # 保存上传的文件，以内容哈希命名，相同文件只保存一份
         filename = secure_filename(file.filename)
-        temp_input_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{filename}")
-        file.save(temp_input_path)
-        
-        # 处理文件
-        output_path = process_pdf_file(temp_input_path, options)
+        temp_input_path, digest, created = save_upload(file, filename)
+        UPLOAD_SECONDS.observe(time.monotonic() - upload_started)
+        UPLOAD_BYTES.observe(os.path.getsize(temp_input_path))
         
-        if output_path:
-            # 渲染下载页面
-            download_html = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>OCRmyPDF Web 界面 - 下载</title>
-                <meta charset="utf-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1">
-                <style>
-                    body {{
-                        font-family: Arial, sans-serif;
-                        max-width: 600px;
-                        margin: 0 auto;
-                        padding: 20px;
-                        line-height: 1.6;
-                    }}
-                    .header {{
-                        text-align: center;
-                        color: #1E88E5;
-                        margin-bottom: 30px;
-                    }}
-                    .success-msg {{
-                        background-color: #D5F5E3;
-                        padding: 20px;
-                        border-radius: 8px;
-                        margin-bottom: 30px;
-                        text-align: center;
-                    }}
-                    .button {{
-                        display: inline-block;
-                        background-color: #1E88E5;
-                        color: white;
-                        padding: 12px 24px;
-                        text-decoration: none;
-                        border-radius: 4px;
-                        margin: 10px;
-                    }}
-                    .button:hover {{
-                        background-color: #1976D2;
-                    }}
-                    .button-container {{
-                        text-align: center;
-                        margin-top: 30px;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="header">
-                    <h1>OCRmyPDF Web 界面</h1>
-                </div>
-                
-                <div class="success-msg">
-                    <h2>PDF处理成功完成！</h2>
-                    <p>现在您可以下载OCR处理后的文件。</p>
-                </div>
-                
-                <div class="button-container">
-                    <a href="/download/{os.path.basename(output_path)}" class="button">下载处理后的PDF</a>
-                    <a href="/" class="button">处理新文件</a>
-                </div>
-            </body>
-            </html>
-            """
-            return download_html
-        else:
-            # 处理失败，删除临时文件
-            if os.path.exists(temp_input_path):
+        # 提交后台任务，立即返回任务页面
+        try:
+            job = submit_job(temp_input_path, options, digest=digest, remove_input_on_failure=created,
+                             client=client_id())
+        except JobRejected as e:
+            with jobs_lock:
+                input_in_use = temp_input_path in active_inputs
+            if created and not input_in_use:
                 os.remove(temp_input_path)
-            
-            return "PDF处理失败，请检查日志获取更多信息。", 500
+            return str(e), 503
+        return redirect(url_for('job_status', job_id=job['id']), code=303)
     
     except Exception as e:
         logging.exception("上传过程中出错")
@@ -623,93 +2804,496 @@ def process_existing_file():
         return "所选文件不存在", 404
     
     # 收集处理选项
-    options = {
-        'ocr_enabled': 'ocr_enabled' in request.form,
-        'language': request.form.get('language', 'eng+chi_sim'),
-        'deskew': 'deskew' in request.form,
-        'optimize_level': int(request.form.get('optimize_level', 1)),
-        'rotate_pages': 'rotate_pages' in request.form,
-        'remove_background': 'remove_background' in request.form,
-        'force_ocr': 'force_ocr' in request.form
-    }
+    options = collect_options(request.form)
     
     try:
-        # 处理文件
-        output_path = process_pdf_file(file_path, options)
-        
-        if output_path:
-            # 渲染下载页面
-            download_html = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>OCRmyPDF Web 界面 - 下载</title>
-                <meta charset="utf-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1">
-                <style>
-                    body {{
-                        font-family: Arial, sans-serif;
-                        max-width: 600px;
-                        margin: 0 auto;
-                        padding: 20px;
-                        line-height: 1.6;
-                    }}
-                    .header {{
-                        text-align: center;
-                        color: #1E88E5;
-                        margin-bottom: 30px;
-                    }}
-                    .success-msg {{
-                        background-color: #D5F5E3;
-                        padding: 20px;
-                        border-radius: 8px;
-                        margin-bottom: 30px;
-                        text-align: center;
-                    }}
-                    .button {{
-                        display: inline-block;
-                        background-color: #1E88E5;
-                        color: white;
-                        padding: 12px 24px;
-                        text-decoration: none;
-                        border-radius: 4px;
-                        margin: 10px;
-                    }}
-                    .button:hover {{
-                        background-color: #1976D2;
-                    }}
-                    .button-container {{
-                        text-align: center;
-                        margin-top: 30px;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="header">
-                    <h1>OCRmyPDF Web 界面</h1>
-                </div>
-                
-                <div class="success-msg">
-                    <h2>PDF处理成功完成！</h2>
-                    <p>现在您可以下载OCR处理后的文件。</p>
-                </div>
-                
-                <div class="button-container">
-                    <a href="/download/{os.path.basename(output_path)}" class="button">下载处理后的PDF</a>
-                    <a href="/" class="button">处理新文件</a>
-                </div>
-            </body>
-            </html>
-            """
-            return download_html
-        else:
-            # 处理失败
-            return "PDF处理失败，请检查日志获取更多信息。", 500
+        # 为输出文件预留空间，提交后台任务，立即返回任务页面
+        retention.ensure_capacity(os.path.getsize(file_path))
+        job = submit_job(file_path, options, client=client_id())
+        return redirect(url_for('job_status', job_id=job['id']), code=303)
+    
+    except JobRejected as e:
+        return str(e), 503
     
     except Exception as e:
         logging.exception("处理已有文件时出错")
         return f"处理PDF时出错: {str(e)}", 500
 
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """开始一次分块上传，参数为文件名和文件总大小（字节）"""
+    data = request.get_json(silent=True) or request.form
+    filename = secure_filename(data.get('filename') or '')
+    if not filename.lower().endswith('.pdf'):
+        return "文件名无效，只接受PDF文件", 400
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return "缺少文件大小", 400
+    if size <= 0:
+        return "文件大小无效", 400
+    if size > app.config['MAX_CONTENT_LENGTH']:
+        return "文件超过大小上限", 413
+    if draining.is_set():
+        return "服务正在停止，暂不接受新任务", 503
+    
+    # 为输入文件和输出文件预留空间
+    try:
+        retention.ensure_capacity(2 * size)
+    except JobRejected as e:
+        return str(e), 503
+    
+    upload = ResumableUpload.create(filename, size)
+    with uploads_lock:
+        uploads[upload.id] = upload
+    logging.info(f"开始分块上传 {upload.id}: {filename}，大小 {size / (1024 * 1024):.2f}MB")
+    response = jsonify(upload.status())
+    response.status_code = 201
+    response.headers['Location'] = upload.status()['url']
+    return response
+
+def _upload_headers(response, upload):
+    response.headers['Upload-Offset'] = str(upload.offset)
+    response.headers['Upload-Length'] = str(upload.size)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'HEAD', 'PUT', 'DELETE'])
+def resumable_upload(upload_id):
+    """查询已写入的偏移（GET/HEAD）、从偏移处写入一个分块（PUT）或放弃上传（DELETE）
+    
+    PUT 请求用 Upload-Offset 头指明分块的起始位置，必须等于服务端已写入的字节数，
+    否则返回409和当前偏移，客户端据此从断点继续。
+    """
+    upload = get_upload(upload_id)
+    if upload is None:
+        return "上传不存在或已过期", 404
+    
+    if request.method in ('GET', 'HEAD'):
+        return _upload_headers(jsonify(upload.status()), upload)
+    
+    if not upload.lock.acquire(blocking=False):
+        return _upload_headers(Response("该上传正在写入另一个分块", 409), upload)
+    try:
+        if request.method == 'DELETE':
+            with uploads_lock:
+                uploads.pop(upload.id, None)
+            upload.remove()
+            logging.info(f"分块上传 {upload.id} 已取消")
+            return '', 204
+        
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return _upload_headers(Response("缺少Upload-Offset头", 400), upload)
+        if offset != upload.offset:
+            return _upload_headers(jsonify(upload.status()), upload), 409
+        if request.content_length is not None and offset + request.content_length > upload.size:
+            return _upload_headers(Response("分块超出声明的文件大小", 413), upload)
+        
+        upload.write(request.stream, offset)
+        return _upload_headers(jsonify(upload.status()), upload)
+    finally:
+        upload.lock.release()
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    """所有分块写完后提交任务，处理选项与 /upload 的表单相同"""
+    upload = get_upload(upload_id)
+    if upload is None:
+        return "上传不存在或已过期", 404
+    if not upload.lock.acquire(blocking=False):
+        return _upload_headers(Response("该上传正在写入另一个分块", 409), upload)
+    try:
+        if upload.offset != upload.size:
+            return _upload_headers(jsonify(upload.status()), upload), 409
+        
+        options = collect_options(request.form)
+        # 哈希在写入分块时已经算好，不需要重新读取文件
+        digest = upload.sha.hexdigest()
+        input_path, created = _commit_upload(upload.path, digest, upload.filename)
+        os.remove(upload.meta_path)
+        with uploads_lock:
+            uploads.pop(upload.id, None)
+        UPLOAD_SECONDS.observe(time.time() - upload.created_at)
+        UPLOAD_BYTES.observe(upload.size)
+        logging.info(f"分块上传 {upload.id} 完成: {os.path.basename(input_path)}")
+    finally:
+        upload.lock.release()
+    
+    try:
+        job = submit_job(input_path, options, digest=digest, remove_input_on_failure=created,
+                         client=client_id())
+    except JobRejected as e:
+        with jobs_lock:
+            input_in_use = input_path in active_inputs
+        if created and not input_in_use:
+            os.remove(input_path)
+        return str(e), 503
+    return redirect(url_for('job_status', job_id=job['id']), code=303)
+
+# 批量提交：一次上传多个PDF或一个ZIP，共用一组处理选项，结果打包为ZIP边生成边下载
+BATCH_ID_RE = UPLOAD_ID_RE
+BATCH_ERRORS_NAME = 'errors.txt'
+# 结果ZIP还不能下载时建议客户端重试的间隔（秒）
+BATCH_RETRY_AFTER = 10
+
+def _archive_path(name):
+    """去掉上传文件名中的绝对路径和上级目录，保留ZIP内的相对目录"""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return '/'.join(parts)
+
+def _batch_documents(files, archive):
+    """依次返回批量提交中的 (文件名, 可读对象)，ZIP中的文件边解压边读取"""
+    for file in files:
+        yield file.filename, file.stream
+    if archive is not None:
+        with zipfile.ZipFile(archive.stream) as zf:
+            for info in zf.infolist():
+                name = _archive_path(info.filename)
+                # 跳过目录、macOS的资源文件和隐藏文件
+                if info.is_dir() or not name or name.startswith('__MACOSX/') or \
+                        os.path.basename(name).startswith('.'):
+                    continue
+                with zf.open(info) as member:
+                    yield name, member
+
+def _submit_batch_document(index, name, stream, options, client):
+    """保存并提交批量中的一个文件，失败只记录在该文件的条目中"""
+    entry = {'name': name, 'job_id': None, 'error': None}
+    if not name.lower().endswith('.pdf'):
+        entry['error'] = '不是PDF文件'
+        return entry
+    filename = secure_filename(os.path.basename(name))
+    if not filename.lower().endswith('.pdf'):
+        filename = f"batch_{index:04d}.pdf"
+    input_path = None
+    created = False
+    try:
+        input_path, digest, created = save_stream(stream, filename)
+        job = submit_job(input_path, options, digest=digest, remove_input_on_failure=created, client=client,
+                         check_queue_limit=False)
+        entry['job_id'] = job['id']
+    except JobRejected as e:
+        entry['error'] = str(e)
+        with jobs_lock:
+            input_in_use = input_path in active_inputs
+        if created and not input_in_use:
+            os.remove(input_path)
+    except Exception:
+        logging.exception(f"保存批量中的文件 {name} 时出错")
+        entry['error'] = '保存或提交文件时出错'
+    return entry
+
+def _batch_entry_status(entry):
+    status = {'name': entry['name'], 'job_id': entry['job_id'], 'state': 'failed', 'error': entry['error'],
+              'result_url': None}
+    job = get_job(entry['job_id']) if entry['job_id'] else None
+    if job is not None:
+        with jobs_lock:
+            status.update(state=job['state'], error=job['error'])
+            if job['state'] == 'done':
+                status['result_url'] = url_for('job_result', job_id=job['id'])
+    elif entry['job_id']:
+        status['error'] = '任务记录不存在'
+    return status
+
+def _batch_public(batch):
+    entries = [_batch_entry_status(entry) for entry in batch['entries']]
+    counts = {}
+    for entry in entries:
+        counts[entry['state']] = counts.get(entry['state'], 0) + 1
+    return {
+        'id': batch['id'],
+        'created_at': batch['created_at'],
+        'total': len(entries),
+        'counts': counts,
+        'finished': all(entry['state'] in FINISHED_STATES for entry in entries),
+        'result_url': url_for('batch_result', batch_id=batch['id']),
+        'files': entries,
+    }
+
+def get_batch(batch_id):
+    if not BATCH_ID_RE.match(batch_id):
+        return None
+    return get_job_store().get_batch(batch_id)
+
+@app.route('/batches', methods=['POST'])
+def create_batch():
+    """批量提交：多个PDF（可重复的 pdf_files 字段）和/或一个ZIP（zip_file 字段）
+    
+    每个文件成为一个独立的任务，共用表单中的处理选项。单个文件保存或提交失败
+    只记录在该文件的条目中，不影响其他文件。
+    """
+    content_length = request.content_length
+    logging.info(f"收到批量提交请求，内容长度: {(content_length or 0) / (1024 * 1024):.2f}MB")
+    try:
+        retention.ensure_capacity(2 * (content_length or 0))
+    except JobRejected as e:
+        return str(e), 503
+    
+    files = [file for file in request.files.getlist('pdf_files') if file.filename]
+    archive = request.files.get('zip_file')
+    if archive is not None and not archive.filename:
+        archive = None
+    if not files and archive is None:
+        return "没有文件被上传", 400
+    
+    count = len(files)
+    if archive is not None:
+        # 解压前检查文件数和解压后的大小
+        try:
+            with zipfile.ZipFile(archive.stream) as zf:
+                members = [info for info in zf.infolist() if not info.is_dir()]
+        except zipfile.BadZipFile:
+            return "ZIP文件无效", 400
+        count += len(members)
+        try:
+            retention.ensure_capacity(2 * sum(info.file_size for info in members))
+        except JobRejected as e:
+            return str(e), 503
+        archive.stream.seek(0)
+    if count > app.config['OCR_BATCH_MAX_FILES']:
+        return f"一次最多提交 {app.config['OCR_BATCH_MAX_FILES']} 个文件", 413
+    
+    # 整批只检查一次排队上限，批内的文件由公平调度与其他客户端的任务交错执行
+    if draining.is_set():
+        return "服务正在停止，暂不接受新任务，请稍后再试。", 503
+    max_queue = app.config['OCR_MAX_QUEUE']
+    if max_queue and job_queue.qsize() >= max_queue:
+        return "服务器繁忙，排队任务已满，请稍后再试。", 503
+    
+    options = collect_options(request.form)
+    client = client_id()
+    batch = {'id': uuid.uuid4().hex, 'client': client, 'options': options, 'entries': [],
+             'created_at': time.time()}
+    try:
+        for index, (name, stream) in enumerate(_batch_documents(files, archive)):
+            batch['entries'].append(_submit_batch_document(index, name, stream, options, client))
+    except zipfile.BadZipFile as e:
+        # ZIP中途损坏时保留已经提交的文件
+        logging.warning(f"批量提交 {batch['id']} 的ZIP文件损坏: {str(e)}")
+        batch['entries'].append({'name': archive.filename, 'job_id': None, 'error': 'ZIP文件已损坏，之后的文件未提交'})
+    get_job_store().save_batch(batch)
+    submitted = sum(1 for entry in batch['entries'] if entry['job_id'])
+    logging.info(f"批量提交 {batch['id']}: {len(batch['entries'])} 个文件，提交 {submitted} 个任务")
+    
+    response = jsonify(_batch_public(batch))
+    response.status_code = 202
+    response.headers['Location'] = url_for('batch_status', batch_id=batch['id'])
+    return response
+
+@app.route('/batches/<batch_id>')
+def batch_status(batch_id):
+    """批量提交中每个文件的任务状态"""
+    batch = get_batch(batch_id)
+    if batch is None:
+        return "批量任务不存在", 404
+    return jsonify(_batch_public(batch))
+
+class _ZipStream:
+    """只追加的写入缓冲，zipfile写入的数据由生成器取走发送
+    
+    没有 seek 方法，zipfile按不可定位的流处理，在每个文件后写入数据描述符，
+    不需要回头修改文件头，整个ZIP不必先保存在内存或磁盘上。
+    """
+    
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+    
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self._offset
+    
+    def flush(self):
+        pass
+    
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+# 长连接数达到上限时建议客户端重试的间隔（秒）
+STREAM_RETRY_AFTER = 5
+
+def stream_response(route, generate, **kwargs):
+    """返回长时间占用请求线程的流式响应，同时打开的长连接达到 OCR_MAX_STREAMS 时返回503
+    
+    名额在响应关闭时（发送完毕或客户端断开）归还。
+    """
+    if not stream_budget.try_acquire():
+        STREAMS_REJECTED.inc(route=route)
+        return ("服务器繁忙，同时打开的进度和下载连接过多，请稍后再试。", 503,
+                {'Retry-After': str(STREAM_RETRY_AFTER)})
+    response = Response(stream_with_context(generate()), **kwargs)
+    response.call_on_close(lambda: stream_budget.release(1))
+    return response
+
+def _unique_name(name, used):
+    stem, ext = os.path.splitext(name)
+    candidate = name
+    number = 2
+    while candidate in used:
+        candidate = f"{stem} ({number}){ext}"
+        number += 1
+    used.add(candidate)
+    return candidate
+
+@app.route('/batches/<batch_id>/result.zip')
+def batch_result(batch_id):
+    """以ZIP下载批量任务的结果，边打包边发送
+    
+    还有未结束的任务时返回 409 和 Retry-After，不在响应中等待（等待期间没有数据发送，
+    会被代理按空闲超时断开）；?partial=1 时只打包已经完成的文件。失败和未完成的
+    文件及原因写入ZIP末尾的 errors.txt。
+    """
+    batch = get_batch(batch_id)
+    if batch is None:
+        return "批量任务不存在", 404
+    partial = request.args.get('partial') == '1'
+    entries = [(entry, get_job(entry['job_id']) if entry['job_id'] else None) for entry in batch['entries']]
+    if not partial and any(job is not None and job['state'] not in FINISHED_STATES for _, job in entries):
+        return ("批量任务尚未全部处理完成，请稍后再试，或使用 ?partial=1 下载已完成的文件。", 409,
+                {'Retry-After': str(BATCH_RETRY_AFTER)})
+    
+    def generate():
+        stream = _ZipStream()
+        used_names = set()
+        errors = []
+        # PDF压缩率很低，直接存储，不再消耗CPU
+        with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as zf:
+            for entry, job in entries:
+                if job is None:
+                    errors.append((entry['name'], entry['error'] or '任务记录不存在'))
+                    continue
+                if job['state'] not in FINISHED_STATES:
+                    errors.append((entry['name'], '尚未处理完成'))
+                    continue
+                if job['state'] != 'done':
+                    errors.append((entry['name'], job['error']))
+                    continue
+                try:
+                    source = open(job['output_path'], 'rb')
+                except OSError:
+                    errors.append((entry['name'], '结果文件已被清理'))
+                    continue
+                with source:
+                    size = os.fstat(source.fileno()).st_size
+                    stem = os.path.splitext(entry['name'])[0]
+                    info = zipfile.ZipInfo(_unique_name(f"{stem}_processed.pdf", used_names),
+                                           time.localtime()[:6])
+                    with zf.open(info, 'w', force_zip64=size >= zipfile.ZIP64_LIMIT) as target:
+                        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+                            target.write(chunk)
+                            yield stream.take()
+                touch_artifact(job['output_path'])
+                yield stream.take()
+            if errors:
+                zf.writestr(_unique_name(BATCH_ERRORS_NAME, used_names),
+                            ''.join(f"{name}\t{error}\n" for name, error in errors))
+        yield stream.take()
+    
+    return stream_response('batch_result', generate, mimetype='application/zip',
+                           headers={'Content-Disposition': f'attachment; filename="batch_{batch_id}.zip"',
+                                    'X-Accel-Buffering': 'no'})
+
+def render_job_page(job):
+    """渲染任务状态页面，处理中时通过事件流更新进度"""
+    with jobs_lock:
+        snapshot = dict(job)
+    return render_template('job.html', job=snapshot, filename=os.path.basename(job['input_path']))
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """查询任务状态，浏览器返回状态页面，API调用返回JSON"""
+    job = get_job(job_id)
+    if job is None:
+        return "任务不存在", 404
+    
+    with jobs_lock:
+        status = _job_public(job)
+    
+    accept = request.accept_mimetypes
+    if request.args.get('format') == 'json' or accept.best_match(['application/json', 'text/html']) == 'application/json':
+        return jsonify(status)
+    return render_job_page(job)
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """以Server-Sent Events推送任务进度，任务结束后关闭事件流"""
+    job = get_job(job_id)
+    if job is None:
+        return "任务不存在", 404
+    
+    def generate():
+        last_version = None
+        while True:
+            with jobs_lock:
+                if job['version'] == last_version:
+                    jobs_changed.wait(timeout=15)
+                if job['version'] == last_version:
+                    status = None
+                else:
+                    last_version = job['version']
+                    status = _job_public(job)
+            if status is None:
+                # 保持连接，避免被代理超时关闭
+                yield ': keepalive\n\n'
+                continue
+            yield f"data: {json.dumps(status, ensure_ascii=False)}\n\n"
+            if status['state'] in ('done', 'failed'):
+                break
+    
+    return stream_response('job_events', generate, mimetype='text/event-stream',
+                           headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """下载任务的处理结果"""
+    job = get_job(job_id)
+    if job is None:
+        return "任务不存在", 404
+    if job['state'] != 'done':
+        return "任务尚未完成", 409
+    if not os.path.exists(job['output_path']):
+        return "文件不存在", 404
+    
+    touch_artifact(job['output_path'])
+    stem = os.path.splitext(os.path.basename(job['input_path']))[0]
+    return send_file(job['output_path'], as_attachment=True, download_name=f"{stem}_processed.pdf")
+
+@app.route('/jobs/<job_id>/trace.json')
+def job_trace(job_id):
+    """下载任务的处理时间线（Chrome trace格式）
+    
+    内存中有时间线时返回当前记录（处理中的任务也可以查看），否则返回
+    处理结束时写入任务库的时间线。
+    """
+    job = get_job(job_id)
+    if job is None:
+        return "任务不存在", 404
+    if not job['options'].get('profile'):
+        return "该任务未开启性能分析", 404
+    
+    if job['trace'] is not None:
+        with jobs_lock:
+            metadata = _trace_metadata(job)
+        trace = job['trace'].chrome_trace(metadata)
+    else:
+        trace = get_job_store().get_trace(job['id'])
+        if trace is None:
+            return "该任务的时间线已不存在", 404
+        trace['otherData']['state'] = job['state']
+    stem = os.path.splitext(os.path.basename(job['input_path']))[0]
+    response = jsonify(trace)
+    response.headers['Content-Disposition'] = f'attachment; filename="{secure_filename(stem) or "job"}_trace.json"'
+    return response
+
 @app.route('/download/<filename>')
 def download(filename):
     """提供处理后的PDF文件下载"""
@@ -721,6 +3305,7 @@ def download(filename):
             return "文件不存在", 404
         
         # 提供文件下载
+        touch_artifact(file_path)
         return send_file(
             file_path,
             as_attachment=True,
@@ -731,7 +3316,12 @@ def download(filename):
         logging.exception("下载文件时出错")
         return f"下载文件时出错: {str(e)}", 500
 
+# 启动时预编译页面模板，请求中直接使用已编译的模板
+for template_name in ('index.html', 'job.html'):
+    app.jinja_env.get_template(template_name)
+
 if __name__ == "__main__":
+    # 开发服务器，生产环境使用 gunicorn -c gunicorn.conf.py server:app
+    start_workers()
     app.run(host='0.0.0.0', port=5000, debug=False)
-        
 
@@ -0,0 +1,140 @@
+function switchTab(tabId) {
+    // 隐藏所有标签内容
+    const tabContents = document.querySelectorAll('.tab-content');
+    tabContents.forEach(content => {
+        content.classList.remove('active');
+    });
+
+    // 显示选中的标签内容
+    document.getElementById(tabId).classList.add('active');
+
+    // 更新标签样式
+    const tabs = document.querySelectorAll('.tab');
+    tabs.forEach(tab => {
+        tab.classList.remove('active');
+    });
+
+    // 激活当前标签
+    if (tabId === 'upload-tab') {
+        tabs[0].classList.add('active');
+    } else {
+        tabs[1].classList.add('active');
+    }
+}
+
+function formatSize(size) {
+    return size >= 1024 * 1024 ? (size / (1024 * 1024)).toFixed(1) + ' MB' : Math.ceil(size / 1024) + ' KB';
+}
+
+function loadMoreFiles() {
+    const button = document.getElementById('load-more');
+    const page = parseInt(button.dataset.nextPage);
+    fetch('/api/files?page=' + page)
+        .then(response => response.json())
+        .then(listing => {
+            const fileList = document.getElementById('file-list');
+            const statusText = {done: ' · 已处理', processing: ' · 处理中'};
+            listing.files.forEach(entry => {
+                const item = document.createElement('div');
+                item.className = 'file-item';
+                item.dataset.name = entry.name;
+                item.textContent = entry.name + ' (' + formatSize(entry.size) + (statusText[entry.ocr_status] || '') + ')';
+                item.onclick = function () { selectFile(item); };
+                fileList.appendChild(item);
+            });
+            button.dataset.nextPage = page + 1;
+            button.hidden = page * listing.per_page >= listing.total;
+        });
+}
+
+function selectFile(element) {
+    // 移除所有选中状态
+    const fileItems = document.querySelectorAll('.file-item');
+    fileItems.forEach(item => {
+        item.classList.remove('selected');
+    });
+
+    // 选中当前文件
+    element.classList.add('selected');
+
+    // 设置隐藏的input值
+    document.getElementById('selected_file').value = element.dataset.name;
+
+    // 启用处理按钮
+    document.getElementById('process-btn').disabled = false;
+}
+
+// 大文件分块上传，网络中断后从服务端已收到的位置继续
+const RESUMABLE_THRESHOLD = 32 * 1024 * 1024;
+const CHUNK_SIZE = 8 * 1024 * 1024;
+const MAX_RETRIES = 5;
+
+function resumableSubmit(event) {
+    const form = event.target;
+    const file = form.elements['pdf_file'].files[0];
+    if (!file || file.size < RESUMABLE_THRESHOLD || !window.fetch) {
+        return;  // 小文件直接用普通表单上传
+    }
+    event.preventDefault();
+    form.querySelector('input[type=submit]').disabled = true;
+    document.getElementById('upload-progress').hidden = false;
+    uploadInChunks(form, file).catch(error => {
+        document.getElementById('upload-progress-text').textContent = '上传失败: ' + error.message;
+        form.querySelector('input[type=submit]').disabled = false;
+    });
+}
+
+function showUploadProgress(offset, size) {
+    document.getElementById('upload-progress-bar').value = offset / size;
+    document.getElementById('upload-progress-text').textContent =
+        '已上传 ' + formatSize(offset) + ' / ' + formatSize(size);
+}
+
+async function checkResponse(response) {
+    if (!response.ok && response.status !== 409) {
+        throw new Error(await response.text());
+    }
+    return response;
+}
+
+async function uploadInChunks(form, file) {
+    const created = await checkResponse(await fetch('/uploads', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({filename: file.name, size: file.size}),
+    }));
+    const upload = await created.json();
+    let offset = 0;
+    let retries = 0;
+    while (offset < file.size) {
+        showUploadProgress(offset, file.size);
+        try {
+            const response = await checkResponse(await fetch(upload.url, {
+                method: 'PUT',
+                headers: {'Upload-Offset': String(offset)},
+                body: file.slice(offset, offset + CHUNK_SIZE),
+            }));
+            offset = parseInt(response.headers.get('Upload-Offset'));
+            retries = 0;
+        } catch (error) {
+            if (++retries > MAX_RETRIES) {
+                throw error;
+            }
+            // 等待后查询服务端实际收到的位置，从那里继续
+            await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+            const status = await fetch(upload.url, {method: 'HEAD'});
+            if (!status.ok) {
+                throw error;
+            }
+            offset = parseInt(status.headers.get('Upload-Offset'));
+        }
+    }
+    showUploadProgress(file.size, file.size);
+    const options = new FormData(form);
+    options.delete('pdf_file');
+    const response = await fetch(upload.url + '/finalize', {method: 'POST', body: options});
+    if (!response.ok) {
+        throw new Error(await response.text());
+    }
+    window.location = response.url;
+}
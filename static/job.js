@@ -0,0 +1,52 @@
+// 订阅任务进度事件流，任务结束后刷新页面显示结果
+(function () {
+    const page = document.getElementById('job-progress');
+    if (!page) {
+        return;
+    }
+    const stages = {queued: '排队中', starting: '正在启动', prescan: '正在预扫描', ocr: '正在识别', merging: '正在合并分片',
+                    postprocessing: '正在生成PDF', optimizing: '正在优化'};
+    // 服务器长连接已满（503）时事件流无法建立，改为定时查询状态
+    const POLL_INTERVAL = 5000;
+
+    function update(status) {
+        if (status.state === 'done' || status.state === 'failed') {
+            window.location.reload();
+            return true;
+        }
+        const progress = status.progress;
+        document.getElementById('state-text').textContent = (stages[progress.stage] || '正在处理') + '...';
+        if (progress.pages_total) {
+            const bar = document.getElementById('progress-bar');
+            bar.max = progress.pages_total;
+            bar.value = progress.pages_started;
+            document.getElementById('progress-text').textContent =
+                '已开始处理 ' + progress.pages_started + ' / ' + progress.pages_total + ' 页';
+        }
+        return false;
+    }
+
+    function poll() {
+        fetch(window.location.pathname + '?format=json')
+            .then(response => response.ok ? response.json() : null)
+            .then(status => {
+                if (!status || !update(status)) {
+                    setTimeout(poll, POLL_INTERVAL);
+                }
+            })
+            .catch(() => setTimeout(poll, POLL_INTERVAL));
+    }
+
+    const events = new EventSource(page.dataset.eventsUrl);
+    events.onmessage = function (event) {
+        if (update(JSON.parse(event.data))) {
+            events.close();
+        }
+    };
+    events.onerror = function () {
+        // 连接中断时浏览器自动重连；服务器返回错误状态时不再重连
+        if (events.readyState === EventSource.CLOSED) {
+            setTimeout(poll, POLL_INTERVAL);
+        }
+    };
+})();
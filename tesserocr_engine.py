@@ -0,0 +1,166 @@
+"""ocrmypdf插件：在常驻工作进程中复用已初始化的Tesseract API
+
+内置引擎对每一页都启动一次tesseract进程，每次都要从tessdata重新加载
+语言模型，chi_sim的LSTM模型加载时间不可忽略。本插件通过tesserocr为每种
+语言组合缓存初始化好的 PyTessBaseAPI 句柄，超过内存上限时按最近最少使用
+淘汰。只有在同一进程中处理页面时缓存才有意义，因此需要配合常驻工作进程
+和 ocrmypdf 的 use_threads=True 使用。
+
+    OCR_TESSERACT_CACHE_MB  缓存句柄占用内存的上限（按模型文件大小估算），默认1024
+"""
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+from ocrmypdf import hookimpl
+from ocrmypdf.builtin_plugins.tesseract_ocr import TesseractOcrEngine
+
+try:
+    import tesserocr
+except ImportError:  # 未安装时使用ocrmypdf内置的tesseract引擎
+    tesserocr = None
+
+log = logging.getLogger(__name__)
+
+# 模型加载后占用的内存约为traineddata文件大小的倍数
+MODEL_MEMORY_FACTOR = 2
+
+HOCR_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN"
+    "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+ <head>
+  <title></title>
+  <meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>
+  <meta name='ocr-system' content='tesseract {version}' />
+  <meta name='ocr-capabilities' content='ocr_page ocr_carea ocr_par ocr_line ocrx_word ocrp_wconf'/>
+ </head>
+ <body>
+"""
+HOCR_FOOTER = """ </body>
+</html>
+"""
+
+
+def _tessdata_path():
+    return os.environ.get('TESSDATA_PREFIX') or tesserocr.get_languages()[0]
+
+
+class TessApiCache:
+    """按 (语言, OEM, PSM) 缓存空闲的Tesseract API句柄
+
+    并发处理同一语言的多个页面时，每个线程各自取出一个句柄；用完后放回，
+    空闲句柄的估算内存超过上限时淘汰最久未使用的语言组合。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.created = 0
+        self.reused = 0
+        self._idle = OrderedDict()   # 键 -> 空闲句柄列表，按最近使用排序
+        self._sizes = {}             # 键 -> 单个句柄的估算内存
+        self._lock = threading.Lock()
+
+    def _estimate(self, languages):
+        tessdata = _tessdata_path()
+        size = 0
+        for language in languages.split('+'):
+            try:
+                size += os.path.getsize(os.path.join(tessdata, f"{language}.traineddata"))
+            except OSError:
+                pass
+        return size * MODEL_MEMORY_FACTOR
+
+    def checkout(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self._idle.move_to_end(key)
+                self.total_bytes -= self._sizes[key]
+                self.reused += 1
+                return idle.pop()
+        languages, oem, psm = key
+        # tesserocr.OEM / PSM 只是存放整数常量的类，不能实例化，直接传整数
+        api = tesserocr.PyTessBaseAPI(path=_tessdata_path(), lang=languages, oem=oem, psm=psm)
+        with self._lock:
+            self._sizes.setdefault(key, self._estimate(languages))
+            self.created += 1
+        log.debug(f"初始化Tesseract API: {languages}")
+        return api
+
+    def checkin(self, key, api):
+        evicted = []
+        with self._lock:
+            api.Clear()
+            self._idle.setdefault(key, []).append(api)
+            self._idle.move_to_end(key)
+            self.total_bytes += self._sizes[key]
+            while self.total_bytes > self.max_bytes and self._idle:
+                old_key, handles = next(iter(self._idle.items()))
+                if old_key == key and len(self._idle) == 1 and len(handles) == 1:
+                    break  # 至少保留刚用过的句柄
+                evicted.append((old_key, handles.pop(0)))
+                self.total_bytes -= self._sizes[old_key]
+                if not handles:
+                    del self._idle[old_key]
+        for old_key, handle in evicted:
+            log.debug(f"淘汰Tesseract API: {old_key[0]}")
+            handle.End()
+
+
+_cache = TessApiCache(int(os.environ.get('OCR_TESSERACT_CACHE_MB') or 1024) * 1024 * 1024)
+
+
+def requires_cli(options):
+    """选项中有只能通过命令行tesseract实现的设置时返回True
+
+    缓存的API句柄按 (语言, OEM, PSM) 初始化，不会应用自定义配置文件、用户词表和
+    模式、二值化方法和超时设置；这些情况交给内置引擎，结果与命令行一致。
+    """
+    thresholding = getattr(options, 'tesseract_thresholding', None)
+    return bool(getattr(options, 'tesseract_config', None)
+                or getattr(options, 'user_words', None)
+                or getattr(options, 'user_patterns', None)
+                or thresholding not in (None, 0, 'auto')
+                or getattr(options, 'tesseract_timeout', None) == 0)
+
+
+class TesserocrEngine(TesseractOcrEngine):
+    """生成hOCR时使用缓存的Tesseract API，其余功能沿用内置引擎"""
+
+    def __str__(self):
+        return f"Tesseract {self.version()} (tesserocr)"
+
+    @staticmethod
+    def generate_hocr(input_file, output_hocr, output_text, options):
+        if requires_cli(options):
+            return TesseractOcrEngine.generate_hocr(input_file, output_hocr, output_text, options)
+
+        oem = options.tesseract_oem if options.tesseract_oem is not None else tesserocr.OEM.DEFAULT
+        psm = options.tesseract_pagesegmode if options.tesseract_pagesegmode is not None else tesserocr.PSM.AUTO
+        key = ('+'.join(options.languages), int(oem), int(psm))
+        api = _cache.checkout(key)
+        try:
+            api.SetImageFile(str(input_file))
+            api.Recognize()
+            hocr = api.GetHOCRText(0)
+            text = api.GetUTF8Text()
+        finally:
+            _cache.checkin(key, api)
+
+        with open(output_hocr, 'w', encoding='utf-8') as f:
+            f.write(HOCR_HEADER.format(version=tesserocr.tesseract_version().split()[1]))
+            f.write(hocr)
+            f.write(HOCR_FOOTER)
+        with open(output_text, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+@hookimpl
+def get_ocr_engine():
+    if tesserocr is None:
+        log.warning("未安装tesserocr，使用内置tesseract引擎")
+        return None
+    return TesserocrEngine()
@@ -0,0 +1,29 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """导入server模块；导入时创建的日志文件写到临时目录，不使用页面缓存"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('log'))
+    os.environ['OCR_PAGE_CACHE_MB'] = '0'
+    try:
+        import server
+    finally:
+        os.chdir(cwd)
+    return server
+
+
+@pytest.fixture
+def upload_dir(server, tmp_path, monkeypatch):
+    """每个测试使用单独的上传目录"""
+    folder = tmp_path / 'uploads'
+    folder.mkdir()
+    monkeypatch.setitem(server.app.config, 'UPLOAD_FOLDER', str(folder))
+    return folder
@@ -0,0 +1,100 @@
+import io
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def batch(server, tmp_path, monkeypatch):
+    output = tmp_path / 'a_ocr.pdf'
+    output.write_bytes(b'%PDF-1.4 done')
+    jobs = {
+        'a': {'state': 'done', 'output_path': str(output), 'error': None},
+        'b': {'state': 'running', 'output_path': None, 'error': None},
+        'c': {'state': 'failed', 'output_path': None, 'error': 'broken'},
+    }
+    batch = {'id': 'batch', 'entries': [
+        {'name': 'a.pdf', 'job_id': 'a', 'error': None},
+        {'name': 'b.pdf', 'job_id': 'b', 'error': None},
+        {'name': 'c.pdf', 'job_id': 'c', 'error': None},
+        {'name': 'notes.txt', 'job_id': None, 'error': '不是PDF文件'},
+    ]}
+    monkeypatch.setattr(server, 'get_batch', lambda batch_id: batch if batch_id == 'batch' else None)
+    monkeypatch.setattr(server, 'get_job', jobs.get)
+    monkeypatch.setattr(server, 'touch_artifact', lambda path: None)
+    return jobs
+
+
+def read_zip(response):
+    archive = zipfile.ZipFile(io.BytesIO(response.get_data()))
+    return {name: archive.read(name) for name in archive.namelist()}
+
+
+def test_result_conflict_until_all_finished(server, batch):
+    response = server.app.test_client().get('/batches/batch/result.zip')
+    assert response.status_code == 409
+    assert response.headers['Retry-After'] == str(server.BATCH_RETRY_AFTER)
+
+
+def test_partial_result_lists_unfinished(server, batch):
+    response = server.app.test_client().get('/batches/batch/result.zip?partial=1')
+    assert response.status_code == 200
+    files = read_zip(response)
+    assert files['a_processed.pdf'] == b'%PDF-1.4 done'
+    errors = files['errors.txt'].decode().splitlines()
+    assert errors == ['b.pdf\t尚未处理完成', 'c.pdf\tbroken', 'notes.txt\t不是PDF文件']
+
+
+def test_result_after_all_finished(server, batch):
+    batch['b'].update(state='done', output_path=batch['a']['output_path'])
+    response = server.app.test_client().get('/batches/batch/result.zip')
+    assert response.status_code == 200
+    assert sorted(read_zip(response)) == ['a_processed.pdf', 'b_processed.pdf', 'errors.txt']
+
+
+@pytest.mark.parametrize('name, expected', [
+    ('scan.pdf', 'scan.pdf'),
+    ('/etc/passwd.pdf', 'etc/passwd.pdf'),
+    ('../../outside.pdf', 'outside.pdf'),
+    ('a/./b/../c.pdf', 'a/b/c.pdf'),
+    ('C:\\docs\\..\\scan.pdf', 'C:/docs/scan.pdf'),
+    ('../', ''),
+])
+def test_archive_path(server, name, expected):
+    assert server._archive_path(name) == expected
+
+
+def test_unique_name(server):
+    used = set()
+    names = [server._unique_name(name, used) for name in ('a.pdf', 'a.pdf', 'a.pdf', 'errors.txt', 'errors.txt')]
+    assert names == ['a.pdf', 'a (2).pdf', 'a (3).pdf', 'errors.txt', 'errors (2).txt']
+
+
+def test_batch_documents_skip_hidden_and_directories(server):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('docs/', b'')
+        archive.writestr('docs/a.pdf', b'a')
+        archive.writestr('__MACOSX/docs/._a.pdf', b'x')
+        archive.writestr('docs/.hidden.pdf', b'x')
+        archive.writestr('../../escape.pdf', b'b')
+    buffer.seek(0)
+    upload = type('Upload', (), {'stream': buffer})()
+    documents = [(name, stream.read()) for name, stream in server._batch_documents([], upload)]
+    assert documents == [('docs/a.pdf', b'a'), ('escape.pdf', b'b')]
+
+
+def test_batch_document_filenames_are_sanitized(server, monkeypatch):
+    saved = []
+
+    def save_stream(stream, filename):
+        saved.append(filename)
+        return f'/uploads/{filename}', 'digest', True
+
+    monkeypatch.setattr(server, 'save_stream', save_stream)
+    monkeypatch.setattr(server, 'submit_job', lambda *args, **kwargs: {'id': 'job'})
+    entries = [server._submit_batch_document(index, name, io.BytesIO(b''), {}, 'client')
+               for index, name in enumerate(['docs/../a b.pdf', '扫描件.pdf', 'notes.txt'])]
+    # 只剩非ASCII字符的文件名按序号命名
+    assert saved == ['a_b.pdf', 'batch_0001.pdf']
+    assert [entry['error'] for entry in entries] == [None, None, '不是PDF文件']
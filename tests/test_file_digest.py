@@ -0,0 +1,41 @@
+import hashlib
+
+import pytest
+
+
+@pytest.fixture
+def memo(server, monkeypatch):
+    monkeypatch.setattr(server, '_digest_memo', server.OrderedDict())
+    monkeypatch.setattr(server, 'DIGEST_MEMO_SIZE', 2)
+    return server._digest_memo
+
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_digest_memo_is_bounded(server, memo, tmp_path):
+    paths = [write(tmp_path / f'{name}.pdf', name.encode()) for name in 'abc']
+    assert server.file_digest(paths[0]) == hashlib.sha256(b'a').hexdigest()
+    server.file_digest(paths[1])
+    # 最近使用过的 a 保留，最久未使用的 b 被丢弃
+    server.file_digest(paths[0])
+    server.file_digest(paths[2])
+    assert [key[0] for key in memo] == [paths[0], paths[2]]
+
+
+def test_changed_file_is_hashed_again(server, memo, tmp_path):
+    path = write(tmp_path / 'a.pdf', b'old')
+    server.file_digest(path)
+    write(tmp_path / 'a.pdf', b'new content')
+    assert server.file_digest(path) == hashlib.sha256(b'new content').hexdigest()
+
+
+def test_forget_digest(server, memo, tmp_path):
+    path = write(tmp_path / 'a.pdf', b'a')
+    other = write(tmp_path / 'b.pdf', b'b')
+    server.file_digest(path)
+    server.file_digest(other)
+    server.forget_digest(path)
+    assert [key[0] for key in memo] == [other]
@@ -0,0 +1,146 @@
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import pikepdf
+import pytest
+
+from ocr_worker import MemoryWatch, WarmWorker, process_tree, virtual_size
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def blank_pdf(tmp_path):
+    path = tmp_path / 'in.pdf'
+    pdf = pikepdf.new()
+    for _ in range(8):
+        pdf.add_blank_page()
+    pdf.save(path)
+    return str(path)
+
+
+def test_address_space_limit_is_per_process_share(server, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'OCR_MEMORY_AS_FACTOR', 3)
+    monkeypatch.setitem(server.app.config, 'OCR_MEMORY_AS_MIN_MB', 256)
+    assert server.address_space_limit({'memory_mb': 4000, 'jobs': 4}) == 3000 * MB
+    assert server.address_space_limit({'memory_mb': 4000, 'jobs': 1}) == 12000 * MB
+    # 份额很小时不低于最小值
+    assert server.address_space_limit({'memory_mb': 400, 'jobs': 8}) == 256 * MB
+    assert server.address_space_limit({'jobs': 4}) is None
+
+
+def test_rss_limit(server, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'OCR_MEMORY_RSS_PERCENT', 150)
+    assert server.rss_limit({'memory_mb': 1000}) == 1500 * MB
+    monkeypatch.setitem(server.app.config, 'OCR_MEMORY_RSS_PERCENT', 0)
+    assert server.rss_limit({'memory_mb': 1000}) is None
+
+
+def test_plan_reduces_cores_to_fit_budget(server, monkeypatch, blank_pdf):
+    monkeypatch.setitem(server.app.config, 'OCR_SHARD_MIN_PAGES', 0)
+    monkeypatch.setitem(server.app.config, 'OCR_JOB_CORES', 4)
+    monkeypatch.setitem(server.app.config, 'OCR_JOB_MIN_CORES', 1)
+    estimate = lambda cores: server.estimate_job_memory(blank_pdf, {}, cores)
+    monkeypatch.setitem(server.app.config, 'OCR_MEMORY_BUDGET_MB', estimate(2))
+    assert server.plan_job_memory(blank_pdf, {}) == (2, estimate(2))
+    monkeypatch.setitem(server.app.config, 'OCR_MEMORY_BUDGET_MB', estimate(4))
+    assert server.plan_job_memory(blank_pdf, {}) == (4, estimate(4))
+
+
+def test_plan_rejects_when_minimum_does_not_fit(server, monkeypatch, blank_pdf):
+    monkeypatch.setitem(server.app.config, 'OCR_SHARD_MIN_PAGES', 0)
+    monkeypatch.setitem(server.app.config, 'OCR_JOB_MIN_CORES', 1)
+    monkeypatch.setitem(server.app.config, 'OCR_MEMORY_BUDGET_MB', server.estimate_job_memory(blank_pdf, {}, 1) - 1)
+    with pytest.raises(server.JobRejected):
+        server.plan_job_memory(blank_pdf, {})
+
+
+def test_cli_limit_is_set_before_exec(server, monkeypatch):
+    limit = server.address_space_limit({'memory_mb': 4000, 'jobs': 2})
+    check = f"import resource, sys; sys.exit(resource.getrlimit(resource.RLIMIT_AS)[0] != {limit})"
+    monkeypatch.setitem(server.app.config, 'OCR_ENGINE', 'cli')
+    monkeypatch.setitem(server.app.config, 'OCR_MEMORY_RSS_PERCENT', 0)
+    monkeypatch.setattr(server, 'build_ocrmypdf_cmd', lambda *args: [sys.executable, '-c', check])
+    assert server.run_ocrmypdf('in.pdf', 'out.pdf', {'memory_mb': 4000, 'jobs': 2})
+    assert resource.getrlimit(resource.RLIMIT_AS)[0] != limit
+
+
+def test_memory_watch_counts_children_and_kills_tree():
+    # 父进程本身很小，内存在子进程中分配
+    child = "import time; data = bytearray(128 * 1024 * 1024); time.sleep(30)"
+    parent = f"import subprocess, sys; subprocess.run([sys.executable, '-c', {child!r}])"
+    process = subprocess.Popen([sys.executable, '-c', parent])
+    start = time.monotonic()
+    with MemoryWatch(process.pid, 64 * MB, interval=0.1) as watch:
+        process.wait(timeout=20)
+    assert watch.exceeded
+    assert watch.peak > 64 * MB
+    assert time.monotonic() - start < 20
+    assert not process_tree(process.pid)
+
+
+def test_memory_watch_relative_ignores_baseline():
+    process = subprocess.Popen([sys.executable, '-c',
+                                "import time; data = bytearray(96 * 1024 * 1024); time.sleep(0.3); print(flush=True); time.sleep(1)"],
+                               stdout=subprocess.PIPE)
+    process.stdout.readline()
+    with MemoryWatch(process.pid, 64 * MB, interval=0.1, relative=True) as watch:
+        process.wait(timeout=20)
+    assert not watch.exceeded
+    assert process.returncode == 0
+
+
+def test_cache_hit_is_not_subject_to_memory_admission(server, upload_dir, tmp_path, monkeypatch, blank_pdf):
+    from job_store import JobStore
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    monkeypatch.setattr(server, '_job_store', store)
+    output = upload_dir / 'done_ocr.pdf'
+    output.write_bytes(b'%PDF-1.4\n')
+    key = server.make_cache_key('digest', {})
+    monkeypatch.setattr(server, 'result_cache', {key: str(output)})
+    monkeypatch.setattr(server, 'jobs', {})
+    monkeypatch.setitem(server.app.config, 'OCR_MEMORY_BUDGET_MB', 1)
+    monkeypatch.setattr(server, 'measure_pdf', lambda path: pytest.fail('命中缓存时不应读取文件'))
+    job = server.submit_job(blank_pdf, {}, digest='digest')
+    assert job['cached'] and job['output_path'] == str(output)
+    store.close()
+
+
+def test_submit_reads_pdf_once(server, upload_dir, tmp_path, monkeypatch, blank_pdf):
+    from job_store import JobStore
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    monkeypatch.setattr(server, '_job_store', store)
+    for name in ('jobs', 'inflight_jobs', 'active_inputs', 'result_cache'):
+        monkeypatch.setattr(server, name, {})
+    monkeypatch.setattr(server, 'start_workers', lambda: None)
+    monkeypatch.setattr(server.job_queue, 'put', lambda job_id, cost, client: None)
+    opened = []
+    real_open = server.pikepdf.open
+    monkeypatch.setattr(server.pikepdf, 'open', lambda *args, **kwargs: opened.append(args) or real_open(*args, **kwargs))
+    job = server.submit_job(blank_pdf, {}, digest='digest')
+    assert len(opened) == 1
+    assert job['cost'] == 8
+    store.close()
+
+
+def test_warm_worker_limit_is_added_to_baseline():
+    # 模拟已经导入大量模块的常驻工作进程
+    process = subprocess.Popen([sys.executable, '-c', "import sys; data = bytearray(256 * 1024 * 1024); sys.stdin.read()"],
+                               stdin=subprocess.PIPE)
+    try:
+        time.sleep(0.5)
+        worker = WarmWorker.__new__(WarmWorker)
+        worker.process = process
+        baseline = virtual_size(process.pid)
+        assert baseline > 256 * MB
+        worker.set_memory_limit(64 * MB)
+        soft = resource.prlimit(process.pid, resource.RLIMIT_AS)[0]
+        assert baseline + 64 * MB <= soft < baseline + 128 * MB
+        worker.set_memory_limit(None)
+        assert resource.prlimit(process.pid, resource.RLIMIT_AS)[0] == resource.getrlimit(resource.RLIMIT_AS)[1]
+    finally:
+        process.kill()
+        process.wait()
@@ -0,0 +1,53 @@
+def test_cmd_selected_pages(server):
+    cmd = server.build_ocrmypdf_cmd('in.pdf', 'out.pdf', {'pages': [1, 2, 3, 7]})
+    assert cmd[cmd.index('--pages') + 1] == '1-3,7'
+    assert '--skip-text' in cmd
+    assert '--tesseract-timeout' not in cmd
+
+
+def test_cmd_empty_page_list_disables_ocr(server):
+    cmd = server.build_ocrmypdf_cmd('in.pdf', 'out.pdf', {'pages': []})
+    assert '--pages' not in cmd
+    assert cmd[cmd.index('--tesseract-timeout') + 1] == '0'
+    assert '--skip-text' in cmd
+
+
+def test_cmd_without_prescan_ocrs_all_pages(server):
+    cmd = server.build_ocrmypdf_cmd('in.pdf', 'out.pdf', {})
+    assert '--pages' not in cmd
+    assert '--skip-text' not in cmd
+    assert '--tesseract-timeout' not in cmd
+    assert cmd[-2:] == ['in.pdf', 'out.pdf']
+
+
+def test_kwargs_empty_page_list_disables_ocr(server):
+    kwargs = server.build_ocrmypdf_kwargs({'pages': []})
+    assert 'pages' not in kwargs
+    assert kwargs['tesseract_timeout'] == 0
+    assert kwargs['skip_text'] is True
+
+
+def test_kwargs_selected_pages(server):
+    kwargs = server.build_ocrmypdf_kwargs({'pages': [2, 4, 5]})
+    assert kwargs['pages'] == '2,4-5'
+    assert 'tesseract_timeout' not in kwargs
+
+
+def test_debug_log_only_when_profiling(server):
+    cmd = server.build_ocrmypdf_cmd('in.pdf', 'out.pdf', {})
+    assert '-v' not in cmd
+    assert cmd[cmd.index('--plugin') + 1] == server.PROGRESS_PLUGIN
+    cmd = server.build_ocrmypdf_cmd('in.pdf', 'out.pdf', {'profile': True})
+    assert cmd[cmd.index('-v') + 1] == '1'
+    assert 'progress_log' in server.build_ocrmypdf_kwargs({})['plugins']
+
+
+def test_progress_counts_completed_pages(server):
+    job = server._new_job('in.pdf', {}, 'key')
+    progress = server.JobProgress(job)
+    server._track_progress('page-progress: 3/10', progress, 0)
+    assert job['progress']['pages_started'] == 3
+    # 分片的页数从分片第一页的偏移开始计
+    server._track_progress('page-progress: 2/5', progress, 10)
+    server._track_progress('page-progress: 2/5', progress, 10)
+    assert job['progress']['pages_started'] == 5
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('ocrmypdf')
+np = pytest.importorskip('numpy')
+
+from PIL import Image, ImageDraw
+
+import preprocess
+
+DPI = 300
+
+
+def text_block(width=1500, height=1200, background=None):
+    """白纸上的若干行“文字”：每行由宽度不同的深色块组成"""
+    image = Image.new('L', (width, height), 255)
+    if background is not None:
+        image = background
+    draw = ImageDraw.Draw(image)
+    rng = np.random.default_rng(0)
+    for top in range(150, height - 150, 60):
+        left = 150
+        while left < width - 250:
+            word = int(rng.integers(40, 160))
+            draw.rectangle((left, top, left + word, top + 24), fill=20)
+            left += word + 25
+    image.info['dpi'] = (DPI, DPI)
+    return image
+
+
+def test_otsu_threshold_separates_bimodal_histogram():
+    rng = np.random.default_rng(1)
+    dark = rng.normal(50, 10, 2000)
+    light = rng.normal(200, 12, 6000)
+    pixels = np.clip(np.concatenate([dark, light]), 0, 255).astype(np.uint8)
+    threshold = preprocess.otsu_threshold(pixels)
+    # 两个峰之间，落在两类的3倍标准差以外
+    assert 80 < threshold < 164
+    assert np.count_nonzero(pixels < threshold) == pytest.approx(2000, abs=20)
+
+
+def test_otsu_threshold_two_levels():
+    pixels = np.array([40] * 100 + [220] * 300, dtype=np.uint8)
+    threshold = preprocess.otsu_threshold(pixels)
+    assert 40 < threshold <= 220
+    assert np.count_nonzero(pixels < threshold) == 100
+
+
+@pytest.mark.parametrize('angle', [-4.0, 2.5])
+def test_estimate_skew_recovers_rotation(angle):
+    image = text_block().rotate(angle, resample=Image.BILINEAR, expand=True, fillcolor=255)
+    image.info['dpi'] = (DPI, DPI)
+    # 返回使文字行水平需要逆时针旋转的角度，与施加的旋转相反
+    assert preprocess.page_skew(image) == pytest.approx(-angle, abs=0.2)
+
+
+def test_estimate_skew_blank_page():
+    assert preprocess.estimate_skew(np.zeros((400, 400), dtype=bool)) == 0.0
+
+
+def test_clean_image_preserves_size_and_dpi():
+    # 从左到右变暗的纸张背景
+    shade = np.tile(np.linspace(250, 150, 1500), (1200, 1)).astype(np.uint8)
+    image = text_block(background=Image.fromarray(shade, 'L'))
+    result = preprocess.clean_image(image)
+    assert result.size == image.size
+    assert result.mode == 'L'
+    assert result.info['dpi'] == (DPI, DPI)
+    pixels = np.asarray(result)
+    assert set(np.unique(pixels)) <= {0, 255}
+    # 暗背景拉平后不被当作文字
+    assert pixels[:100, -100:].min() == 255
+    assert pixels[150:174, 150:180].max() == 0
+
+
+def test_filter_ocr_image_passes_through_without_flatten_background():
+    image = text_block()
+    page = SimpleNamespace(options=SimpleNamespace(flatten_background=False))
+    assert preprocess.filter_ocr_image(page, image) is image
+    bilevel = image.convert('1')
+    page.options.flatten_background = True
+    assert preprocess.filter_ocr_image(page, bilevel) is bilevel
+    assert preprocess.filter_ocr_image(page, image) is not image
@@ -0,0 +1,43 @@
+import pytest
+
+from job_store import JobStore
+
+
+@pytest.fixture
+def store(server, upload_dir, tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    monkeypatch.setattr(server, '_job_store', store)
+    for name in ('jobs', 'inflight_jobs', 'active_inputs', 'job_aliases', 'result_cache'):
+        monkeypatch.setattr(server, name, {})
+    queued = []
+    monkeypatch.setattr(server.job_queue, 'put', lambda job_id, cost, client: queued.append(job_id))
+    store.queued = queued
+    yield store
+    store.close()
+
+
+def test_recovered_duplicate_follows_inflight_job(server, upload_dir, store):
+    input_path = upload_dir / 'scan.pdf'
+    input_path.write_bytes(b'%PDF-1.4\n')
+    first = server._new_job(str(input_path), {}, 'key')
+    second = server._new_job(str(input_path), {}, 'key')
+    second['state'] = 'running'
+    second['created_at'] = first['created_at'] + 1
+    store.save(first)
+    store.save(second)
+
+    server.recover_jobs()
+    assert store.queued == [first['id']]
+    # 重复任务的ID指向同一个任务，不标记为失败
+    assert server.get_job(second['id']) is server.get_job(first['id'])
+    assert store.get(second['id'])['state'] == 'running'
+
+    output_path = str(upload_dir / 'scan_ocr.pdf')
+    job = server.get_job(first['id'])
+    job['started_at'] = job['created_at']
+    server.finish_job(job, output_path)
+    record = store.get(second['id'])
+    assert record['state'] == 'done'
+    assert record['output_path'] == output_path
+    assert server.job_aliases == {}
+    assert server.active_inputs == {}
@@ -0,0 +1,91 @@
+import hashlib
+
+import pytest
+
+DATA = b'%PDF-1.4\n' + bytes(range(256)) * 4
+
+
+@pytest.fixture
+def client(server, upload_dir, monkeypatch):
+    monkeypatch.setattr(server, 'uploads', {})
+    monkeypatch.setattr(server.retention, 'ensure_capacity', lambda incoming_bytes: None)
+    return server.app.test_client()
+
+
+def create(client, size=len(DATA)):
+    response = client.post('/uploads', json={'filename': 'scan.pdf', 'size': size})
+    assert response.status_code == 201
+    return response.headers['Location']
+
+
+def put(client, url, offset, data):
+    return client.put(url, data=data, headers={'Upload-Offset': str(offset)})
+
+
+def test_offset_mismatch_returns_current_offset(client):
+    url = create(client)
+    assert put(client, url, 0, DATA[:100]).headers['Upload-Offset'] == '100'
+    # 重发已经写入的分块
+    response = put(client, url, 0, DATA[:100])
+    assert response.status_code == 409
+    assert response.headers['Upload-Offset'] == '100'
+    assert response.get_json()['offset'] == 100
+    # 跳过一段数据
+    assert put(client, url, 200, DATA[200:300]).status_code == 409
+    assert client.head(url).headers['Upload-Offset'] == '100'
+
+
+def test_invalid_offset_header(client):
+    url = create(client)
+    assert client.put(url, data=DATA[:10]).status_code == 400
+    assert client.put(url, data=DATA[:10], headers={'Upload-Offset': 'abc'}).status_code == 400
+
+
+def test_chunk_beyond_declared_size(client):
+    url = create(client, size=50)
+    response = put(client, url, 0, DATA[:51])
+    assert response.status_code == 413
+    assert response.headers['Upload-Offset'] == '0'
+
+
+def test_create_rejects_bad_requests(client):
+    assert client.post('/uploads', json={'filename': 'notes.txt', 'size': 10}).status_code == 400
+    assert client.post('/uploads', json={'filename': 'scan.pdf', 'size': 0}).status_code == 400
+    assert client.post('/uploads', json={'filename': 'scan.pdf'}).status_code == 400
+
+
+def test_unknown_upload(client):
+    assert client.head('/uploads/' + '0' * 32).status_code == 404
+    assert client.put('/uploads/../etc', headers={'Upload-Offset': '0'}).status_code == 404
+
+
+def test_finalize_requires_complete_upload(client):
+    url = create(client)
+    put(client, url, 0, DATA[:10])
+    response = client.post(url + '/finalize')
+    assert response.status_code == 409
+    assert response.headers['Upload-Offset'] == '10'
+
+
+def test_resume_after_restart(server, client, upload_dir, monkeypatch):
+    url = create(client)
+    put(client, url, 0, DATA[:300])
+    # 重启后内存中没有上传状态，从磁盘恢复偏移和哈希
+    monkeypatch.setattr(server, 'uploads', {})
+    assert client.head(url).headers['Upload-Offset'] == '300'
+    assert put(client, url, 300, DATA[300:]).get_json()['complete']
+
+    submitted = []
+
+    def submit_job(input_path, options, digest=None, **kwargs):
+        submitted.append((input_path, digest))
+        return {'id': 'job'}
+
+    monkeypatch.setattr(server, 'submit_job', submit_job)
+    response = client.post(url + '/finalize')
+    assert response.status_code == 303
+    [(input_path, digest)] = submitted
+    assert digest == hashlib.sha256(DATA).hexdigest()
+    with open(input_path, 'rb') as f:
+        assert f.read() == DATA
+    assert [path.name for path in upload_dir.iterdir()] == [f"{digest[:16]}_scan.pdf"]
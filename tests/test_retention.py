@@ -0,0 +1,82 @@
+import os
+import time
+
+import pytest
+
+SAVED = '0123456789abcdef_scan.pdf'
+OUTPUT = SAVED + '_0123456789ab_ocr.pdf'
+USER = 'report.pdf'
+
+
+@pytest.fixture
+def folder(server, upload_dir, monkeypatch):
+    old = time.time() - 3600
+    for name, size in ((USER, 300), (SAVED, 200), (OUTPUT, 100)):
+        path = upload_dir / name
+        path.write_bytes(b'0' * size)
+        os.utime(path, (old, old))
+    index = server.FileIndex(str(upload_dir))
+    index.scan()
+    monkeypatch.setattr(server, 'get_file_index', lambda: index)
+    monkeypatch.setattr(server, 'remove_stale_uploads', lambda ttl: None)
+    monkeypatch.setitem(server.app.config, 'RETENTION_QUOTA_BYTES', 0)
+    monkeypatch.setitem(server.app.config, 'RETENTION_MIN_FREE_BYTES', 0)
+    monkeypatch.setitem(server.app.config, 'RETENTION_TTL_SECONDS', 60)
+    monkeypatch.setitem(server.app.config, 'RETENTION_EVICT_USER_FILES', False)
+    return upload_dir
+
+
+def test_is_service_artifact(server):
+    assert server.is_service_artifact(SAVED)
+    assert server.is_service_artifact(OUTPUT)
+    assert server.is_service_artifact('report.pdf_ocr.pdf')
+    assert not server.is_service_artifact(USER)
+
+
+def test_user_files_are_kept_by_default(server, folder):
+    manager = server.RetentionManager(str(folder))
+    assert manager.used_bytes() == 300
+    manager.sweep()
+    assert sorted(os.listdir(folder)) == [USER]
+    assert manager.evicted_bytes == 300
+
+
+def test_quota_counts_only_service_files(server, folder, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'RETENTION_TTL_SECONDS', 0)
+    monkeypatch.setitem(server.app.config, 'RETENTION_QUOTA_BYTES', 250)
+    manager = server.RetentionManager(str(folder))
+    manager.sweep()
+    # 用户文件本身超过配额，但不计入，只需淘汰一个服务文件
+    assert len(os.listdir(folder)) == 2
+    assert USER in os.listdir(folder)
+    manager.ensure_capacity(10)
+
+
+def test_user_files_evicted_when_opted_in(server, folder, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'RETENTION_EVICT_USER_FILES', True)
+    manager = server.RetentionManager(str(folder))
+    assert manager.used_bytes() == 600
+    manager.sweep()
+    assert os.listdir(folder) == []
+
+
+def test_sweep_prunes_page_cache(server, folder, tmp_path, monkeypatch):
+    cache_dir = tmp_path / 'page-cache'
+    now = time.time()
+    for i in range(4):
+        shard = cache_dir / f'{i:02x}'
+        shard.mkdir(parents=True)
+        for suffix in ('.hocr', '.txt'):
+            path = shard / (f'{i:02x}' + suffix)
+            path.write_bytes(b'0' * 256 * 1024)
+            os.utime(path, (now - 100 * (4 - i), now - 100 * (4 - i)))
+    monkeypatch.setitem(server.app.config, 'OCR_PAGE_CACHE_DIR', str(cache_dir))
+    monkeypatch.setitem(server.app.config, 'OCR_PAGE_CACHE_MB', 1)
+    server.RetentionManager(str(folder)).sweep()
+    # 2 MB 压到 0.9 MB 以内，只保留最近使用的条目
+    remaining = sorted(os.path.basename(path) for _, _, path in server.page_cache_entries(str(cache_dir)))
+    assert remaining == ['03.hocr', '03.txt']
+
+
+def test_page_cache_missing_directory(server, tmp_path):
+    assert server.prune_page_cache(str(tmp_path / 'missing'), 1024) == 0
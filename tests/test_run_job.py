@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+from job_store import JobStore
+
+
+@pytest.fixture
+def job(server, upload_dir, tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    monkeypatch.setattr(server, '_job_store', store)
+    monkeypatch.setitem(server.app.config, 'OCR_SEARCH_INDEX', True)
+    input_path = upload_dir / 'scan.pdf'
+    input_path.write_bytes(b'%PDF-1.4\n' + b'0' * 1000)
+    job = server._new_job(str(input_path), {}, 'key')
+    job['memory_mb'] = 1
+    yield job
+    store.close()
+
+
+class Recorder:
+    def __init__(self):
+        self.values = []
+
+    def observe(self, value, **labels):
+        self.values.append(value)
+
+
+def sidecars(upload_dir):
+    return [name for name in os.listdir(upload_dir) if name.startswith('.sidecar-')]
+
+
+def test_input_removed_during_processing(server, upload_dir, job, monkeypatch):
+    def process(input_path, options, output_path, progress):
+        os.remove(input_path)
+        with open(output_path, 'wb') as f:
+            f.write(b'%PDF-1.4\n' + b'0' * 500)
+        return output_path
+
+    finished, indexed = [], []
+    monkeypatch.setattr(server, 'process_pdf_file', process)
+    monkeypatch.setattr(server, 'finish_job', lambda job, output_path: finished.append(output_path))
+    monkeypatch.setattr(server, 'index_job_text', lambda job, output_path, sidecar: indexed.append(sidecar))
+    ratio = Recorder()
+    monkeypatch.setattr(server, 'OUTPUT_RATIO', ratio)
+    server.run_job(job)
+    assert finished == [server.job_output_path(job)]
+    assert len(indexed) == 1
+    # 输入大小在处理前记录，输入被删除后仍能计算输出/输入之比
+    assert ratio.values == [509 / 1009]
+    assert sidecars(upload_dir) == []
+
+
+def test_sidecar_removed_when_processing_raises(server, upload_dir, job, monkeypatch):
+    def process(input_path, options, output_path, progress):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(server, 'process_pdf_file', process)
+    with pytest.raises(RuntimeError):
+        server.run_job(job)
+    assert sidecars(upload_dir) == []
+    assert server.cpu_budget.snapshot()['in_use'] == 0
+
+
+def test_output_ratio_skips_missing_files(server, tmp_path, monkeypatch):
+    ratio = Recorder()
+    monkeypatch.setattr(server, 'OUTPUT_RATIO', ratio)
+    output = tmp_path / 'out.pdf'
+    output.write_bytes(b'0' * 10)
+    server.observe_output_ratio(None, str(output), 2)
+    server.observe_output_ratio(1000, str(tmp_path / 'missing.pdf'), 2)
+    assert ratio.values == []
+
+
+def test_background_optimize_runs_after_max_defer(server, upload_dir, job, monkeypatch):
+    output_path = server.job_output_path(job)
+    with open(output_path, 'wb') as f:
+        f.write(b'%PDF-1.4\n' + b'0' * 500)
+    job.update(output_path=output_path, options={'optimize_level': 2})
+    calls = []
+
+    def optimize(input_path, output_path, options, nice=0):
+        calls.append(options['optimize_level'])
+        with open(output_path, 'wb') as f:
+            f.write(b'%PDF-1.4\n' + b'0' * 100)
+        return True
+
+    monkeypatch.setattr(server, 'run_optimizer', optimize)
+    monkeypatch.setattr(server, 'run_ocrmypdf', lambda *args, **kwargs: pytest.fail('不应重新运行完整的ocrmypdf'))
+    # OCR队列一直不空，等待 OCR_OPTIMIZE_MAX_DEFER 秒后照常优化
+    monkeypatch.setattr(server.job_queue, 'qsize', lambda: 1)
+    monkeypatch.setitem(server.app.config, 'OCR_OPTIMIZE_MAX_DEFER', 0)
+    server.optimize_job_output(job)
+    assert calls == [2]
+    assert job['optimization'] == 'done'
+    assert os.path.getsize(output_path) == 109
+
+
+def test_optimize_cmd_calls_optimizer_directly(server):
+    cmd = server.build_optimize_cmd('in.pdf', 'out.pdf', 3)
+    assert cmd[1:] == ['-m', 'ocrmypdf.optimize', 'in.pdf', 'out.pdf', '3']
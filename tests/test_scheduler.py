@@ -0,0 +1,78 @@
+import pytest
+
+
+@pytest.fixture
+def clock(server, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def make_scheduler(server, aging_seconds=10 ** 9, max_wait=10 ** 9):
+    return server.JobScheduler(aging_seconds, max_wait, small_cost=20, large_cost=200)
+
+
+def drain(scheduler):
+    order = []
+    while scheduler.qsize():
+        order.append(scheduler.get())
+    return order
+
+
+def test_smallest_first_within_client(server, clock):
+    scheduler = make_scheduler(server)
+    for job_id, cost in (('a', 10), ('b', 1), ('c', 5)):
+        scheduler.put(job_id, cost, 'x')
+    assert drain(scheduler) == ['b', 'c', 'a']
+
+
+def test_clients_take_turns(server, clock):
+    scheduler = make_scheduler(server)
+    for index in range(4):
+        scheduler.put(f'a{index}', 10, 'bulk')
+    scheduler.put('b0', 10, 'single')
+    scheduler.put('b1', 10, 'single')
+    assert drain(scheduler) == ['a0', 'b0', 'a1', 'b1', 'a2', 'a3']
+
+
+def test_returning_client_does_not_bank_credit(server, clock):
+    scheduler = make_scheduler(server)
+    for index in range(6):
+        scheduler.put(f'a{index}', 10, 'bulk')
+    assert [scheduler.get() for _ in range(3)] == ['a0', 'a1', 'a2']
+    # 空闲期间没有积累额度，与已在排队的客户端从相同的虚拟时间开始轮流
+    for index in range(3):
+        scheduler.put(f'b{index}', 10, 'late')
+    assert drain(scheduler) == ['a3', 'b0', 'a4', 'b1', 'a5', 'b2']
+
+
+def test_small_jobs_of_other_client_overtake_large_job(server, clock):
+    scheduler = make_scheduler(server)
+    scheduler.put('large', 500, 'x')
+    scheduler.put('small', 5, 'y')
+    assert drain(scheduler) == ['small', 'large']
+
+
+def test_aging_and_max_wait(server, clock):
+    scheduler = make_scheduler(server, aging_seconds=10, max_wait=60)
+    scheduler.put('large', 500, 'x')
+    clock[0] += 61
+    for index in range(3):
+        scheduler.put(f'small{index}', 1, 'y')
+    # 排队超过 max_wait 的任务最先执行
+    assert drain(scheduler)[0] == 'large'
+
+
+def test_stats_by_priority(server, clock):
+    scheduler = make_scheduler(server)
+    scheduler.put('s', 5, 'x')
+    scheduler.put('m', 50, 'x')
+    scheduler.put('l', 500, 'y')
+    stats = scheduler.stats()
+    assert stats['queued'] == 3
+    assert stats['clients'] == {'x': 2, 'y': 1}
+    assert {name: value['queued'] for name, value in stats['classes'].items()} == \
+        {'small': 1, 'medium': 1, 'large': 1}
+    clock[0] += 2
+    assert scheduler.get() == 's'
+    assert scheduler.stats()['classes']['small']['wait_max'] == 2
@@ -0,0 +1,80 @@
+import pytest
+
+import search_index
+from search_index import MATCH_END, MATCH_START, SearchIndex, build_query, read_sidecar, segment, unsegment
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = SearchIndex(str(tmp_path / 'search.sqlite3'))
+    yield index
+    index.close()
+
+
+def add(index, pages, cache_key='key'):
+    document = {'cache_key': cache_key, 'job_id': 'job', 'filename': 'scan.pdf', 'output_path': 'scan_ocr.pdf',
+                'language': 'chi_sim', 'indexed_at': 0}
+    return index.add_document(document, pages)
+
+
+@pytest.mark.parametrize('text', ['PDF 文件', '扫描件 ok', '文件。下一句', '第 3 页', 'plain text'])
+def test_unsegment_restores_spacing(text):
+    assert unsegment(segment(text)).strip() == text
+
+
+def test_unsegment_joins_spaces_between_cjk():
+    # tesseract在汉字之间输出的空格也去掉
+    assert unsegment(segment('扫 描 件')).strip() == '扫描件'
+
+
+def test_build_query_phrases():
+    assert build_query('扫描件 "pdf') == '"扫 描 件" """pdf"'
+    assert build_query('   ') == ''
+
+
+def test_snippet_keeps_latin_spacing(index):
+    add(index, ['这是 PDF 文件 ok', ''])
+    hits, ranked = index.search('文件')
+    assert ranked
+    assert [(hit['page'], hit['snippet']) for hit in hits] == [(1, f'这是 PDF {MATCH_START}文件{MATCH_END} ok')]
+    hits, _ = index.search('pdf')
+    assert hits[0]['snippet'] == f'这是 {MATCH_START}PDF{MATCH_END} 文件 ok'
+
+
+def test_readding_replaces_document(index):
+    assert add(index, ['旧的文本', '']) == 1
+    assert add(index, ['新的文本', '第二页']) == 2
+    assert index.search('旧的')[0] == []
+    assert [hit['page'] for hit in index.search('第二')[0]] == [2]
+
+
+def test_read_sidecar_blanks_skipped_pages(tmp_path):
+    path = tmp_path / 'sidecar.txt'
+    path.write_text('first\f[OCR skipped on page 2]\fthird\f', encoding='utf-8')
+    assert read_sidecar(str(path)) == ['first', '', 'third']
+    assert read_sidecar(str(path), 4) == ['first', '', 'third', '']
+
+
+def test_skipped_pages_indexed_from_text_layer(server, tmp_path, monkeypatch):
+    sidecar = tmp_path / 'sidecar.txt'
+    sidecar.write_text('识别的文本\f[OCR skipped on page 2]\f', encoding='utf-8')
+    index = SearchIndex(str(tmp_path / 'search.sqlite3'))
+    monkeypatch.setattr(server, 'get_search_index', lambda: index)
+    requested = []
+
+    def extract(path, page_numbers):
+        requested.append(page_numbers)
+        return {2: '已有的文字层'}
+
+    monkeypatch.setattr(server, 'extract_pdf_text', extract)
+    job = server._new_job(str(tmp_path / 'scan.pdf'), {}, 'key')
+    job['progress']['pages_total'] = 2
+    server.index_job_text(job, str(tmp_path / 'scan_ocr.pdf'), str(sidecar))
+    assert requested == [[2]]
+    assert [hit['page'] for hit in index.search('文字层')[0]] == [2]
+    index.close()
+
+
+def test_extract_pdf_text_without_pdfminer(monkeypatch):
+    monkeypatch.setattr(search_index, 'extract_pages', None)
+    assert search_index.extract_pdf_text('missing.pdf', [1]) == {}
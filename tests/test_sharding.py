@@ -0,0 +1,101 @@
+import pikepdf
+import pytest
+
+
+def make_pdf(path, pages):
+    with pikepdf.new() as pdf:
+        for _ in range(pages):
+            pdf.add_blank_page()
+        # 页码标签和文档信息常以直接对象出现
+        pdf.Root.PageLabels = pikepdf.Dictionary(Nums=pikepdf.Array([0, pikepdf.Dictionary(S=pikepdf.Name.r)]))
+        pdf.docinfo = pdf.make_indirect(pikepdf.Dictionary(Title=pikepdf.String('source')))
+        with pdf.open_outline() as outline:
+            outline.root.append(pikepdf.OutlineItem('last', pages - 1))
+        pdf.save(path)
+
+
+def fake_ocrmypdf(calls):
+    """代替ocrmypdf：复制输入，并像PDF/A输出一样写入直接对象形式的根字典项"""
+
+    def run(input_path, output_path, options, progress=None, page_offset=0, nice=0):
+        calls.append((page_offset, options.get('pages')))
+        with pikepdf.open(input_path) as pdf:
+            profile = pdf.make_stream(b'icc profile')
+            pdf.Root.OutputIntents = pikepdf.Array([pikepdf.Dictionary(
+                Type=pikepdf.Name.OutputIntent, S=pikepdf.Name.GTS_PDFA1, DestOutputProfile=profile)])
+            pdf.Root.MarkInfo = pikepdf.Dictionary(Marked=True)
+            pdf.Root.Lang = pikepdf.String('en-US')
+            pdf.Root.Metadata = pdf.make_stream(b'<x:xmpmeta/>', Type=pikepdf.Name.Metadata)
+            pdf.save(output_path)
+        if options.get('sidecar'):
+            with open(options['sidecar'], 'w', encoding='utf-8') as f:
+                f.write(''.join(f"text {page_offset + n}\f" for n in range(1, 3)))
+        return True
+
+    return run
+
+
+@pytest.fixture
+def sharding(server, upload_dir, monkeypatch):
+    monkeypatch.setitem(server.app.config, 'OCR_SHARD_PAGES', 2)
+    calls = []
+    monkeypatch.setattr(server, 'run_ocrmypdf', fake_ocrmypdf(calls))
+    return calls
+
+
+def test_merge_copies_direct_root_entries(server, upload_dir, sharding):
+    source = str(upload_dir / 'in.pdf')
+    output = str(upload_dir / 'out.pdf')
+    make_pdf(source, 5)
+
+    assert server.process_sharded(source, output, {'jobs': 2}, 5)
+
+    with pikepdf.open(output) as merged:
+        assert len(merged.pages) == 5
+        assert bool(merged.Root.MarkInfo.Marked) is True
+        assert str(merged.Root.Lang) == 'en-US'
+        intent = merged.Root.OutputIntents[0]
+        assert intent.DestOutputProfile.read_bytes() == b'icc profile'
+        assert '/Metadata' in merged.Root
+        assert merged.Root.PageLabels.Nums[1].S == pikepdf.Name.r
+        with merged.open_outline() as outline:
+            assert outline.root[0].title == 'last'
+    assert len(sharding) == 3
+
+
+def test_merge_concatenates_sidecars(server, upload_dir, sharding):
+    source = str(upload_dir / 'in.pdf')
+    sidecar = str(upload_dir / 'out.txt')
+    make_pdf(source, 4)
+
+    assert server.process_sharded(source, str(upload_dir / 'out.pdf'), {'sidecar': sidecar}, 4)
+
+    with open(sidecar, encoding='utf-8') as f:
+        assert f.read().split('\f')[:4] == ['text 1', 'text 2', 'text 3', 'text 4']
+
+
+def test_shards_without_ocr_pages_are_not_run(server, upload_dir, sharding):
+    source = str(upload_dir / 'in.pdf')
+    sidecar = str(upload_dir / 'out.txt')
+    make_pdf(source, 5)
+
+    assert server.process_sharded(source, str(upload_dir / 'out.pdf'), {'pages': [4], 'sidecar': sidecar}, 5)
+
+    # 只有第3、4页所在的分片需要运行，页码换算为分片内的页码
+    assert sharding == [(2, [2])]
+    with open(sidecar, encoding='utf-8') as f:
+        pages = f.read().split('\f')
+    assert pages[:2] == ['', '']
+    assert pages[2:4] == ['text 3', 'text 4']
+
+
+def test_prescan_without_ocr_pages_skips_ocrmypdf(server, upload_dir, sharding):
+    source = str(upload_dir / 'blank.pdf')
+    make_pdf(source, 3)
+
+    output = server.process_pdf_file(source, {'prescan': True, 'optimize_level': 1})
+
+    assert output == source + '_ocr.pdf'
+    assert sharding == []
+    with pikepdf.open(output) as pdf:
+        assert len(pdf.pages) == 3
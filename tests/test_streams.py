@@ -0,0 +1,29 @@
+def test_streams_beyond_limit_are_rejected(server, monkeypatch):
+    monkeypatch.setattr(server, 'stream_budget', server.ResourceBudget(1))
+    generate = lambda: iter(['data: {}\n\n'])
+    with server.app.test_request_context():
+        first = server.stream_response('job_events', generate, mimetype='text/event-stream')
+        body, status, headers = server.stream_response('job_events', generate, mimetype='text/event-stream')
+    assert first.status_code == 200
+    assert status == 503
+    assert headers['Retry-After'] == str(server.STREAM_RETRY_AFTER)
+    assert server.STREAMS_REJECTED.value(route='job_events') >= 1
+
+
+def test_stream_slot_released_on_close(server, monkeypatch):
+    monkeypatch.setattr(server, 'stream_budget', server.ResourceBudget(1))
+    with server.app.test_request_context():
+        response = server.stream_response('batch_result', lambda: iter([b'PK']), mimetype='application/zip')
+    assert server.stream_budget.snapshot()['in_use'] == 1
+    # 客户端断开时响应未读完也会关闭
+    response.close()
+    assert server.stream_budget.snapshot()['in_use'] == 0
+    with server.app.test_request_context():
+        assert server.stream_response('batch_result', lambda: iter([b'PK'])).status_code == 200
+
+
+def test_missing_job_does_not_take_stream_slot(server, monkeypatch):
+    monkeypatch.setattr(server, 'stream_budget', server.ResourceBudget(1))
+    monkeypatch.setattr(server, 'get_job', lambda job_id: None)
+    assert server.app.test_client().get('/jobs/missing/events').status_code == 404
+    assert server.stream_budget.snapshot()['in_use'] == 0
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('ocrmypdf')
+tesserocr = pytest.importorskip('tesserocr')
+
+import tesserocr_engine
+
+
+def test_checkout_passes_integer_modes(monkeypatch):
+    created = []
+
+    class FakeApi:
+        def __init__(self, **kwargs):
+            created.append(kwargs)
+
+    monkeypatch.setattr(tesserocr, 'PyTessBaseAPI', FakeApi)
+    cache = tesserocr_engine.TessApiCache(1 << 30)
+
+    cache.checkout(('eng', 1, 3))
+
+    assert created[0]['oem'] == 1
+    assert created[0]['psm'] == 3
+    assert created[0]['lang'] == 'eng'
+
+
+def options(**overrides):
+    values = dict(languages=['eng'], tesseract_oem=1, tesseract_pagesegmode=None, tesseract_config=[],
+                  tesseract_thresholding=0, tesseract_timeout=180, user_words=None, user_patterns=None)
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+
+@pytest.mark.parametrize('overrides', [
+    {'tesseract_config': ['hocr']},
+    {'user_words': 'words.txt'},
+    {'user_patterns': 'patterns.txt'},
+    {'tesseract_thresholding': 2},
+    {'tesseract_thresholding': 'sauvola'},
+    {'tesseract_timeout': 0},
+])
+def test_cli_only_options_use_stock_engine(monkeypatch, overrides):
+    calls = []
+    monkeypatch.setattr(tesserocr_engine.TesseractOcrEngine, 'generate_hocr',
+                        staticmethod(lambda *args: calls.append(args)))
+    monkeypatch.setattr(tesserocr_engine._cache, 'checkout', lambda key: pytest.fail('不应使用缓存的API'))
+    tesserocr_engine.TesserocrEngine.generate_hocr('in.png', 'out.hocr', 'out.txt', options(**overrides))
+    assert len(calls) == 1
+
+
+def test_default_options_use_cached_api():
+    assert not tesserocr_engine.requires_cli(options())
+    assert not tesserocr_engine.requires_cli(options(tesseract_thresholding='auto'))
@@ -0,0 +1,50 @@
+import time
+
+import pytest
+
+from job_store import JobStore
+
+
+@pytest.fixture
+def store(server, tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path / 'jobs.sqlite3'))
+    monkeypatch.setattr(server, '_job_store', store)
+    yield store
+    store.close()
+
+
+def test_trace_served_after_restart(server, store, tmp_path, monkeypatch):
+    job = server._new_job(str(tmp_path / 'scan.pdf'), {'profile': True}, 'key')
+    now = time.time()
+    job['trace'].add_span('ocrmypdf', now, now + 1)
+    job['state'] = 'done'
+    server.persist_job(job)
+    server.persist_trace(job)
+
+    # 重启后从任务库重建的已结束任务没有内存中的时间线
+    restored = server._job_from_record(JobStore(store.path).get(job['id']))
+    assert restored['trace'] is None
+    monkeypatch.setattr(server, 'get_job', lambda job_id: restored if job_id == job['id'] else None)
+    response = server.app.test_client().get(f"/jobs/{job['id']}/trace.json")
+    assert response.status_code == 200
+    trace = response.get_json()
+    assert [event['name'] for event in trace['traceEvents'] if event['ph'] == 'X'] == ['ocrmypdf']
+    assert trace['otherData']['state'] == 'done'
+    with server.app.test_request_context():
+        assert server._job_public(restored)['trace_url'] == f"/jobs/{job['id']}/trace.json"
+        # 状态页面按选项显示时间线链接，不依赖内存中的时间线
+        assert f"/jobs/{job['id']}/trace.json" in server.render_job_page(restored)
+
+
+def test_trace_missing_without_profile(server, store, monkeypatch):
+    job = server._new_job('scan.pdf', {}, 'key')
+    monkeypatch.setattr(server, 'get_job', lambda job_id: job)
+    assert server.app.test_client().get(f"/jobs/{job['id']}/trace.json").status_code == 404
+
+
+def test_job_page_without_profile_has_no_trace_link(server, tmp_path):
+    job = server._new_job(str(tmp_path / 'scan.pdf'), {}, 'key')
+    job['state'] = 'done'
+    job['output_path'] = str(tmp_path / 'scan_ocr.pdf')
+    with server.app.test_request_context():
+        assert 'trace.json' not in server.render_job_page(job)